@@ -1,169 +1,493 @@
-# needed for implementing Match.equals method. RPython doesn't support sets. 
-def string_set_intersection(dict_a, dict_b):
-    intersection = {}
-    for key in dict_a.keys():
-        if key in dict_b:
-            intersection[key] = None
-    return intersection
-
-def make_string_set(keys):
-    stringset = {}
-    for k in keys:
-        stringset[k] = None
-    return stringset
+# Bindings are persistent - operations on Binding return a new Binding and never modify existing one.
+# Matches can be branched (e.g. when matching ellipsis non-deterministically) by copying 
+# the array of bindings, bound terms are shared and never copied.
+class BindingElements:
+    # persistent list of terms bound at a single ellipsis depth, most recently added term first.
+    def __init__(self, term, rest, length):
+        self.term = term
+        self.rest = rest
+        self.length = length
+
+class BindingLevel:
+    # Sequence of terms being matched at some ellipsis depth and the level enclosing it. 
+    def __init__(self, elements, below):
+        self.elements = elements
+        self.below = below
+        self.sequence = None
+
+    def length(self):
+        if self.elements is None:
+            return 0
+        return self.elements.length
+
+    def tosequence(self):
+        # levels are immutable, materialized sequence is cached.
+        if self.sequence is None:
+            seq = [None] * self.length()
+            elements = self.elements
+            i = self.length() - 1
+            while elements is not None:
+                seq[i] = elements.term
+                elements = elements.rest
+                i -= 1
+            self.sequence = Sequence(seq)
+        return self.sequence
+
+    def add(self, term):
+        return BindingLevel(BindingElements(term, self.elements, self.length() + 1), self.below)
 
 class Binding:
-    def __init__(self, var):
-        self.var = var
-        self.buf = []
+    def __init__(self, value=None, top=None):
+        # term bound at ellipsis depth 0.
+        self.value = value
+        # innermost level of sequences being matched.
+        self.top = top
 
     def add(self, value):
-        # if stack is empty, add value
+        # if stack is empty, bind value
         # if stack is not empty and not a compoundarray, raise exception
         # if stack is not empty and is compoundarray, add value to the array.
-        if len(self.buf) == 0:
-            self.buf.append(value)
-        else:
-            if self.buf[-1].kind() != TermKind.Sequence:
+        if self.top is None:
+            if self.value is not None:
                 assert False, 'not compound array'
-            else:
-                self.buf[-1].append(value)
+            return Binding(value, None)
+        return Binding(None, self.top.add(value))
 
     def increasedepth(self):
         # preceding element must be compound array, raise exception otherwise.
-        if len(self.buf) != 0:
-            if self.buf[-1].kind() != TermKind.Sequence: 
-                assert False, 'previous element is not compoundarray'
-        self.buf.append( Sequence([]) )
+        if self.value is not None: 
+            assert False, 'previous element is not compoundarray'
+        return Binding(None, BindingLevel(None, self.top))
 
     def decreasedepth(self):
         # if stack is empty, raise exception
-        # if stack size is 1 and topmost element is not compoundarray raise exception.
-        # if stack size is 1 and topmost element is compoundarray do nothing.
-        # if stack size > 1, pop topmost element and append it to element below. ( works because increasedepth must be called beforehand)
-        if len(self.buf) == 0: 
+        # if stack size is 1 do nothing.
+        # if stack size > 1, materialize topmost sequence and add it to sequence below.
+        if self.top is None: 
             assert False, 'empty stack'
-        if len(self.buf) == 1 :
-            if self.buf[-1].kind() != TermKind.Sequence: 
-                assert False, 'previous element is not compoundarray'
-            else:
-                return
-        top = self.buf.pop()
-        self.buf[-1].append(top)
+        if self.top.below is None:
+            return self
+        return Binding(None, self.top.below.add(self.top.tosequence()))
+
+    def current(self):
+        # topmost element of the stack.
+        if self.top is None:
+            assert self.value is not None, 'empty stack'
+            return self.value
+        return self.top.tosequence()
 
     def getbinding(self):
-        assert len(self.buf) == 1, 'incomplete match!'
-        return self.buf[0]
+        if self.top is None:
+            assert self.value is not None, 'incomplete match!'
+            return self.value
+        assert self.top.below is None, 'incomplete match!'
+        return self.top.tosequence()
 
     def equals(self, other):
         return self.getbinding().equals(other.getbinding())
 
     def deepcopy(self):
-        copyof = Binding(self.var)
-        for elem in self.buf:
-            copyof.buf.append( elem.deepcopy() )
-        return copyof
+        return self
     
-class Match:
-    def __init__(self, identifiers=[]): 
-        self.bindings = {} 
-        for ident in identifiers:
-            self.bindings[ident] = Binding(ident)
+emptybinding = Binding()
 
-    def create_binding(self, var):
-        assert var not in self.bindings.keys()
-        self.bindings[var] = Binding(var)
+# Pattern variables are numbered at compile-time and each Match stores bindings in an array indexed by 
+# that number (slot). Layout of the array is shared by all matches produced by the pattern. Slots that 
+# are not visible hold temporary bindings needed for constraint checking and are not part of the match.
+class MatchLayout:
+    def __init__(self, names, visible):
+        assert len(names) == len(visible)
+        self.names = names
+        self.visible = visible
 
-    def increasedepth(self, var):
-        self.bindings[var].increasedepth()
+emptymatchlayout = MatchLayout([], [])
 
-    def decreasedepth(self, var):
-        self.bindings[var].decreasedepth()
+class Match:
+    def __init__(self, layout=emptymatchlayout): 
+        self.layout = layout
+        self.bindings = [emptybinding] * len(layout.names)
+
+    def emptycopy(self):
+        return Match(self.layout)
 
-    def addtobinding(self, var, val):
-        self.bindings[var].add(val)
+    def increasedepth(self, slot):
+        self.bindings[slot] = self.bindings[slot].increasedepth()
 
-    def removebinding(self, var):
-        self.bindings.pop(var, None)
+    def decreasedepth(self, slot):
+        self.bindings[slot] = self.bindings[slot].decreasedepth()
 
-    def comparekeys(self, var1, var2):
-        binding1 = self.bindings[var1]
-        binding2 = self.bindings[var2]
-        assert len(binding1.buf) > 0
-        assert len(binding2.buf) > 0
-        return binding1.buf[-1].equals(binding2.buf[-1])
+    def addtobinding(self, slot, val):
+        self.bindings[slot] = self.bindings[slot].add(val)
 
-    def getbinding(self, sym):
-        return self.bindings[sym].getbinding()
+    def comparekeys(self, slot1, slot2):
+        binding1 = self.bindings[slot1]
+        binding2 = self.bindings[slot2]
+        return terms_equal(binding1.current(), binding2.current())
+
+    def getbinding(self, slot):
+        return self.bindings[slot].getbinding()
 
     def equals(self, other):
         if isinstance(other, Match):
-            if len(self.bindings) == len(other.bindings):
-                lkeys = make_string_set(self.bindings.keys())
-                rkeys = make_string_set(other.bindings.keys())
-                intersection = string_set_intersection(lkeys, rkeys)
-                if len(lkeys) == len(intersection):
-                    for key in lkeys:
-                        if not self.bindings[key].equals(other.bindings[key]):
+            if self.layout is other.layout:
+                for slot in range(len(self.bindings)):
+                    if self.layout.visible[slot]:
+                        if not self.bindings[slot].equals(other.bindings[slot]):
                             return False
-                    return True
+                return True
         return False
 
     def deepcopy(self):
-        # import copy
-        #a = copy.deepcopy(self.bindings)
-        #m = Match([])
-        #m.bindings = a
-        copyof = Match() 
-        for name, binding in self.bindings.items():
-            copyof.bindings[name] = binding.deepcopy()
+        # bindings are persistent and thus can be shared, O(number of bindings).
+        copyof = Match(self.layout) 
+        for slot in range(len(self.bindings)):
+            copyof.bindings[slot] = self.bindings[slot]
         return copyof
 
     def tostring(self):
-        ## FIXME won't compile under RPython
         string = ''
-        if len(self.bindings) > 0:
-            for key in self.bindings:
-                value = self.bindings[key]
-                s = '%s=%s, ' % (key, value.getbinding().tostring())
+        for slot in range(len(self.bindings)):
+            if self.layout.visible[slot]:
+                value = self.bindings[slot]
+                s = '%s=%s, ' % (self.layout.names[slot], value.getbinding().tostring())
                 string = string + s
         return 'Match(%s)' % string
 
-    def combine_with(self, other):
-        assert isinstance(other, Match)
-        lkeys = make_string_set(self.bindings.keys())
-        rkeys = make_string_set(other.bindings.keys())
-        intersection = string_set_intersection(lkeys, rkeys)
-        assert len(intersection) == 0
-        self.bindings.update(other.bindings)
-
-def combine_matches(match1, match2):
-    m1k = make_string_set(match1.bindings.keys())
-    m2k = make_string_set(match2.bindings.keys())
-    intersection = string_set_intersection(m1k, m2k)
-    assert len(intersection) == 0
-    nbindings = match1.bindings.copy()   
-    nbindings.update(match2.bindings)    
-    match = Match([])
-    match.bindings = nbindings
-    return match
-
-def match_cartesian_product_add_binding_to(matches1, matches2, to, head, tail):
+# constraint checks compare terms bound to the same pattern variable, which are mostly unequal. 
+# Hashes are cached in terms and reject such pairs without traversing them.
+def terms_equal(term1, term2):
+    if term1 is term2:
+        return True
+    if term1.hash() != term2.hash():
+        return False
+    return term1.equals(term2)
+
+def match_cartesian_product_add_binding_to(matches1, slots1, matches2, slots2, to, head, tail, constraints1, constraints2):
     """
     computes cartesian product between matches in matches1 and matches2. 
-    Resulting bindings are added to existing match wth, which is copied beforehand.
-    head and tail must be precomputed.
+    Bindings in slots1 of matches1 and slots2 of matches2 are added to existing match to, 
+    which is copied beforehand. head and tail must be precomputed. Pairs in which binding 
+    at constraints1[i] of the first match differs from binding at constraints2[i] of the 
+    second are skipped.
     """
     out = []
     for m1, h1, t1 in matches1:
         for m2, h2, t2 in matches2:
-            combined = combine_matches(m1, m2)
+            if not match_bindings_equal(m1, constraints1, m2, constraints2):
+                continue
             retmatch = to.deepcopy()
-            for key in combined.bindings:
-                retmatch.addtobinding(key, combined.getbinding(key))
+            for slot in slots1:
+                retmatch.addtobinding(slot, m1.getbinding(slot))
+            for slot in slots2:
+                retmatch.addtobinding(slot, m2.getbinding(slot))
             out.append((retmatch,head,tail))
     return out
 
+def match_bindings_equal(m1, slots1, m2, slots2):
+    for i in range(len(slots1)):
+        if not terms_equal(m1.getbinding(slots1[i]), m2.getbinding(slots2[i])):
+            return False
+    return True
+
+# Context-aware membership checks used by in-hole matching. The context is not materialised: 
+# the term that is about to be replaced with the hole is given by the index path from the root. 
+# depth is the position on the path of the term being checked or -1 if the term is off the path.
+class InHolePosition:
+    OffPath = 0
+    Hole = 1
+    OnPath = 2
+
+def inhole_position(path, depth):
+    if depth < 0:
+        return InHolePosition.OffPath
+    if depth == len(path):
+        return InHolePosition.Hole
+    return InHolePosition.OnPath
+
+def inhole_child_depth(path, depth, index):
+    if depth >= 0 and depth < len(path) and path[depth] == index:
+        return depth + 1
+    return -1
+
+# returns the term that is actually at given position of the context.
+def inhole_subject(term, hole, path, depth):
+    if depth == len(path):
+        return hole
+    return term
+
+def inhole_root(path, term):
+    if len(path) == 0:
+        return term
+    return path[0]
+
+# subterms of the term the hole of some context pattern can be placed at, in preorder. 
+# Contexts are copied on demand and shared between in-hole patterns with the same context pattern.
+class InHoleDecompositions:
+    def __init__(self, term):
+        self.term = term
+        self.subterms = []
+        self.paths = []
+        self.indices = []
+        self.contexts = []
+
+    def add(self, subterm, path, indices):
+        self.subterms.append(subterm)
+        self.paths.append(path + [subterm])
+        self.indices.append(indices + [])
+        self.contexts.append(None)
+
+    def length(self):
+        return len(self.subterms)
+
+    def subterm(self, k):
+        return self.subterms[k]
+
+    def context(self, k, hole):
+        ctx = self.contexts[k]
+        if ctx is None:
+            ctx = copy_path_and_replace_last_with_hole(self.paths[k], self.indices[k], hole)
+            self.contexts[k] = ctx
+        return ctx
+
+# keeps decompositions of the last term only - reduction cases are tried against the same term
+# one after another. Partial decompositions found by refocusing are kept separately.
+class InHoleDecompositionsCache:
+    def __init__(self):
+        self.last = None
+        self.lastpartial = None
+        self.lastpartialpath = None
+
+    def get(self, term):
+        if self.last is not None and self.last.term is term:
+            return self.last
+        return None
+
+    def put(self, decompositions):
+        self.last = decompositions
+
+    def getpartial(self, term, plugpath):
+        if self.lastpartial is not None and self.lastpartial.term is term and self.lastpartialpath is plugpath:
+            return self.lastpartial
+        return None
+
+    def putpartial(self, decompositions, plugpath):
+        self.lastpartial = decompositions
+        self.lastpartialpath = plugpath
+
+# Refocusing. After each step of a #:refocus reduction relation the reduction case records a hint 
+# for the term it returned: its subterm produced by plugging the contractum into the context and 
+# the path to the hole within that subterm. The next redex is usually found near that position. 
+# The hint is only used when the next step reduces that very term - cases are first matched with 
+# refocusing active and in-hole decompositions of the recorded subterm then only consist of subterms 
+# on the way to the plug point, subterms of the plugged term and subterms to the right. Full search is 
+# done if no case matches. This is only sound if each term has at most one decomposition into context 
+# and redex.
+class Refocusing:
+    def __init__(self):
+        self.active = False
+        self.root = None
+        self.subject = None
+        self.path = None
+        self.pathstart = 0
+
+    def setactive(self, active):
+        self.active = active
+        return 0
+
+    # context is the term the contractum was plugged into, root.get(i)...get(j) is subject.
+    def sethint(self, root, subject, context):
+        if context.holepath is None:
+            return self.clearhint()
+        self.root = root
+        self.subject = subject
+        self.path = context.holepath
+        self.pathstart = context.holepathstart
+        return 0
+
+    def clearhint(self):
+        self.root = None
+        self.subject = None
+        self.path = None
+        return 0
+
+    def hashintfor(self, root):
+        return self.path is not None and self.root is root
+
+    def applies(self, term):
+        return self.active and self.path is not None and self.subject is term
+
+refocusing = Refocusing()
+
+def inhole_decompose_along_plugpath(node, i, plugpath, path, indices, decompositions, traverse, contextcheck):
+    if i == len(plugpath):
+        traverse(node, path, indices, decompositions)
+        return 0
+    if contextcheck(inhole_root(path, node), indices, 0, False):
+        decompositions.add(node, path, indices)
+    if not isinstance(node, Sequence):
+        return 0
+    path.append(node)
+    root = inhole_root(path, node)
+    for j in range(plugpath[i], node.length()):
+        indices.append(j)
+        if contextcheck(root, indices, 0, True):
+            if j == plugpath[i]:
+                inhole_decompose_along_plugpath(node.get(j), i + 1, plugpath, path, indices, decompositions, traverse, contextcheck)
+            else:
+                traverse(node.get(j), path, indices, decompositions)
+        indices.pop()
+    path.pop()
+    return 0
+
+# returns partial decompositions of the term if refocusing is active and the hint recorded by the 
+# previous step refers to the term, None otherwise.
+def inhole_decompose_refocused(term, cache, traverse, contextcheck):
+    if not refocusing.applies(term):
+        return None
+    decompositions = cache.getpartial(term, refocusing.path)
+    if decompositions is None:
+        decompositions = InHoleDecompositions(term)
+        inhole_decompose_along_plugpath(term, refocusing.pathstart, refocusing.path, [], [], decompositions, traverse, contextcheck)
+        cache.putpartial(decompositions, refocusing.path)
+    return decompositions
+
+def inhole_any_position(root, indices, depth, inside):
+    return True
+
+def inhole_decompose_all_impl(term, path, indices, decompositions):
+    decompositions.add(term, path, indices)
+    if isinstance(term, Sequence):
+        path.append(term)
+        for i in range(term.length()):
+            indices.append(i)
+            inhole_decompose_all_impl(term.get(i), path, indices, decompositions)
+            indices.pop()
+        path.pop()
+
+# decompositions for context patterns that do not restrict where the hole may be placed.
+def inhole_decompose_all(term):
+    decompositions = InHoleDecompositions(term)
+    if refocusing.applies(term):
+        inhole_decompose_along_plugpath(term, refocusing.pathstart, refocusing.path, [], [], decompositions, inhole_decompose_all_impl, inhole_any_position)
+        return decompositions
+    inhole_decompose_all_impl(term, [], [], decompositions)
+    return decompositions
+
+# Lazy matching. Matchers f(term, match, head, tail, k) resume continuation k with every match found 
+# and return True as soon as k asks to stop. Continuation owns the match it is resumed with - matchers 
+# trying multiple alternatives give a copy to all but the last one.
+class MatchContinuation:
+    def resume(self, match, head, tail):
+        assert False, 'resume is not implemented'
+        return False
+
+class SequenceContinuation(MatchContinuation):
+    # matches the rest of sequence term with step function.
+    def __init__(self, step, term, k):
+        self.step = step
+        self.term = term
+        self.k = k
+
+    def resume(self, match, head, tail):
+        return self.step(self.term, match, head, tail, self.k)
+
+class SequenceExitContinuation(MatchContinuation):
+    # all terms of the sequence have to be matched, matching continues in the enclosing sequence.
+    def __init__(self, k, head, tail):
+        self.k = k
+        self.head = head
+        self.tail = tail
+
+    def resume(self, match, head, tail):
+        if head != tail:
+            return False
+        return self.k.resume(match, self.head + 1, self.tail)
+
+# compile-time known parts of in-hole pattern.
+class LazyInHole:
+    def __init__(self, matchsubterm, slots1, slots2, constraints1, constraints2):
+        self.matchsubterm = matchsubterm
+        self.slots1 = slots1
+        self.slots2 = slots2
+        self.constraints1 = constraints1
+        self.constraints2 = constraints2
+
+class InHoleContinuation(MatchContinuation):
+    # resumed with matches of the context at index of decompositions, matches the subterm.
+    def __init__(self, inhole, decompositions, index, match, head, tail, k):
+        self.inhole = inhole
+        self.decompositions = decompositions
+        self.index = index
+        self.match = match
+        self.head = head
+        self.tail = tail
+        self.k = k
+
+    def resume(self, match, head, tail):
+        subterm = self.decompositions.subterm(self.index)
+        k = InHoleSubtermContinuation(self, match)
+        return self.inhole.matchsubterm(subterm, self.match.emptycopy(), 0, 1, k)
+
+class InHoleSubtermContinuation(MatchContinuation):
+    def __init__(self, parent, contextmatch):
+        self.parent = parent
+        self.contextmatch = contextmatch
+
+    def resume(self, match, head, tail):
+        parent = self.parent
+        inhole = parent.inhole
+        if not match_bindings_equal(self.contextmatch, inhole.constraints1, match, inhole.constraints2):
+            return False
+        retmatch = parent.match.deepcopy()
+        for slot in inhole.slots1:
+            retmatch.addtobinding(slot, self.contextmatch.getbinding(slot))
+        for slot in inhole.slots2:
+            retmatch.addtobinding(slot, match.getbinding(slot))
+        return parent.k.resume(retmatch, parent.head + 1, parent.tail)
+
+# matches of the repeated pattern along with the position in the sequence, repeats are matched
+# breadth-first so that matches are found in the same order as by the list-based matchers.
+class MatchQueue(MatchContinuation):
+    def __init__(self):
+        self.matches = []
+        self.heads = []
+
+    def getmatches(self):
+        return self.matches
+
+    def getheads(self):
+        return self.heads
+
+    def length(self):
+        return len(self.matches)
+
+    def resume(self, match, head, tail):
+        self.matches.append(match)
+        self.heads.append(head)
+        return False
+
+class MatchCollector(MatchContinuation):
+    def __init__(self):
+        self.matches = []
+
+    def getmatches(self):
+        return self.matches
+
+    def resume(self, match, head, tail):
+        self.matches.append(match)
+        return False
+
+class FirstMatch(MatchContinuation):
+    def __init__(self):
+        self.match = None
+
+    def getmatch(self):
+        return self.match
+
+    def resume(self, match, head, tail):
+        self.match = match
+        return True
+
 def assert_compare_match_lists(m1, m2):
     if len(m1) == len(m2):
         for i, m in enumerate(m1):
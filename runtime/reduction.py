@@ -0,0 +1,421 @@
+import os
+import sys
+from rpython.rlib.rfloat import formatd, string_to_float
+from rpython.rlib.objectmodel import we_are_translated
+
+# Options of the generated program, set from the command line by parse_reduction_options.
+# --workers N  expand frontier of read-from-stdin-and-apply-reduction-relation* in N forked processes.
+# --min-frontier K  only fork workers for frontiers of at least K terms, smaller ones are expanded
+#                   by the main process (default 64).
+# --print all|final|none  print frontier after each step and irreducible terms and cycles at the end
+#                         (default), only the latter, or nothing at all.
+# --print-every K  print frontier after every K-th step only.
+class ReductionOptions:
+    def __init__(self):
+        self.workers = 1
+        self.minfrontier = 64
+        self.printevery = 1     # 0 - frontier is not printed.
+        self.printsummary = True
+
+    def printstep(self, step):
+        return self.printevery > 0 and step % self.printevery == 0
+
+reduction_options = ReductionOptions()
+
+def parse_reduction_options(argv):
+    i = 1
+    while i < len(argv):
+        if argv[i] == '--workers' and i + 1 < len(argv):
+            workers = int(argv[i + 1])
+            if workers < 1:
+                raise Exception('--workers: expected positive number of workers')
+            reduction_options.workers = workers
+            i += 2
+            continue
+        if argv[i] == '--min-frontier' and i + 1 < len(argv):
+            minfrontier = int(argv[i + 1])
+            if minfrontier < 1:
+                raise Exception('--min-frontier: expected positive number of terms')
+            reduction_options.minfrontier = minfrontier
+            i += 2
+            continue
+        if argv[i] == '--print' and i + 1 < len(argv):
+            mode = argv[i + 1]
+            if mode == 'all':
+                reduction_options.printevery = 1
+                reduction_options.printsummary = True
+            elif mode == 'final':
+                reduction_options.printevery = 0
+                reduction_options.printsummary = True
+            elif mode == 'none':
+                reduction_options.printevery = 0
+                reduction_options.printsummary = False
+            else:
+                raise Exception('--print: expected one of all, final, none')
+            i += 2
+            continue
+        if argv[i] == '--print-every' and i + 1 < len(argv):
+            printevery = int(argv[i + 1])
+            if printevery < 1:
+                raise Exception('--print-every: expected positive number of steps')
+            reduction_options.printevery = printevery
+            i += 2
+            continue
+        raise Exception('unknown option %s' % argv[i])
+    return 0
+
+# Reduction graph explored by read-from-stdin-and-apply-reduction-relation*. Each distinct term
+# (up to structural equality) is a node of the graph and is expanded exactly once.
+class ReductionGraph:
+    def __init__(self):
+        self.indices = new_term_dict()
+        self.terms = []
+        self.edges = []
+        self.irreducible = []
+        self.steps = 0
+
+    def addterm(self, term):
+        # returns index of the node and True if the term has not been seen before.
+        if term in self.indices:
+            return self.indices[term], False
+        index = len(self.terms)
+        self.indices[term] = index
+        self.terms.append(term)
+        self.edges.append([])
+        return index, True
+
+    def expand(self, term, successors):
+        # records edges from term to its successors and returns successors that have not been seen before.
+        source, _ = self.addterm(term)
+        if len(successors) == 0:
+            self.irreducible.append(source)
+        newterms = []
+        for successor in successors:
+            target, isnew = self.addterm(successor)
+            self.edges[source].append(target)
+            if isnew:
+                newterms.append(successor)
+        return newterms
+
+    def expandfrontier(self, frontier, reductionrelation, hashcons):
+        # applies reduction relation to each term of the frontier, possibly in worker processes, and
+        # expands the graph in frontier order so that the result does not depend on the number of workers.
+        # Workers are forked anew for each frontier, small frontiers are not worth it.
+        if reduction_options.workers > 1 and len(frontier) >= reduction_options.minfrontier:
+            successors = reduce_in_workers(frontier, reductionrelation, reduction_options.workers, hashcons)
+        else:
+            successors = [reductionrelation(term) for term in frontier]
+        newterms = []
+        for i in range(len(frontier)):
+            newterms.extend(self.expand(frontier[i], successors[i]))
+        return newterms
+
+    # frontier of step 0 consists of the input term only.
+    def printfrontier(self, frontier):
+        print_frontier(frontier, self.steps)
+        self.steps += 1
+        return 0
+
+    def irreducibleterms(self):
+        return [self.terms[i] for i in self.irreducible]
+
+    def cycles(self):
+        # Tarjan's strongly connected components algorithm with explicit stack. Returns components
+        # that contain a cycle, i.e. ones consisting of multiple nodes or a node with a self-loop.
+        n = len(self.terms)
+        index = [-1] * n
+        lowlink = [0] * n
+        onstack = [False] * n
+        stack = []
+        components = []
+        counter = 0
+        for root in range(n):
+            if index[root] != -1:
+                continue
+            callstack = [root]
+            edgepositions = [0]
+            index[root] = counter
+            lowlink[root] = counter
+            counter += 1
+            stack.append(root)
+            onstack[root] = True
+            while len(callstack) != 0:
+                v = callstack[-1]
+                pos = edgepositions[-1]
+                if pos < len(self.edges[v]):
+                    edgepositions[-1] = pos + 1
+                    w = self.edges[v][pos]
+                    if index[w] == -1:
+                        index[w] = counter
+                        lowlink[w] = counter
+                        counter += 1
+                        stack.append(w)
+                        onstack[w] = True
+                        callstack.append(w)
+                        edgepositions.append(0)
+                    elif onstack[w]:
+                        lowlink[v] = min(lowlink[v], index[w])
+                    continue
+                callstack.pop()
+                edgepositions.pop()
+                if len(callstack) != 0:
+                    u = callstack[-1]
+                    lowlink[u] = min(lowlink[u], lowlink[v])
+                if lowlink[v] == index[v]:
+                    component = []
+                    while True:
+                        w = stack.pop()
+                        onstack[w] = False
+                        component.append(w)
+                        if w == v:
+                            break
+                    if len(component) > 1 or v in self.edges[v]:
+                        component.reverse()
+                        components.append([self.terms[i] for i in component])
+        return components
+
+    def print_summary(self):
+        if not reduction_options.printsummary:
+            return 0
+        print_labelled_term_list('irreducible terms: ', self.irreducibleterms())
+        for cycle in self.cycles():
+            print_labelled_term_list('cycle: ', cycle)
+        return 0
+
+def print_frontier(frontier, step):
+    if reduction_options.printstep(step):
+        print_term_list(frontier)
+    return 0
+
+# read-from-stdin-and-apply-reduction-relation* for #:deterministic reduction relations. step(term) returns
+# the only successor of the term or None. Instead of the reduction graph only the current term is kept,
+# cycles are detected with Brent's algorithm that keeps a single additional term. Output follows 
+# ReductionGraph, except that terms of the cycle are printed until the cycle is detected.
+def reduce_deterministically(term, step):
+    start = term
+    tortoise = term
+    power = 1
+    length = 1
+    steps = 0
+    print_frontier([term], steps)
+    while True:
+        successor = step(term)
+        steps += 1
+        if successor is None:
+            print_frontier([], steps)
+            if reduction_options.printsummary:
+                print_labelled_term_list('irreducible terms: ', [term])
+            return 0
+        if successor.equals(tortoise):
+            break
+        print_frontier([successor], steps)
+        term = successor
+        if power == length:
+            tortoise = term
+            power *= 2
+            length = 0
+        length += 1
+
+    # the cycle has given length, its first term is found by stepping from the start twice: 
+    # once right away and once length steps ahead.
+    print_frontier([], steps)
+    if not reduction_options.printsummary:
+        return 0
+    print_labelled_term_list('irreducible terms: ', [])
+    tortoise = start
+    hare = start
+    for i in range(length):
+        hare = step(hare)
+    while not tortoise.equals(hare):
+        tortoise = step(tortoise)
+        hare = step(hare)
+    cycle = [tortoise]
+    term = step(tortoise)
+    while not term.equals(tortoise):
+        cycle.append(term)
+        term = step(term)
+    print_labelled_term_list('cycle: ', cycle)
+    return 0
+
+# Terms are passed from worker processes to the parent in the following format:
+# Sequence - q<length>; followed by elements, Integer - i<value>;, Float - f<value>;, Hole - h, 
+# String, Boolean and Variable - s, b and v respectively followed by <length of value>:<value>.
+def encode_term(term, out):
+    kind = term.kind()
+    if kind == TermKind.Sequence:
+        assert isinstance(term, Sequence)
+        out.append('q%d;' % term.length())
+        for i in range(term.length()):
+            encode_term(term.get(i), out)
+    elif kind == TermKind.Integer:
+        assert isinstance(term, Integer)
+        out.append('i%d;' % term.value())
+    elif kind == TermKind.Float:
+        assert isinstance(term, Float)
+        out.append('f%s;' % formatd(term.value(), 'r', 0))
+    elif kind == TermKind.Hole:
+        out.append('h')
+    else:
+        tag = 'v'
+        if kind == TermKind.String:
+            tag = 's'
+        elif kind == TermKind.Boolean:
+            tag = 'b'
+        value = term.tostring()
+        out.append('%s%d:%s' % (tag, len(value), value))
+
+class TermDecoder:
+    def __init__(self, string):
+        self.string = string
+        self.pos = 0
+
+    def _readuntil(self, delimiter):
+        start = self.pos
+        end = self.string.find(delimiter, start)
+        assert end >= 0
+        self.pos = end + 1
+        return self.string[start:end]
+
+    def _readvalue(self):
+        length = int(self._readuntil(':'))
+        start = self.pos
+        end = start + length
+        assert end >= start
+        self.pos = end
+        return self.string[start:end]
+
+    def decode(self):
+        tag = self.string[self.pos]
+        self.pos += 1
+        if tag == 'q':
+            length = int(self._readuntil(';'))
+            seq = []
+            for i in range(length):
+                seq.append(self.decode())
+            return Sequence(seq)
+        if tag == 'i':
+            return Integer(int(self._readuntil(';')))
+        if tag == 'f':
+            return Float(string_to_float(self._readuntil(';')))
+        if tag == 'h':
+            return Hole()
+        if tag == 's':
+            return String(self._readvalue())
+        if tag == 'b':
+            return Boolean(self._readvalue())
+        if tag == 'v':
+            return Variable(self._readvalue())
+        raise Exception('malformed term encoding')
+
+def _read_all(fd):
+    chunks = []
+    while True:
+        chunk = os.read(fd, 65536)
+        if len(chunk) == 0:
+            break
+        chunks.append(chunk)
+    return ''.join(chunks)
+
+def _print_worker_output(output):
+    if len(output) == 0:
+        return 0
+    end = len(output) - 1
+    assert end >= 0
+    if output[end] == '\n':
+        output = output[:end]
+    print(output)
+    return 0
+
+def _write_all(fd, string):
+    while len(string) != 0:
+        written = os.write(fd, string)
+        string = string[written:]
+
+# Frontier is sharded between forked workers by term hash. Each worker inherits the frontier, 
+# applies reduction relation to terms of its shard and writes encoded successors into the pipe:
+# number of successors of each term of the shard followed by the successors themselves.
+# Standard output of a worker is redirected into a separate pipe, the parent reports it if the worker 
+# fails - generated code prints the error message before raising. The visited set (ReductionGraph) 
+# is only kept by the parent.
+def reduce_in_workers(frontier, reductionrelation, workers, hashcons):
+    shards = [[] for _ in range(workers)]
+    for i in range(len(frontier)):
+        shard = frontier[i].hash() % workers
+        if shard < 0:
+            shard += workers
+        shards[shard].append(i)
+
+    # untranslated, the first call to formatd builds a C library with ll2ctypes. Workers doing it 
+    # at once overwrite each other's build, so it is done by the parent before forking. Buffered 
+    # output of the parent is flushed so that workers do not inherit it.
+    if not we_are_translated():
+        formatd(0.0, 'r', 0)
+        sys.stdout.flush()
+
+    pids = []
+    fds = []
+    errfds = []
+    for w in range(workers):
+        readfd, writefd = os.pipe()
+        errreadfd, errwritefd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(readfd)
+            os.close(errreadfd)
+            os.dup2(errwritefd, 1)
+            os.close(errwritefd)
+            exitcode = 0
+            out = []
+            try:
+                for i in shards[w]:
+                    successors = reductionrelation(frontier[i])
+                    out.append('%d;' % len(successors))
+                    for successor in successors:
+                        encode_term(successor, out)
+            except Exception:
+                exitcode = 1
+            # the parent reads standard output of the worker first, it has to be closed before 
+            # successors are written.
+            if not we_are_translated():
+                sys.stdout.flush()
+            os.close(1)
+            if exitcode == 0:
+                _write_all(writefd, ''.join(out))
+            os.close(writefd)
+            os._exit(exitcode)
+        os.close(writefd)
+        os.close(errwritefd)
+        pids.append(pid)
+        fds.append(readfd)
+        errfds.append(errreadfd)
+
+    # children only block on their own pipes and close standard output before writing successors, 
+    # thus reading pipes one by one can not deadlock. All children are waited for before reporting 
+    # a failed one.
+    outputs = []
+    errors = []
+    failed = -1
+    for w in range(workers):
+        errors.append(_read_all(errfds[w]))
+        os.close(errfds[w])
+        outputs.append(_read_all(fds[w]))
+        os.close(fds[w])
+        _, status = os.waitpid(pids[w], 0)
+        if status != 0 and failed == -1:
+            failed = w
+    if failed != -1:
+        print('Exception: reduction worker %d failed' % failed)
+        _print_worker_output(errors[failed])
+        raise Exception('reduction worker %d failed' % failed)
+
+    results = [[] for _ in frontier]
+    for w in range(workers):
+        decoder = TermDecoder(outputs[w])
+        for i in shards[w]:
+            count = int(decoder._readuntil(';'))
+            for j in range(count):
+                successor = decoder.decode()
+                if hashcons:
+                    successor = intern_term(successor)
+                results[i].append(successor)
+    return results
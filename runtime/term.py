@@ -1,4 +1,8 @@
 import copy 
+import os
+import sys
+from rpython.rlib.objectmodel import r_dict, compute_hash, we_are_translated
+from rpython.rlib.rarithmetic import intmask
 
 class TermKind:
     Variable = 0
@@ -9,20 +13,61 @@ class TermKind:
     String = 5
     Boolean = 6
 
+def _hash_combine(x, y):
+    return intmask((1000003 * x) ^ y)
+
 class Term:
-    def __init__(self, kind):
+    def __init__(self, kind, hashvalue):
         self.__kind = kind
+        # structural hash, number of nodes and depth are computed once upon construction and 
+        # kept up to date by Sequence.append. hash is consistent with equals.
+        self._hash = hashvalue
+        self._size = 1
+        self._depth = 1
+        # set by TermInternTable. Interned terms are shared and must never be mutated.
+        self.interned = False
+        # non-terminal membership cache. Each non-terminal is assigned a bit at compile time, 
+        # _ntyes holds non-terminals the term is known to be in, _ntno - known not to be in.
+        self._ntyes = 0
+        self._ntno = 0
+        # path to the hole recorded by in-hole matching: hole is reached by following indices 
+        # holepath[holepathstart:]. None if unknown, then the hole has to be searched for.
+        self.holepath = None
+        self.holepathstart = 0
 
     def kind(self):
         return self.__kind
 
+    def hash(self):
+        return self._hash
+
+    def size(self):
+        return self._size
+
+    def depth(self):
+        return self._depth
+
+    # returns 1 if the term is known to be in the non-terminal, 0 if it is known not to be and -1 otherwise.
+    def ntmembership(self, ntbit):
+        if self._ntyes & ntbit:
+            return 1
+        if self._ntno & ntbit:
+            return 0
+        return -1
+
+    def addntmembership(self, ntbit, ismember):
+        if ismember:
+            self._ntyes |= ntbit
+        else:
+            self._ntno |= ntbit
+
     def append(self, term):
         raise Exception('unsupported operation')
 
 class Integer(Term):
     def __init__(self, value):
         assert isinstance(value, int) 
-        Term.__init__(self, TermKind.Integer)
+        Term.__init__(self, TermKind.Integer, _hash_combine(TermKind.Integer, compute_hash(value)))
         self.__value = value
 
     def tostring(self):
@@ -40,12 +85,15 @@ class Integer(Term):
         return Integer(self.__value)
 
     def deepcopy(self):
+        if self.interned:
+            return self
         return Integer(self.__value)
 
 class Float(Term):
     def __init__(self, value):
         assert isinstance(value, float) 
-        Term.__init__(self, TermKind.Float)
+        # floats are equal up to tolerance, thus the value cannot contribute to the hash.
+        Term.__init__(self, TermKind.Float, _hash_combine(TermKind.Float, 0))
         self.__value = value
         
     def tostring(self):
@@ -63,12 +111,14 @@ class Float(Term):
         return Float(self.__value)
 
     def deepcopy(self):
+        if self.interned:
+            return self
         return Float(self.__value)
 
 class String(Term):
     def __init__(self, value):
         assert isinstance(value, str) 
-        Term.__init__(self, TermKind.String)
+        Term.__init__(self, TermKind.String, _hash_combine(TermKind.String, compute_hash(value)))
         self.__value = value
 
     def value(self):
@@ -86,12 +136,14 @@ class String(Term):
         return String(self.__value)
 
     def deepcopy(self):
+        if self.interned:
+            return self
         return String(self.__value)
 
 class Boolean(Term):
     def __init__(self, value):
         assert isinstance(value, str) 
-        Term.__init__(self, TermKind.Boolean)
+        Term.__init__(self, TermKind.Boolean, _hash_combine(TermKind.Boolean, compute_hash(value)))
         self.__value = value
 
     def value(self):
@@ -109,12 +161,14 @@ class Boolean(Term):
         return Boolean(self.__value)
 
     def deepcopy(self):
+        if self.interned:
+            return self
         return Boolean(self.__value)
 
 class Variable(Term):
     def __init__(self, value):
         assert isinstance(value, str) 
-        Term.__init__(self, TermKind.Variable)
+        Term.__init__(self, TermKind.Variable, _hash_combine(TermKind.Variable, compute_hash(value)))
         self.__value = value
 
     def value(self):
@@ -132,11 +186,13 @@ class Variable(Term):
         return Variable(self.__value)
 
     def deepcopy(self):
+        if self.interned:
+            return self
         return Variable(self.__value)
 
 class Hole(Term):
     def __init__(self):
-        Term.__init__(self, TermKind.Hole)
+        Term.__init__(self, TermKind.Hole, _hash_combine(TermKind.Hole, 0))
 
     def tostring(self):
         return 'hole'
@@ -148,31 +204,39 @@ class Hole(Term):
         return Hole()
 
     def deepcopy(self):
+        if self.interned:
+            return self
         return Hole()
 
 class Sequence(Term):
     def __init__(self, seq):
-        Term.__init__(self, TermKind.Sequence)
+        Term.__init__(self, TermKind.Sequence, _hash_combine(TermKind.Sequence, 0x345678))
         self.seq = seq
+        self.hasfloat = False
+        for elem in seq:
+            self._updatecached(elem)
+
+    def _updatecached(self, elem):
+        self._hash = _hash_combine(self._hash, elem.hash())
+        self._size += elem.size()
+        if elem.depth() + 1 > self._depth:
+            self._depth = elem.depth() + 1
 
     def get(self, key):
         return self.seq[key]
 
     def append(self, val):
+        assert not self.interned, 'interned terms are immutable'
         self.seq.append(val)
+        self._updatecached(val)
+        self._ntyes = 0
+        self._ntno = 0
 
     def length(self):
         return len(self.seq)
 
     def tostring(self):
-        string = ''
-        if len(self.seq) > 0:
-            string = ''
-            for i in range(len(self.seq) - 1):
-                elem = self.seq[i]
-                string = string + elem.tostring() + ' '
-            string = string + self.seq[len(self.seq)-1].tostring()
-        return '(%s)' % string
+        return '(%s)' % ' '.join([elem.tostring() for elem in self.seq])
     
     def shallowcopy(self):
         nseq = [] * len(self.seq)
@@ -180,14 +244,34 @@ class Sequence(Term):
             nseq.append(elem)
         return Sequence(nseq)
 
+    # returns copy of the sequence with element at position i replaced with the term.
+    def replacedat(self, i, term):
+        nseq = [] * len(self.seq)
+        for j, elem in enumerate(self.seq):
+            if j == i:
+                nseq.append(term)
+            else:
+                nseq.append(elem)
+        return Sequence(nseq)
+
     def deepcopy(self):
+        if self.interned:
+            return self
         nseq = [] * len(self.seq)
         for i, elem in enumerate(self.seq):
             nseq.append( elem.deepcopy() )
         return Sequence(nseq)
 
     def equals(self, other):
+        if self is other:
+            return True
         if isinstance(other, Sequence):
+            # Structurally equal interned terms are the same object. Floats are interned by their
+            # exact value but compared with tolerance so sequences containing them are compared as usual.
+            if self.interned and other.interned and not self.hasfloat:
+                return False
+            if self.hash() != other.hash():
+                return False
             if self.length() == other.length():
                 for i in range(self.length()):
                     if not self.get(i).equals(other.get(i)):
@@ -195,6 +279,205 @@ class Sequence(Term):
                 return True
         return False
 
+# Terms can be used as keys in r_dicts. Note that due to Float tolerance, term equality is not transitive. 
+def term_hash(term):
+    return term.hash()
+
+def term_equals(term1, term2):
+    return term1.equals(term2)
+
+def new_term_dict():
+    return r_dict(term_equals, term_hash)
+
+# Results of metafunctions defined with #:memo. Entries are keyed by the application term
+# (mfname arg ...) and kept in doubly linked list ordered from the most to the least recently used.
+# Once there are more than capacity entries, the least recently used one is evicted.
+class MetafunctionCacheEntry:
+    def __init__(self, key, value):
+        self.key = key
+        self.value = value
+        self.prev = None
+        self.next = None
+
+class MetafunctionCache:
+    def __init__(self, capacity):
+        assert capacity > 0
+        self.capacity = capacity
+        self.entries = r_dict(term_equals, term_hash)
+        self.first = None
+        self.last = None
+
+    def _unlink(self, entry):
+        if entry.prev is not None:
+            entry.prev.next = entry.next
+        else:
+            self.first = entry.next
+        if entry.next is not None:
+            entry.next.prev = entry.prev
+        else:
+            self.last = entry.prev
+        entry.prev = None
+        entry.next = None
+
+    def _pushfront(self, entry):
+        entry.next = self.first
+        if self.first is not None:
+            self.first.prev = entry
+        self.first = entry
+        if self.last is None:
+            self.last = entry
+
+    def length(self):
+        return len(self.entries)
+
+    # returns cached result of application term or None.
+    def get(self, key):
+        entry = self.entries.get(key, None)
+        if entry is None:
+            return None
+        if entry is not self.first:
+            self._unlink(entry)
+            self._pushfront(entry)
+        return entry.value
+
+    def put(self, key, value):
+        entry = self.entries.get(key, None)
+        if entry is not None:
+            entry.value = value
+            self._unlink(entry)
+            self._pushfront(entry)
+            return
+        entry = MetafunctionCacheEntry(key, value)
+        self.entries[key] = entry
+        self._pushfront(entry)
+        if len(self.entries) > self.capacity:
+            evicted = self.last
+            assert evicted is not None
+            self._unlink(evicted)
+            del self.entries[evicted.key]
+
+# Hash-consing. Terms produced by term templates and the parser are passed through intern_term 
+# when the spec is compiled with -hash-cons. Structurally equal terms then are represented by
+# the same object, so comparing them is an identity check and copying them is sharing.
+def _sequence_children_identical(seq1, seq2):
+    if seq1.length() != seq2.length():
+        return False
+    for i in range(seq1.length()):
+        if seq1.get(i) is not seq2.get(i):
+            return False
+    return True
+
+# keys of the table are Sequences rather than Terms, thus term_hash can not be shared with it.
+def _sequence_hash(seq):
+    return seq.hash()
+
+class TermInternTable:
+    def __init__(self):
+        self.integers = {}
+        self.floats = {}
+        self.strings = {}
+        self.booleans = {}
+        self.variables = {}
+        self.holes = []
+        # children of sequences stored here are interned, thus comparing them by identity is enough.
+        self.sequences = r_dict(_sequence_children_identical, _sequence_hash)
+
+    # tables of atoms have keys of different types, RPython requires a separate helper for each.
+    def _intern_integer(self, term):
+        key = term.value()
+        if key in self.integers:
+            return self.integers[key]
+        term.interned = True
+        self.integers[key] = term
+        return term
+
+    def _intern_float(self, term):
+        key = term.value()
+        if key in self.floats:
+            return self.floats[key]
+        term.interned = True
+        self.floats[key] = term
+        return term
+
+    def _intern_string(self, table, key, term):
+        if key in table:
+            return table[key]
+        term.interned = True
+        table[key] = term
+        return term
+
+    def intern(self, term):
+        if term.interned:
+            return term
+        if isinstance(term, Integer):
+            return self._intern_integer(term)
+        if isinstance(term, Float):
+            return self._intern_float(term)
+        if isinstance(term, String):
+            return self._intern_string(self.strings, term.value(), term)
+        if isinstance(term, Boolean):
+            return self._intern_string(self.booleans, term.value(), term)
+        if isinstance(term, Variable):
+            return self._intern_string(self.variables, term.value(), term)
+        if isinstance(term, Hole):
+            if len(self.holes) == 0:
+                term.interned = True
+                self.holes.append(term)
+            return self.holes[0]
+        if isinstance(term, Sequence):
+            # interned sequence always owns its list - the original one may still be modified by someone else.
+            nseq = []
+            hasfloat = False
+            for i in range(term.length()):
+                child = self.intern(term.get(i))
+                if isinstance(child, Float):
+                    hasfloat = True
+                if isinstance(child, Sequence) and child.hasfloat:
+                    hasfloat = True
+                nseq.append(child)
+            candidate = Sequence(nseq)
+            if candidate in self.sequences:
+                return self.sequences[candidate]
+            candidate.interned = True
+            candidate.hasfloat = hasfloat
+            self.sequences[candidate] = candidate
+            return candidate
+        assert False, 'unknown term'
+
+term_intern_table = TermInternTable()
+
+def intern_term(term):
+    return term_intern_table.intern(term)
+
+# Maps the shape of the term - its kind and the variable at fixed path within the term - to the id 
+# of the bucket of alternatives that may match the term. See DiscriminationIndexCodegen.
+class DiscriminationIndex:
+    def __init__(self, path, default):
+        self.path = path
+        self.default = default
+        self.bykind = {}
+        self.byliteral = {}
+
+    def addkind(self, kind, bucket):
+        self.bykind[kind] = bucket
+
+    def addliteral(self, literal, bucket):
+        self.byliteral[literal] = bucket
+
+    def lookup(self, term):
+        if len(self.byliteral) != 0:
+            subterm = term
+            for i in self.path:
+                if not isinstance(subterm, Sequence) or subterm.length() <= i:
+                    subterm = None
+                    break
+                subterm = subterm.get(i)
+            if isinstance(subterm, Variable):
+                bucket = self.byliteral.get(subterm.value(), -1)
+                if bucket != -1:
+                    return bucket
+        return self.bykind.get(term.kind(), self.default)
+
 def term_is_number(term):
     return isinstance(term, Float) or isinstance(term, Integer)
 
@@ -219,28 +502,43 @@ def term_is_boolean(term):
 def term_is_variable_not_otherwise_mentioned(term, variableset):
     return isinstance(term, Variable) and term.value() not in variableset
 
+def term_is_literal_integer(term, literal):
+    return isinstance(term, Integer) and term.value() == literal
+
+def term_is_literal_float(term, literal):
+    return isinstance(term, Float) and abs(literal - term.value()) < 0.001
+
+def term_is_literal_string(term, literal):
+    return isinstance(term, String) and term.value() == literal
+
+def term_is_literal_boolean(term, literal):
+    return isinstance(term, Boolean) and term.value() == literal
+
+def term_is_literal_variable(term, literal):
+    return isinstance(term, Variable) and term.value() == literal
+
 def consume_literal_integer(term, match, head, tail, literal):
-    if isinstance(term, Integer) and term.value() == literal:
+    if term_is_literal_integer(term, literal):
         return [ (match, head+1, tail) ]
     return []
 
 def consume_literal_float(term, match, head, tail, literal):
-    if isinstance(term, Float) and abs(literal - term.value()) < 0.001:
+    if term_is_literal_float(term, literal):
         return [ (match, head+1, tail) ]
     return []
 
 def consume_literal_string(term, match, head, tail, literal):
-    if isinstance(term, String) and term.value() == literal:
+    if term_is_literal_string(term, literal):
         return [ (match, head+1, tail) ]
     return []
 
 def consume_literal_boolean(term, match, head, tail, literal):
-    if isinstance(term, Boolean) and term.value() == literal:
+    if term_is_literal_boolean(term, literal):
         return [ (match, head+1, tail) ]
     return []
 
 def consume_variable(term, match, head, tail, literal):
-    if isinstance(term, Variable) and term.value() == literal:
+    if term_is_literal_variable(term, literal):
         return [ (match, head+1, tail) ]
     return []
 
@@ -261,17 +559,60 @@ def copy_path_and_replace_last(path, withterm):
     child = withterm
     while i >= 0:
         parent = path[i]
-        parentcopy = parent.shallowcopy()
-        assert isinstance(parentcopy, Sequence)
+        assert isinstance(parent, Sequence)
         childfound = False 
-        for j, node in enumerate(parentcopy.seq):
-            if node is path[i+1]:
+        for j in range(parent.length()):
+            if parent.get(j) is path[i+1]:
                 childfound = True
-                parentcopy.seq[j] = child
+                child = parent.replacedat(j, child)
                 break
         if not childfound:
             assert False, 'malformed term'
-        child = parentcopy
+        i -= 1
+    return child
+
+def copy_path_and_replace_last_at(path, indices, withterm):
+    """
+    Same as copy_path_and_replace_last but term path[i+1] is located at position indices[i] of path[i]
+    instead of being looked up by identity. Required when subterms are shared (e.g. when terms are
+    hash-consed) because the same object may then appear at multiple positions of its parent.
+
+    returns: root of the term.
+    """
+    assert len(path) > 0
+    assert len(path) == len(indices) + 1
+
+    i = len(path) - 2
+    child = withterm
+    while i >= 0:
+        parent = path[i]
+        assert isinstance(parent, Sequence)
+        child = parent.replacedat(indices[i], child)
+        i -= 1
+    return child
+
+def copy_path_and_replace_last_with_hole(path, indices, hole):
+    """
+    Same as copy_path_and_replace_last_at but also records the path to the hole on every copied 
+    term, so that plughole does not need to search for it. 
+
+    returns: root of the term.
+    """
+    assert len(path) > 0
+    assert len(path) == len(indices) + 1
+
+    holepath = [0] * len(indices)
+    for i in range(len(indices)):
+        holepath[i] = indices[i]
+
+    i = len(path) - 2
+    child = hole
+    while i >= 0:
+        parent = path[i]
+        assert isinstance(parent, Sequence)
+        child = parent.replacedat(holepath[i], child)
+        child.holepath = holepath
+        child.holepathstart = i
         i -= 1
     return child
 
@@ -292,7 +633,26 @@ def locatehole(term, path):
         path.pop()
     return False
 
+def plug_along_holepath(into, term):
+    path = into.holepath
+    assert path is not None
+    nodes = []
+    node = into
+    for i in range(into.holepathstart, len(path)):
+        nodes.append(node)
+        node = node.get(path[i])
+    assert isinstance(node, Hole), 'recorded path does not lead to the hole'
+
+    child = term
+    i = len(nodes) - 1
+    while i >= 0:
+        child = nodes[i].replacedat(path[into.holepathstart + i], child)
+        i -= 1
+    return child
+
 def plughole(into, term):
+    if into.holepath is not None:
+        return plug_along_holepath(into, term)
     path = []
     locatehole(into, path)
     if len(path) != 0:
@@ -323,13 +683,76 @@ def aretermsequalpairwise(terms):
 def print_term(term):
     print( term.tostring() )
 
+def term_list_to_string(terms):
+    return '[%s]' % ', '.join([term.tostring() for term in terms])
+
+# Writes terms into standard output piece by piece instead of building the string of the whole
+# term first. Pieces are collected into chunks of roughly buffersize characters that are written
+# into the file descriptor right away. Everything is flushed at the end of each print call so that
+# the output is not reordered relative to print statements.
+class TermWriter:
+    def __init__(self, fd, buffersize):
+        self.fd = fd
+        self.buffersize = buffersize
+        self.smallterm = 256
+        self.pieces = []
+        self.size = 0
+
+    def write(self, string):
+        self.pieces.append(string)
+        self.size += len(string)
+        if self.size >= self.buffersize:
+            self.writechunk()
+
+    def writechunk(self):
+        chunk = ''.join(self.pieces)
+        self.pieces = []
+        self.size = 0
+        while len(chunk) != 0:
+            written = os.write(self.fd, chunk)
+            chunk = chunk[written:]
+
+    # subterms of at most smallterm nodes are converted to strings at once.
+    def writeterm(self, term):
+        if isinstance(term, Sequence) and term.size() > self.smallterm:
+            self.write('(')
+            for i in range(term.length()):
+                if i != 0:
+                    self.write(' ')
+                self.writeterm(term.get(i))
+            self.write(')')
+        else:
+            self.write(term.tostring())
+
+    def writetermlist(self, terms):
+        self.write('[')
+        for i in range(len(terms)):
+            if i != 0:
+                self.write(', ')
+            self.writeterm(terms[i])
+        self.write(']')
+
+    # print statements of untranslated programs go through sys.stdout that has its own buffer.
+    def begin(self):
+        if not we_are_translated():
+            sys.stdout.flush()
+
+    def flush(self):
+        if self.size != 0:
+            self.writechunk()
+
+termwriter = TermWriter(1, 65536)
+
 def print_term_list(terms):
-    string = '['
-    if len(terms) > 0:
-        for i in range(len(terms) - 1):
-            term = terms[i]
-            string = string + term.tostring() + ', '
-        string = string + terms[-1].tostring()
-    string = string + ']'
-    print(string)
+    termwriter.begin()
+    termwriter.writetermlist(terms)
+    termwriter.write('\n')
+    termwriter.flush()
+
+def print_labelled_term_list(label, terms):
+    termwriter.begin()
+    termwriter.write(label)
+    termwriter.writetermlist(terms)
+    termwriter.write('\n')
+    termwriter.flush()
 
@@ -31,5 +31,8 @@ def map_multiply(ns, n):
         seq.append(Integer(v))
     return Sequence(seq)
 
-
-
+def positive_or_none(n):
+    assert isinstance(n, Integer)
+    if n.value() > 0:
+        return n
+    return None
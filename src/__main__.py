@@ -22,7 +22,7 @@ def create_output(module, path):
 
 def entrypoint(args):
     tree = parse(args.src) 
-    context = CompilationContext()
+    context = CompilationContext(hash_cons=args.hash_cons, lazy_match=args.lazy_match, decision_trees=args.decision_trees)
     tree, context = TopLevelProcessor(tree, context, debug_dump_ntgraph=args.debug_dump_ntgraph).run()
     if args.dump_ast:
         print(tree)
@@ -37,6 +37,9 @@ if __name__ == '__main__':
     parser.add_argument('-o', '--output-directory', help='Write RPython source to output directory, default rpyout', default= 'rpyout/')
     parser.add_argument('-dump-ast', action='store_true', help='Write spec to stdout')
     parser.add_argument('-debug-dump-ntgraph', action='store_true', help='Write Nt graph')
+    parser.add_argument('-hash-cons', action='store_true', help='Intern all terms so that structurally equal terms are shared')
+    parser.add_argument('-lazy-match', action='store_true', help='Generate pattern matchers that produce matches on demand')
+    parser.add_argument('-decision-trees', action='store_true', help='Check alternatives of non-terminals together, sharing common tests')
     args = parser.parse_args()
     entrypoint(args)
 
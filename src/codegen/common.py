@@ -2,6 +2,8 @@ import src.model.pattern as pattern
 import src.model.rpython as rpy
 
 ReadFromStdinAndParse = 'read_from_stdin_and_parse'
+ParseReductionOptions = 'parse_reduction_options'
+ReduceDeterministically = 'reduce_deterministically'
 
 class TermMethodTable:
     Value = 'value'
@@ -9,11 +11,17 @@ class TermMethodTable:
     Get = 'get'
     ReplaceWith = 'replacewith'
     ToString = 'tostring'
+    NtMembership = 'ntmembership'
+    AddNtMembership = 'addntmembership'
 
 class TermHelperFuncs:
     CopyPathAndReplaceLast = 'copy_path_and_replace_last'
+    CopyPathAndReplaceLastAt = 'copy_path_and_replace_last_at'
+    CopyPathAndReplaceLastWithHole = 'copy_path_and_replace_last_with_hole'
+    PlugHole = 'plughole'
     AssertTermListsEqual = 'asserttermlistsequal'
     AreTermsEqualPairwise = 'aretermsequalpairwise'
+    InternTerm = 'intern_term'
 
     TermIsNumber  = 'term_is_number'
     TermIsInteger = 'term_is_integer'
@@ -24,6 +32,12 @@ class TermHelperFuncs:
     TermIsBoolean = 'term_is_boolean'
     TermIsVariableNotOtherwiseMentioned = 'term_is_variable_not_otherwise_mentioned'
 
+    TermIsLiteralInteger = 'term_is_literal_integer'
+    TermIsLiteralFloat = 'term_is_literal_float'
+    TermIsLiteralBoolean = 'term_is_literal_boolean'
+    TermIsLiteralVariable = 'term_is_literal_variable'
+    TermIsLiteralString = 'term_is_literal_string'
+
     ConsumeInteger = 'consume_literal_integer'
     ConsumeFloat = 'consume_literal_float'
     ConsumeBoolean = 'consume_literal_boolean'
@@ -34,21 +48,153 @@ class TermHelperFuncs:
     PrintTermList = 'print_term_list'
 
 
+class ReductionGraphMethodTable:
+    AddTerm = 'addterm'
+    Expand = 'expand'
+    PrintSummary = 'print_summary'
+    ExpandFrontier = 'expandfrontier'
+    PrintFrontier = 'printfrontier'
+
+class InHolePosition:
+    OffPath = 0
+    Hole = 1
+    OnPath = 2
+
 class MatchHelperFuncs:
-    CombineMatches = 'combine_matches'
     PrintMatchList = 'print_match_list'
     CartesianProductAndCombineWith = 'match_cartesian_product_add_binding_to'
+    InHolePosition = 'inhole_position'
+    InHoleChildDepth = 'inhole_child_depth'
+    InHoleSubject = 'inhole_subject'
+    InHoleRoot = 'inhole_root'
+    InHoleDecomposeAll = 'inhole_decompose_all'
+    InHoleDecomposeRefocused = 'inhole_decompose_refocused'
 
 class MatchMethodTable:
     AddToBinding ='addtobinding'
-    AddKey = 'create_binding'
     IncreaseDepth = 'increasedepth'
     DecreaseDepth = 'decreasedepth'
     DeepCopy = 'deepcopy'
+    EmptyCopy = 'emptycopy'
     CompareKeys = 'comparekeys'
-    RemoveKey   = 'removebinding'
     GetBinding = 'getbinding'
 
+class MatchContinuationMethodTable:
+    Resume = 'resume'
+
+class PatternVariableCollector(pattern.PatternTransformer):
+    """
+    Collects pattern variables in the order of their first occurence (i.e. preorder traversal).
+    """
+    def __init__(self):
+        self.variables = []
+
+    def _add(self, sym):
+        if sym not in self.variables:
+            self.variables.append(sym)
+
+    def transformPatSequence(self, node):
+        for pat in node.seq:
+            self.transform(pat)
+        return node
+
+    def transformRepeat(self, node):
+        self.transform(node.pat)
+        return node
+
+    def transformInHole(self, node):
+        self.transform(node.pat1)
+        self.transform(node.pat2)
+        return node
+
+    def transformNt(self, node):
+        self._add(node.sym)
+        return node
+
+    def transformBuiltInPat(self, node):
+        if node.kind != pattern.BuiltInPatKind.Hole:
+            self._add(node.sym)
+        return node
+
+    def transformCheckConstraint(self, node):
+        return node
+
+    def collect(self, pat):
+        self.transform(pat)
+        return self.variables
+
+class PatternCanonicalizer(pattern.PatternTransformer):
+    """
+    Returns representation of the pattern with pattern variables replaced by their slots in the layout
+    or erased if layout is None. Generated code refers to pattern variables by their slots only, thus 
+    alpha-equivalent patterns, e.g. (e_1 + e_2) and (e_3 + e_4), share generated functions. Pattern 
+    variables are numbered in the order of their first occurence, so such patterns agree on slots.
+    """
+    def __init__(self, layout=None):
+        self.layout = layout
+
+    def _sym(self, sym):
+        if self.layout is None:
+            return '_'
+        return '#{}'.format(self.layout.slot(sym))
+
+    def transformPatSequence(self, node):
+        return 'PatSequence([{}])'.format(', '.join(self.transform(pat) for pat in node.seq))
+
+    def transformRepeat(self, node):
+        return 'Repeat({}, {})'.format(self.transform(node.pat), node.matchmode)
+
+    def transformInHole(self, node):
+        checks = node.constraintchecks if node.constraintchecks != None else []
+        return 'InHole({}, {}, [{}])'.format(self.transform(node.pat1), self.transform(node.pat2), 
+                ', '.join(self.transform(chck) for chck in checks))
+
+    def transformNt(self, node):
+        return 'Nt({}, {})'.format(node.prefix, self._sym(node.sym))
+
+    def transformBuiltInPat(self, node):
+        if node.kind == pattern.BuiltInPatKind.Hole:
+            return 'BuiltInPat({}, {})'.format(node.kind, node.prefix)
+        return 'BuiltInPat({}, {}, {})'.format(node.kind, node.prefix, self._sym(node.sym))
+
+    def transformCheckConstraint(self, node):
+        return 'CheckConstraint({} == {})'.format(self._sym(node.sym1), self._sym(node.sym2))
+
+    def transformLit(self, node):
+        return repr(node)
+
+    def canonicalize(self, pat):
+        return self.transform(pat)
+
+class MatchLayout:
+    """
+    Compile-time numbering of pattern variables. Each pattern variable is assigned a slot - index into the 
+    array of bindings of runtime Match object. Hidden variables are the ones used for constraint checking only.
+    name is the identifier of runtime MatchLayout object.
+    """
+    def __init__(self, name, syms, hidden=[]):
+        self.name = name
+        self.syms = list(syms)
+        self.hidden = hidden
+        self.slots = {}
+        for i, sym in enumerate(self.syms):
+            self.slots[sym] = i
+
+    def slot(self, sym):
+        assert sym in self.slots, 'unknown pattern variable {}'.format(sym)
+        return self.slots[sym]
+
+    def slotsof(self, pat):
+        return [self.slot(sym) for sym in PatternVariableCollector().collect(pat)]
+
+    def gen(self, modulebuilder):
+        # layout = MatchLayout([...names], [...visible])
+        names = [rpy.PyString(sym) for sym in self.syms]
+        visible = [rpy.PyBoolean(sym not in self.hidden) for sym in self.syms]
+        modulebuilder.AssignTo(rpy.PyId(self.name)).New('MatchLayout', rpy.PyList(*names), rpy.PyList(*visible))
+
+emptymatchlayout = MatchLayout('emptymatchlayout', [])
+
 # FIXME this shouldnt be here, need to reference TermKind of literal terms.
 class TermKind:
     Variable = 0
@@ -0,0 +1,135 @@
+import src.model.pattern as pattern
+import src.model.rpython as rpy
+
+from src.util import SymGen
+from src.context import CompilationContext
+from src.codegen.pattern import PatternIsaCodegen
+from src.codegen.common import TermMethodTable, PatternCanonicalizer
+
+class SequenceAlternativesCodegen:
+    """
+    Merges membership checks of sequence alternatives of the same length into a single function
+    f(term) -> bool. Each alternative is a conjunction of tests (position, element pattern), tests
+    shared between alternatives are evaluated at most once per term - their results are kept
+    in local variables (-1 if not evaluated yet, 0 or 1 otherwise). Within an alternative, literal
+    tests go first and then tests shared by the most alternatives.
+    """
+    def __init__(self, modulebuilder, context, languagename, symgen):
+        assert isinstance(context, CompilationContext)
+        self.modulebuilder = modulebuilder
+        self.context = context
+        self.languagename = languagename
+        self.symgen = symgen
+
+    def canmerge(self, pat):
+        # sequences of fixed length whose elements can be checked without computing matches.
+        if not isinstance(pat, pattern.PatSequence):
+            return False
+        isacodegen = PatternIsaCodegen(self.modulebuilder, pat, self.context, self.languagename, self.symgen)
+        for elem in pat:
+            if isinstance(elem, pattern.Repeat) or isinstance(elem, pattern.CheckConstraint):
+                return False
+            if isacodegen._requiresmatch(elem):
+                return False
+        return True
+
+    def _isany(self, pat):
+        return isinstance(pat, pattern.BuiltInPat) and pat.kind == pattern.BuiltInPatKind.Any
+
+    def run(self, pats):
+        assert len(pats) > 0
+        length = len(pats[0].seq)
+        for pat in pats:
+            assert self.canmerge(pat) and len(pat.seq) == length
+
+        key = 'decision {}'.format(' | '.join(PatternCanonicalizer().canonicalize(pat) for pat in pats))
+        nameof_this_func = self.context.get_function_for_pattern(self.languagename, key)
+        if nameof_this_func is not None:
+            return nameof_this_func
+        nameof_this_func = 'lang_{}_isa_alternatives_{}'.format(self.languagename, self.symgen.get())
+        self.context.add_function_for_pattern(self.languagename, key, nameof_this_func)
+
+        # number distinct tests, patterns are compared by their representation without pattern variables.
+        tests = {}
+        alternatives = []
+        for pat in pats:
+            alternative = []
+            for position, elem in enumerate(pat.seq):
+                if self._isany(elem):
+                    continue
+                k = (position, PatternCanonicalizer().canonicalize(elem))
+                if k not in tests:
+                    tests[k] = (len(tests), position, elem)
+                alternative.append(k)
+            alternatives.append(alternative)
+        counts = {}
+        for alternative in alternatives:
+            for k in alternative:
+                counts[k] = counts.get(k, 0) + 1
+        def testorder(k):
+            _, position, elem = tests[k]
+            return (not isinstance(elem, pattern.Lit), -counts[k], position)
+
+        # if not isinstance(term, Sequence):
+        #   return False
+        # tmp0 = term.length()
+        # if tmp0 != length:
+        #   return False
+        # known{k} = -1                 # for each test
+        # { for each alternative
+        #   if known{i} == -1:
+        #     tmp1 = term.get(position)
+        #     tmp2 = check(tmp1)
+        #     known{i} = 0
+        #     if tmp2 == True:
+        #       known{i} = 1
+        #   if known{i} == 1:
+        #     { ... same for the remaining tests of the alternative }
+        #       return True }
+        # return False
+        symgen = SymGen()
+        term = rpy.gen_pyid_for('term')
+        tmp0 = rpy.gen_pyid_temporaries(1, symgen)
+        known = dict((k, rpy.gen_pyid_for('known{}'.format(i))) for k, (i, _, _) in tests.items())
+
+        fb = rpy.BlockBuilder()
+        ifb = rpy.BlockBuilder()
+        ifb.Return(rpy.PyBoolean(False))
+        fb.If.NotIsInstance(term, 'Sequence').ThenBlock(ifb)
+
+        ifb = rpy.BlockBuilder()
+        ifb.Return(rpy.PyBoolean(False))
+        fb.AssignTo(tmp0).MethodCall(term, TermMethodTable.Length)
+        fb.If.NotEqual(tmp0, rpy.PyInt(length)).ThenBlock(ifb)
+
+        for k in sorted(tests.keys(), key=lambda k: tests[k][0]):
+            fb.AssignTo(known[k]).PyInt(-1)
+
+        for alternative in alternatives:
+            self._gen_alternative(fb, term, sorted(alternative, key=testorder), tests, known, symgen)
+        fb.Return(rpy.PyBoolean(False))
+
+        self.modulebuilder.SingleLineComment('isa {}'.format(' | '.join(repr(pat) for pat in pats)))
+        self.modulebuilder.Function(nameof_this_func).WithParameters(term).Block(fb)
+        return nameof_this_func
+
+    def _gen_alternative(self, fb, term, alternative, tests, known, symgen):
+        if len(alternative) == 0:
+            fb.Return(rpy.PyBoolean(True))
+            return
+        k = alternative[0]
+        _, position, elem = tests[k]
+
+        ifb1 = rpy.BlockBuilder()
+        tmp1 = rpy.gen_pyid_temporaries(1, symgen)
+        ifb1.AssignTo(tmp1).MethodCall(term, TermMethodTable.Get, rpy.PyInt(position))
+        tmp2 = PatternIsaCodegen(self.modulebuilder, elem, self.context, self.languagename, self.symgen)._gen_check(ifb1, elem, tmp1, symgen)
+        ifb1.AssignTo(known[k]).PyInt(0)
+        ifb2 = rpy.BlockBuilder()
+        ifb2.AssignTo(known[k]).PyInt(1)
+        ifb1.If.Equal(tmp2, rpy.PyBoolean(True)).ThenBlock(ifb2)
+        fb.If.Equal(known[k], rpy.PyInt(-1)).ThenBlock(ifb1)
+
+        ifb3 = rpy.BlockBuilder()
+        self._gen_alternative(ifb3, term, alternative[1:], tests, known, symgen)
+        fb.If.Equal(known[k], rpy.PyInt(1)).ThenBlock(ifb3)
@@ -0,0 +1,257 @@
+import src.model.pattern as pattern
+import src.model.rpython as rpy
+
+from src.context import CompilationContext
+from src.codegen.common import TermKind, TermMethodTable
+
+class Discriminator:
+    """
+    Shape of terms a pattern may match - kinds of terms (None if any term may be matched), exact
+    or minimal length of sequences and discriminators of sequence elements at fixed positions.
+    variable is set for variable literals.
+    """
+    def __init__(self, kinds=None, length=None, minlength=0, elements=None, variable=None):
+        self.kinds = kinds
+        self.length = length
+        self.minlength = minlength
+        self.elements = elements if elements is not None else {}
+        self.variable = variable
+
+    def mayhavekind(self, kind):
+        return self.kinds is None or kind in self.kinds
+
+    def issequence(self):
+        return self.kinds is not None and self.kinds == set([TermKind.Sequence])
+
+    def literalat(self, path):
+        # variable literal the subterm at the path must be equal to, None if unknown.
+        disc = self
+        for i in path:
+            if i not in disc.elements:
+                return None
+            disc = disc.elements[i]
+        return disc.variable
+
+    def literalpaths(self, prefix=()):
+        for i, disc in self.elements.items():
+            if disc.variable is not None:
+                yield prefix + (i,)
+            for path in disc.literalpaths(prefix + (i,)):
+                yield path
+
+class PatternDiscriminator:
+    def __init__(self, context, languagename):
+        assert isinstance(context, CompilationContext)
+        self.context = context
+        self.languagename = languagename
+        self.inprogress = set([])
+
+    def discriminate(self, pat):
+        if isinstance(pat, pattern.Nt):
+            return self._discriminatent(pat.prefix)
+        if isinstance(pat, pattern.PatSequence):
+            return self._discriminatesequence(pat)
+        if isinstance(pat, pattern.BuiltInPat):
+            kinds = {
+                pattern.BuiltInPatKind.Number:  [TermKind.Integer, TermKind.Decimal],
+                pattern.BuiltInPatKind.Integer: [TermKind.Integer],
+                pattern.BuiltInPatKind.Natural: [TermKind.Integer],
+                pattern.BuiltInPatKind.Float:   [TermKind.Decimal],
+                pattern.BuiltInPatKind.String:  [TermKind.String],
+                pattern.BuiltInPatKind.Boolean: [TermKind.Boolean],
+                pattern.BuiltInPatKind.Hole:    [TermKind.Hole],
+                pattern.BuiltInPatKind.VariableNotOtherwiseDefined: [TermKind.Variable],
+                pattern.BuiltInPatKind.VariableExcept: [TermKind.Variable],
+            }
+            if pat.kind in kinds:
+                return Discriminator(set(kinds[pat.kind]))
+            return Discriminator()
+        if isinstance(pat, pattern.Lit):
+            kinds = {
+                pattern.LitKind.Integer:  TermKind.Integer,
+                pattern.LitKind.Float:    TermKind.Decimal,
+                pattern.LitKind.String:   TermKind.String,
+                pattern.LitKind.Boolean:  TermKind.Boolean,
+                pattern.LitKind.Variable: TermKind.Variable,
+            }
+            variable = pat.lit if pat.kind == pattern.LitKind.Variable else None
+            return Discriminator(set([kinds[pat.kind]]), variable=variable)
+        # hole of in-hole pattern may be at the root, thus it may match any term.
+        return Discriminator()
+
+    def _discriminatent(self, prefix):
+        # union of kinds of all alternatives.
+        if prefix in self.inprogress:
+            return Discriminator()
+        self.inprogress.add(prefix)
+        kinds = set([])
+        for pat in self.context.get_nt_definition(self.languagename, prefix).patterns:
+            disc = self.discriminate(pat)
+            if disc.kinds is None:
+                kinds = None
+                break
+            kinds.update(disc.kinds)
+        self.inprogress.remove(prefix)
+        return Discriminator(kinds)
+
+    def _discriminatesequence(self, seq):
+        elements = {}
+        length = 0
+        hasrepeat = False
+        for pat in seq:
+            if isinstance(pat, pattern.CheckConstraint):
+                continue
+            if isinstance(pat, pattern.Repeat):
+                hasrepeat = True
+                continue
+            # positions of elements after the first repeat are not fixed.
+            if not hasrepeat:
+                elements[length] = self.discriminate(pat)
+            length += 1
+        if hasrepeat:
+            return Discriminator(set([TermKind.Sequence]), minlength=length, elements=elements)
+        return Discriminator(set([TermKind.Sequence]), length=length, minlength=length, elements=elements)
+
+
+class DiscriminationIndexCodegen:
+    """
+    Builds discrimination index for the list of alternative patterns - either alternatives of
+    non-terminal definition, reduction cases or metafunction clauses. Alternatives are split into
+    buckets keyed on the kind of the term and the variable at the fixed path within the term.
+    Alternatives in each bucket keep their original order. The path is chosen to distinguish
+    the most alternatives.
+
+    Generated code looks up the bucket with DiscriminationIndex.lookup and tests the bucket id,
+    RPython turns such chains of integer comparisons into a switch. Within buckets of sequences
+    alternatives are additionally guarded by the length of the term.
+    """
+    def __init__(self, modulebuilder, context, languagename, symgen):
+        assert isinstance(context, CompilationContext)
+        self.modulebuilder = modulebuilder
+        self.context = context
+        self.languagename = languagename
+        self.symgen = symgen
+
+    def _choosepath(self, discs):
+        paths = set([])
+        for disc in discs:
+            paths.update(disc.literalpaths())
+        best, bestcount = None, 0
+        for path in sorted(paths, key=lambda p: (len(p), p)):
+            count = len(set(disc.literalat(path) for disc in discs if disc.literalat(path) is not None))
+            if count > bestcount:
+                best, bestcount = path, count
+        return best
+
+    def _bucket(self, discs, kind, path, literal):
+        bucket = []
+        for i, disc in enumerate(discs):
+            if not disc.mayhavekind(kind):
+                continue
+            if kind == TermKind.Sequence and path is not None and disc.kinds is not None:
+                if disc.literalat(path) not in (None, literal):
+                    continue
+            bucket.append(i)
+        return bucket
+
+    def _genindex(self, pats):
+        # Returns index, list of buckets - lists of alternative indices and list of flags telling 
+        # whether terms in the bucket are sequences. The last bucket is used for terms of kinds not 
+        # matched by any alternative. Returns None if the index would not rule out any alternatives.
+        if len(pats) < 2:
+            return None, None, None
+        discs = [PatternDiscriminator(self.context, self.languagename).discriminate(pat) for pat in pats]
+        path = self._choosepath(discs)
+
+        kinds = set([])
+        for disc in discs:
+            if disc.kinds is not None:
+                kinds.update(disc.kinds)
+        literals = []
+        if path is not None:
+            for disc in discs:
+                literal = disc.literalat(path)
+                if literal is not None and literal not in literals:
+                    literals.append(literal)
+
+        keys, buckets, sequencebuckets = [], [], []
+        for literal in literals:
+            keys.append(('literal', literal))
+            buckets.append(self._bucket(discs, TermKind.Sequence, path, literal))
+            sequencebuckets.append(True)
+        for kind in sorted(kinds):
+            keys.append(('kind', kind))
+            buckets.append(self._bucket(discs, kind, path, None))
+            sequencebuckets.append(kind == TermKind.Sequence)
+        buckets.append([i for i, disc in enumerate(discs) if disc.kinds is None])
+        sequencebuckets.append(False)
+
+        if all(len(bucket) == len(pats) for bucket in buckets):
+            return None, None, None
+
+        # index = DiscriminationIndex([path...], len(buckets) - 1)
+        # tmp = index.addliteral(literal, bucketid)
+        # tmp = index.addkind(kind, bucketid)
+        index = rpy.gen_pyid_for('lang_{}_discrimination_index_{}'.format(self.languagename, self.symgen.get()))
+        tmp = rpy.gen_pyid_for('{}_tmp'.format(index.name))
+        pathlist = rpy.PyList(*[rpy.PyInt(i) for i in (path if path is not None else [])])
+        self.modulebuilder.AssignTo(index).New('DiscriminationIndex', pathlist, rpy.PyInt(len(buckets) - 1))
+        for bucketid, (keykind, key) in enumerate(keys):
+            if keykind == 'literal':
+                self.modulebuilder.AssignTo(tmp).MethodCall(index, 'addliteral', rpy.PyString(key), rpy.PyInt(bucketid))
+            else:
+                self.modulebuilder.AssignTo(tmp).MethodCall(index, 'addkind', rpy.PyInt(key), rpy.PyInt(bucketid))
+        return index, buckets, sequencebuckets
+
+    def emit(self, fb, term, pats, symgen, emitalternative, emitexit, emitbucket=None):
+        """
+        Emits code trying alternatives pats that may match the term. emitalternative(fb, i) emits 
+        code trying i-th alternative, emitexit(fb) emits code following the last alternative.
+        If given, emitbucket(fb, indices, length) emits code trying all alternatives of the bucket 
+        instead, length is variable holding the length of the term if it is known to be a sequence.
+        """
+        def trybucket(fb, alternatives, length):
+            if emitbucket is not None:
+                emitbucket(fb, alternatives, length)
+                return
+            for i in alternatives:
+                self.emitguarded(fb, pats[i], length, lambda ab: emitalternative(ab, i))
+
+        index, buckets, sequencebuckets = self._genindex(pats)
+        if index is None:
+            trybucket(fb, list(range(len(pats))), None)
+            emitexit(fb)
+            return
+
+        # bucket = index.lookup(term)
+        # if bucket == 0:
+        #   { alternatives in bucket 0 }
+        #   { exit }
+        # ...
+        # { alternatives in the last bucket }
+        # { exit }
+        bucket = rpy.gen_pyid_temporaries(1, symgen)
+        fb.AssignTo(bucket).MethodCall(index, 'lookup', term)
+        for bucketid, alternatives in enumerate(buckets):
+            ifb = fb if bucketid == len(buckets) - 1 else rpy.BlockBuilder()
+            length = None
+            if sequencebuckets[bucketid]:
+                length = rpy.gen_pyid_temporaries(1, symgen)
+                ifb.AssignTo(length).MethodCall(term, TermMethodTable.Length)
+            trybucket(ifb, alternatives, length)
+            emitexit(ifb)
+            if ifb is not fb:
+                fb.If.Equal(bucket, rpy.PyInt(bucketid)).ThenBlock(ifb)
+
+    def emitguarded(self, fb, pat, length, emit):
+        # alternatives matching sequences are skipped if length of the term is wrong.
+        disc = PatternDiscriminator(self.context, self.languagename).discriminate(pat)
+        if length is None or not disc.issequence() or (disc.length is None and disc.minlength == 0):
+            emit(fb)
+            return
+        ifb = rpy.BlockBuilder()
+        emit(ifb)
+        if disc.length is not None:
+            fb.If.Equal(length, rpy.PyInt(disc.length)).ThenBlock(ifb)
+        else:
+            fb.If.GreaterEqual(length, rpy.PyInt(disc.minlength)).ThenBlock(ifb)
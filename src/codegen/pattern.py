@@ -2,11 +2,153 @@ import src.model.pattern as pattern
 import src.model.rpython as rpy
 
 from src.util import SymGen
+from src.preprocess.pattern.solveholereachability import NumberOfHoles
 from src.context import CompilationContext
 
 from src.codegen.common import TermHelperFuncs, MatchHelperFuncs, \
-                          MatchMethodTable, TermKind, \
-                          TermMethodTable
+                          MatchMethodTable, TermKind, InHolePosition, \
+                          TermMethodTable, MatchLayout, PatternVariableCollector, \
+                          MatchContinuationMethodTable, PatternCanonicalizer
+
+# generate isa function for variable-not-otherwise-mentioned here because we need to reference
+# compile-time generated language-specific array 'langname_variable_mentioned'
+def gen_isa_function_for_variable_not_otherwise_mentioned(modulebuilder, context, languagename, pat):
+    if context.get_isa_function_name(languagename, pat.prefix) is None:
+        nameof_this_func = 'lang_{}_isa_builtin_variable_not_othewise_mentioned'.format(languagename)
+        context.add_isa_function_name(languagename, pat.prefix, nameof_this_func)
+
+        symgen = SymGen()
+        var, _ = context.get_variables_mentioned(languagename)
+        var = rpy.gen_pyid_for(var)
+        term = rpy.gen_pyid_for('term')
+        tmp0, tmp1 = rpy.gen_pyid_temporaries(2, symgen)
+
+        fb = rpy.BlockBuilder()
+        fb.AssignTo(tmp0).FunctionCall(TermHelperFuncs.TermIsVariableNotOtherwiseMentioned, term, var)
+        fb.Return(tmp0)
+
+        modulebuilder.SingleLineComment('#Is this term {}?'.format(pat.prefix))
+        modulebuilder.Function(nameof_this_func).WithParameters(term).Block(fb)
+        """
+        # tmp0 = term.kind()
+        # if tmp0 == TermKind.Variable:
+        #   tmp1 = term.value()
+        #   if tmp1 not in var:
+        #     return True
+        # return False
+        # This one is different from other built-in isa funcs because we do set membership test here.
+        ifb2 = rpy.BlockBuilder()
+        ifb2.Return(rpy.PyBoolean(True))
+
+        ifb1 = rpy.BlockBuilder()
+        ifb1.AssignTo(tmp1).MethodCall(term, TermMethodTable.Value)
+        ifb1.If.NotContains(tmp1).In(var).ThenBlock(ifb2)
+
+        fb = rpy.BlockBuilder()
+        fb.If.IsInstance(term, 'Variable').ThenBlock(ifb1)
+        fb.Return(rpy.PyBoolean(False))
+
+        modulebuilder.SingleLineComment('#Is this term {}?'.format(pat.prefix))
+        modulebuilder.Function(nameof_this_func).WithParameters(term).Block(fb)
+        """
+
+def gen_inhole_decompositions_function(modulebuilder, context, languagename, symgen, pat1, contextcheck):
+    # Generates function returning InHoleDecompositions of the term - subterms the hole of pat1 
+    # may be placed at. Only the last computed decompositions are kept, this is enough as 
+    # reduction cases with the same context pattern are matched against the same term one 
+    # after another. 
+    key = 'decompositions {}'.format(PatternCanonicalizer().canonicalize(pat1))
+    nameof_this_func = context.get_function_for_pattern(languagename, key)
+    if nameof_this_func is not None:
+        return nameof_this_func
+    nameof_this_func = 'lang_{}_inhole_decompositions_{}'.format(languagename, symgen.get())
+    context.add_function_for_pattern(languagename, key, nameof_this_func)
+    traversefuncname = '{}_traverse'.format(nameof_this_func)
+    cachename = rpy.gen_pyid_for('{}_cache'.format(nameof_this_func))
+    modulebuilder.AssignTo(cachename).New('InHoleDecompositionsCache')
+
+    # def traverse(term, path, indices, decompositions):
+    #   tmp0 = inhole_root(path, term)
+    #   tmp1 = contextcheck(tmp0, indices, 0, False)
+    #   if tmp1 == True:
+    #     tmp2 = decompositions.add(term, path, indices)
+    #   if isinstance(term, Sequence):
+    #     tmp2 = path.append(term)
+    #     tmp3 = term.length()
+    #     tmp0 = inhole_root(path, term)
+    #     for tmp4 in range(tmp3):
+    #       tmp2 = indices.append(tmp4)
+    #       tmp1 = contextcheck(tmp0, indices, 0, True) # skip children the hole cannot be within.
+    #       if tmp1 == True:
+    #         tmp5 = term.get(tmp4)
+    #         tmp2 = traverse(tmp5, path, indices, decompositions)
+    #       tmp2 = indices.pop()
+    #     tmp2 = path.pop()
+    tmpsymgen = SymGen()
+    term, path, indices, decompositions = rpy.gen_pyid_for('term', 'path', 'indices', 'decompositions')
+    tmp0, tmp1, tmp2, tmp3, tmp4, tmp5, tmp6, tmp7 = rpy.gen_pyid_temporaries(8, tmpsymgen)
+
+    ifb0 = rpy.BlockBuilder()
+    ifb0.AssignTo(tmp2).MethodCall(decompositions, 'add', term, path, indices)
+
+    ifb1 = rpy.BlockBuilder()
+    ifb1.AssignTo(tmp5).MethodCall(term, TermMethodTable.Get, tmp4)
+    ifb1.AssignTo(tmp6).FunctionCall(traversefuncname, tmp5, path, indices, decompositions)
+
+    forb = rpy.BlockBuilder()
+    forb.AssignTo(tmp6).MethodCall(indices, 'append', tmp4)
+    forb.AssignTo(tmp1).FunctionCall(contextcheck, tmp0, indices, rpy.PyInt(0), rpy.PyBoolean(True))
+    forb.If.Equal(tmp1, rpy.PyBoolean(True)).ThenBlock(ifb1)
+    forb.AssignTo(tmp6).MethodCall(indices, 'pop')
+
+    ifb2 = rpy.BlockBuilder()
+    ifb2.AssignTo(tmp6).MethodCall(path, 'append', term)
+    ifb2.AssignTo(tmp3).MethodCall(term, TermMethodTable.Length)
+    ifb2.AssignTo(tmp0).FunctionCall(MatchHelperFuncs.InHoleRoot, path, term)
+    ifb2.For(tmp4).InRange(tmp3).Block(forb)
+    ifb2.AssignTo(tmp7).MethodCall(path, 'pop')
+
+    fb = rpy.BlockBuilder()
+    fb.AssignTo(tmp0).FunctionCall(MatchHelperFuncs.InHoleRoot, path, term)
+    fb.AssignTo(tmp1).FunctionCall(contextcheck, tmp0, indices, rpy.PyInt(0), rpy.PyBoolean(False))
+    fb.If.Equal(tmp1, rpy.PyBoolean(True)).ThenBlock(ifb0)
+    fb.If.IsInstance(term, 'Sequence').ThenBlock(ifb2)
+
+    modulebuilder.SingleLineComment('decompositions {}'.format(repr(pat1)))
+    modulebuilder.Function(traversefuncname).WithParameters(term, path, indices, decompositions).Block(fb)
+
+    # def decompose(term):
+    #   decompositions = inhole_decompose_refocused(term, cache, traverse, contextcheck)
+    #   if decompositions is not None:
+    #     return decompositions
+    #   decompositions = cache.get(term)
+    #   if decompositions is None:
+    #     decompositions = InHoleDecompositions(term)
+    #     tmp0 = traverse(term, [], [], decompositions)
+    #     tmp0 = cache.put(decompositions)
+    #   return decompositions
+    tmpsymgen = SymGen()
+    tmp0 = rpy.gen_pyid_temporaries(1, tmpsymgen)
+
+    ifb0 = rpy.BlockBuilder()
+    ifb0.Return(decompositions)
+
+    ifb = rpy.BlockBuilder()
+    ifb.AssignTo(decompositions).New('InHoleDecompositions', term)
+    ifb.AssignTo(tmp0).FunctionCall(traversefuncname, term, rpy.PyList(), rpy.PyList(), decompositions)
+    ifb.AssignTo(tmp0).MethodCall(cachename, 'put', decompositions)
+
+    fb = rpy.BlockBuilder()
+    fb.AssignTo(decompositions).FunctionCall(MatchHelperFuncs.InHoleDecomposeRefocused, term, cachename,
+            rpy.PyId(traversefuncname), rpy.PyId(contextcheck))
+    fb.If.IsNotNone(decompositions).ThenBlock(ifb0)
+    fb.AssignTo(decompositions).MethodCall(cachename, 'get', term)
+    fb.If.IsNone(decompositions).ThenBlock(ifb)
+    fb.Return(decompositions)
+
+    modulebuilder.Function(nameof_this_func).WithParameters(term).Block(fb)
+    return nameof_this_func
+
 
 class PatternCodegen(pattern.PatternTransformer):
     def __init__(self, modulebuilder, pat, context, languagename, symgen):
@@ -18,38 +160,51 @@ class PatternCodegen(pattern.PatternTransformer):
         self.languagename = languagename
         self.symgen = symgen
 
-    def _assignable_symbols_to_rpylist(self, assignable_symbols):
-        assignable_syms = map(lambda s: rpy.PyString(s), assignable_symbols)
-        return rpy.PyList(*assignable_syms)
+    # Generated code refers to pattern variables by their slots, thus functions can only be shared
+    # between patterns that agree on slot assignment.
+    def _key(self, pat):
+        return PatternCanonicalizer(self.layout).canonicalize(pat)
 
-    def run(self):
-        if self.context.get_function_for_pattern(self.languagename, repr(self.pattern)) is None:
-            self.transform(self.pattern)
+    def _slot(self, sym):
+        return rpy.PyInt(self.layout.slot(sym))
 
+    def _slots_to_rpylist(self, syms):
+        return rpy.PyList(*[self._slot(sym) for sym in syms])
+
+    def run(self):
         if self.context.get_toplevel_function_for_pattern(self.languagename, repr(self.pattern)) is None:
             nameof_this_func = 'lang_{}_{}_toplevel'.format(self.languagename, self.symgen.get('pat'))
             self.context.add_toplevel_function_for_pattern(self.languagename, repr(self.pattern), nameof_this_func)
 
-            assignable_symbols = self.pattern.getattribute(pattern.PatternAttribute.PatternVariables)
+            # number pattern variables. Variables introduced by constraint checking are not part of the match.
+            try: 
+                symstoremove = self.pattern.getattribute(pattern.PatternAttribute.PatternVariablesToRemove)
+            except: 
+                symstoremove = []
+            syms = PatternVariableCollector().collect(self.pattern)
+            self.layout = MatchLayout('{}_layout'.format(nameof_this_func), syms, symstoremove)
+            self.layout.gen(self.modulebuilder)
+            self.context.add_match_layout_for_pattern(self.languagename, repr(self.pattern), self.layout)
+
+            if self.context.lazy_match:
+                self._gen_lazy_toplevel(nameof_this_func)
+                return self.pattern
+
+            if self.context.get_function_for_pattern(self.languagename, self._key(self.pattern)) is None:
+                self.transform(self.pattern)
+
             symgen = SymGen()
 
-            func2call = self.context.get_function_for_pattern(self.languagename, repr(self.pattern))
+            func2call = self.context.get_function_for_pattern(self.languagename, self._key(self.pattern))
 
             term, match, matches, ret = rpy.gen_pyid_for('term', 'match', 'matches', 'ret')
             m, h, t = rpy.gen_pyid_for('m', 'h', 't')
             tmp0, tmp1 = rpy.gen_pyid_temporaries(2, symgen)
 
             forb = rpy.BlockBuilder()
-            try: 
-                symstoremove = self.pattern.getattribute(pattern.PatternAttribute.PatternVariablesToRemove)
-                for sym in symstoremove:
-                    tmpi = rpy.gen_pyid_temporaries(1, symgen)
-                    forb.AssignTo(tmpi).MethodCall(m, MatchMethodTable.RemoveKey, rpy.PyString(sym))
-            except: 
-                pass
             forb.AssignTo(tmp0).MethodCall(ret, 'append', m)
             fb = rpy.BlockBuilder()
-            fb.AssignTo(match).New('Match', self._assignable_symbols_to_rpylist(assignable_symbols))
+            fb.AssignTo(match).New('Match', rpy.PyId(self.layout.name))
             fb.AssignTo(matches).FunctionCall(func2call, term, match, rpy.PyInt(0), rpy.PyInt(1))
             fb.AssignTo(ret).PyList()
             fb.For(m, h, t).In(matches).Block(forb)
@@ -60,6 +215,51 @@ class PatternCodegen(pattern.PatternTransformer):
 
         return self.pattern
 
+    def runfirst(self):
+        """
+        Returns the name of function f(term) -> Match finding the first match of the pattern, None 
+        if the term does not match. Lazy matcher is generated for the pattern even if patterns are 
+        matched eagerly.
+        """
+        self.run()
+        nameof_first_func = self.context.get_first_match_function_for_pattern(self.languagename, repr(self.pattern))
+        if nameof_first_func is None:
+            nameof_this_func = self.context.get_toplevel_function_for_pattern(self.languagename, repr(self.pattern))
+            self.layout = self.context.get_match_layout_for_pattern(self.languagename, repr(self.pattern))
+            nameof_first_func = self._gen_lazy_toplevel(nameof_this_func, firstonly=True)
+        return nameof_first_func
+
+    def _gen_lazy_toplevel(self, nameof_this_func, firstonly=False):
+        func2call = PatternLazyCodegen(self.modulebuilder, self.context, self.languagename, self.symgen, self.layout).run(self.pattern)
+
+        # def toplevel(term):
+        #   match = Match(layout)
+        #   tmp0 = MatchCollector()
+        #   tmp1 = lazymatch(term, match, 0, 1, tmp0)
+        #   tmp2 = tmp0.getmatches()
+        #   return tmp2
+        # First match function is the same, FirstMatch stops matching once the match is found.
+        nameof_first_func = '{}_first'.format(nameof_this_func)
+        self.context.add_first_match_function_for_pattern(self.languagename, repr(self.pattern), nameof_first_func)
+        functions = [(nameof_first_func, 'FirstMatch', 'getmatch')]
+        if not firstonly:
+            functions.insert(0, (nameof_this_func, 'MatchCollector', 'getmatches'))
+        for functionname, collector, getter in functions:
+            symgen = SymGen()
+            term, match = rpy.gen_pyid_for('term', 'match')
+            tmp0, tmp1, tmp2 = rpy.gen_pyid_temporaries(3, symgen)
+
+            fb = rpy.BlockBuilder()
+            fb.AssignTo(match).New('Match', rpy.PyId(self.layout.name))
+            fb.AssignTo(tmp0).New(collector)
+            fb.AssignTo(tmp1).FunctionCall(func2call, term, match, rpy.PyInt(0), rpy.PyInt(1), tmp0)
+            fb.AssignTo(tmp2).MethodCall(tmp0, getter)
+            fb.Return(tmp2)
+
+            self.modulebuilder.SingleLineComment('toplevel {}'.format(repr(self.pattern)))
+            self.modulebuilder.Function(functionname).WithParameters(term).Block(fb)
+        return nameof_first_func
+
     # Most matching functions for builtins/nt are the same - call isa function on term and 
     # add binding.
     def _gen_match_function_for_primitive(self, functionname, isafunction, patstr, sym=None):
@@ -75,7 +275,7 @@ class PatternCodegen(pattern.PatternTransformer):
 
         ifb1 = rpy.BlockBuilder()
         if sym is not None:
-            ifb1.AssignTo(tmp0).MethodCall(match, MatchMethodTable.AddToBinding, rpy.PyString(sym), term)
+            ifb1.AssignTo(tmp0).MethodCall(match, MatchMethodTable.AddToBinding, self._slot(sym), term)
         ifb1.AssignTo(head).Add(head, rpy.PyInt(1))
         ifb1.Return(rpy.PyList( rpy.PyTuple(match, head, tail) ))
 
@@ -89,14 +289,14 @@ class PatternCodegen(pattern.PatternTransformer):
 
     def transformRepeat(self, repeat):
         assert isinstance(repeat, pattern.Repeat)
-        if self.context.get_function_for_pattern(self.languagename, repr(repeat)) is None:
+        if self.context.get_function_for_pattern(self.languagename, self._key(repeat)) is None:
             match_fn = 'match_{}_term_{}'.format(self.languagename, self.symgen.get())
-            self.context.add_function_for_pattern(self.languagename, repr(repeat), match_fn)
+            self.context.add_function_for_pattern(self.languagename, self._key(repeat), match_fn)
 
             # codegen enclosed pattern 
             self.transform(repeat.pat)
 
-            functionname = self.context.get_function_for_pattern(self.languagename, repr(repeat.pat))
+            functionname = self.context.get_function_for_pattern(self.languagename, self._key(repeat.pat))
 
             # retrieve all bindable elements
             assignable_symbols = repeat.getattribute(pattern.PatternAttribute.PatternVariables)
@@ -105,24 +305,10 @@ class PatternCodegen(pattern.PatternTransformer):
             term, match, head, tail = rpy.gen_pyid_for('term', 'match', 'head', 'tail')
             if repeat.matchmode == pattern.RepeatMatchMode.Deterministic:
                 
-                tmp0, tmp1, tmp2, tmp3, tmp4 = rpy.gen_pyid_temporaries(5, symgen)
-
-                # tmp0 = match.increasedepth(...)
-                # while True:
-                #   if head == tail:
-                #     break
-                #   tmp1 = term.get[head]
-                #   tmp2 = match_term(tmp1, match, head, tail)
-                #   if len(tmp2) == 0:
-                #     break
-                #   if len(tmp2) != 1:
-                #     raise Exception
-                #   tmp3 = tmp2[0]
-                #   match = tmp3[0]
-                #   head  = tmp3[1]
-                # tmp4 = match.decreasedepth(...)
-                # return (match, head, tail)
+                tmp0, tmp1, tmp2, tmp3, tmp4, tmp5 = rpy.gen_pyid_temporaries(6, symgen)
 
+                # Sequence and in-hole patterns may bind some variables before failing to match. Unless
+                # enclosed pattern binds the term only on success, match has to be copied.
                 # tmp0 = match.increasedepth(...)
                 # outmatches = []
                 # matches = [(tmp0, head, tail)]
@@ -130,13 +316,13 @@ class PatternCodegen(pattern.PatternTransformer):
                 #   nmatches = []
                 #   for m, h, t in matches:
                 #     if h == t:
-                #       tmp1 = (m,h,t)
-                #       tmp1 = completedmatches.append()
+                #       tmp1 = outmatches.append((m,h,t))
                 #       continue
                 #     tmp2 = term.get[h]
-                #     tmp3 = match_term(tmp2, m, h, t) 
+                #     tmp5 = m.copy()       # if needed
+                #     tmp3 = match_term(tmp2, tmp5, h, t) 
                 #     if len(tmp3) == 0:
-                #       completedmatches.append((m,h,t))
+                #       tmp1 = outmatches.append((m,h,t))
                 #       continue
                 #     nmatches = nmatches + tmp3
                 #   matches = nmatches 
@@ -147,19 +333,21 @@ class PatternCodegen(pattern.PatternTransformer):
                 m, h, t = rpy.gen_pyid_for('m', 'h', 't')
 
                 ifb1 = rpy.BlockBuilder()
-                ifb1.AssignTo(tmp1).PyTuple(m, h, t)
-                ifb1.AssignTo(tmp1).MethodCall(outmatches, 'append', tmp1)
+                ifb1.AssignTo(tmp1).MethodCall(outmatches, 'append', rpy.PyTuple(m, h, t))
                 ifb1.Continue
 
                 ifb2 = rpy.BlockBuilder()
-                ifb2.AssignTo(tmp4).PyTuple(m, h, t)
-                ifb2.AssignTo(tmp4).MethodCall(outmatches, 'append', tmp4)
+                ifb2.AssignTo(tmp1).MethodCall(outmatches, 'append', rpy.PyTuple(m, h, t))
                 ifb2.Continue
 
                 forb1 = rpy.BlockBuilder()
                 forb1.If.Equal(h, t).ThenBlock(ifb1)
                 forb1.AssignTo(tmp2).MethodCall(term, TermMethodTable.Get, h)
-                forb1.AssignTo(tmp3).FunctionCall(functionname, tmp2, m, h, t)
+                if isinstance(repeat.pat, (pattern.Nt, pattern.BuiltInPat, pattern.Lit)):
+                    forb1.AssignTo(tmp3).FunctionCall(functionname, tmp2, m, h, t)
+                else:
+                    forb1.AssignTo(tmp5).MethodCall(m, MatchMethodTable.DeepCopy)
+                    forb1.AssignTo(tmp3).FunctionCall(functionname, tmp2, tmp5, h, t)
                 forb1.If.LengthOf(tmp3).Equal(rpy.PyInt(0)).ThenBlock(ifb2)
                 forb1.AssignTo(nmatches).Add(nmatches, tmp3)
 
@@ -172,12 +360,12 @@ class PatternCodegen(pattern.PatternTransformer):
                 if len(assignable_symbols) != 0:
                     forb2 = rpy.BlockBuilder()
                     for bindable in assignable_symbols:
-                        forb2.AssignTo(tmp4).MethodCall(m, MatchMethodTable.DecreaseDepth, rpy.PyString(bindable))
+                        forb2.AssignTo(tmp4).MethodCall(m, MatchMethodTable.DecreaseDepth, self._slot(bindable))
 
 
                 fb = rpy.BlockBuilder()
                 for bindable in assignable_symbols:
-                    fb.AssignTo(tmp0).MethodCall(match, MatchMethodTable.IncreaseDepth, rpy.PyString(bindable))
+                    fb.AssignTo(tmp0).MethodCall(match, MatchMethodTable.IncreaseDepth, self._slot(bindable))
                 fb.AssignTo(outmatches).PyList()
                 fb.AssignTo(matches).PyList( rpy.PyTuple(match, head, tail) )
                 fb.While.LengthOf(matches).NotEqual(rpy.PyInt(0)).Block(whb)
@@ -189,23 +377,24 @@ class PatternCodegen(pattern.PatternTransformer):
                 self.modulebuilder.Function(match_fn).WithParameters(term, match, head, tail).Block(fb)
 
             if repeat.matchmode == pattern.RepeatMatchMode.NonDetermininstic:
-                matches, queue = rpy.gen_pyid_for('matches', 'queue')
+                matches, cursor = rpy.gen_pyid_for('matches', 'cursor')
                 m, h, t = rpy.gen_pyid_for('m', 'h', 't')
                 tmp0, tmp1, tmp2, tmp3, tmp4 = rpy.gen_pyid_temporaries(5, symgen)
 
+                # matches is used as a worklist - every match is extended by one more term after all 
+                # matches preceding it, results are appended in place.
                 # tmp0 = match.increasedepth(...)
-                # tmp1 = (match, head, tail)
-                # matches = [ tmp1 ]
-                # queue   = [ tmp1 ]
-                # while len(queue) != 0:
-                #   m, h, t = queue.pop(0)
+                # matches = [ (match, head, tail) ]
+                # cursor = 0
+                # while len(matches) > cursor:
+                #   m, h, t = matches[cursor]
+                #   cursor = cursor + 1
                 #   if h == t:
                 #      continue
                 #   m = m.copy()
                 #   tmp2 = term.get[h]
                 #   tmp3 = match_term(tmp2, m, h, t)
-                #   matches = matches + tmp3
-                #   queue   = queue + tmp3
+                #   tmp1 = matches.extend(tmp3)
                 # for m, h, t in matches:
                 #   tmp4 = m.decreasedepth(...)
                 # return matches
@@ -213,26 +402,25 @@ class PatternCodegen(pattern.PatternTransformer):
                 ifb.Continue
 
                 wb = rpy.BlockBuilder()
-                wb.AssignTo(m, h, t).MethodCall(queue, 'pop', rpy.PyInt(0))
+                wb.AssignTo(m, h, t).ArrayGet(matches, cursor)
+                wb.AssignTo(cursor).Add(cursor, rpy.PyInt(1))
                 wb.If.Equal(h, t).ThenBlock(ifb)
                 wb.AssignTo(m).MethodCall(m, MatchMethodTable.DeepCopy)
                 wb.AssignTo(tmp2).MethodCall(term, TermMethodTable.Get, h)
                 wb.AssignTo(tmp3).FunctionCall(functionname, tmp2, m, h, t)
-                wb.AssignTo(matches).Add(matches, tmp3)
-                wb.AssignTo(queue).Add(queue, tmp3)
+                wb.AssignTo(tmp1).MethodCall(matches, 'extend', tmp3)
 
                 if len(assignable_symbols) != 0:
                     forb = rpy.BlockBuilder()
                     for bindable in assignable_symbols:
-                        forb.AssignTo(tmp4).MethodCall(m, MatchMethodTable.DecreaseDepth, rpy.PyString(bindable))
+                        forb.AssignTo(tmp4).MethodCall(m, MatchMethodTable.DecreaseDepth, self._slot(bindable))
 
                 fb = rpy.BlockBuilder()
                 for bindable in assignable_symbols:
-                    fb.AssignTo(tmp0).MethodCall(match, MatchMethodTable.IncreaseDepth, rpy.PyString(bindable))
-                fb.AssignTo(tmp1).PyTuple(match, head, tail)
-                fb.AssignTo(matches).PyList(tmp1)
-                fb.AssignTo(queue).PyList(tmp1)
-                fb.While.LengthOf(queue).NotEqual(rpy.PyInt(0)).Block(wb)
+                    fb.AssignTo(tmp0).MethodCall(match, MatchMethodTable.IncreaseDepth, self._slot(bindable))
+                fb.AssignTo(matches).PyList(rpy.PyTuple(match, head, tail))
+                fb.AssignTo(cursor).PyInt(0)
+                fb.While.LengthOf(matches).GreaterThan(cursor).Block(wb)
                 if len(assignable_symbols) != 0:
                     fb.For(m, h, t).In(matches).Block(forb)
                 fb.Return(matches)
@@ -242,9 +430,13 @@ class PatternCodegen(pattern.PatternTransformer):
 
     def transformPatSequence(self, seq):
         assert isinstance(seq, pattern.PatSequence)
-        if self.context.get_function_for_pattern(self.languagename, repr(seq)) is None:
+        if self.context.get_function_for_pattern(self.languagename, self._key(seq)) is None:
             match_fn = 'language_{}_match_term_{}'.format(self.languagename, self.symgen.get())
-            self.context.add_function_for_pattern(self.languagename, repr(seq), match_fn)
+            self.context.add_function_for_pattern(self.languagename, self._key(seq), match_fn)
+
+            if not seq.hasrepeat():
+                self._gen_fixed_arity_sequence(match_fn, seq)
+                return
             
             # generate code for all elements of the sequence.
             for pat in seq:
@@ -303,7 +495,7 @@ class PatternCodegen(pattern.PatternTransformer):
                     # for m,h,t in matches{i-1}:
                     #   tmp{i} = matchfn(term, m, h, t)   
                     #   matches{i} = matches{i} + tmp{i}
-                    functionname = self.context.get_function_for_pattern(self.languagename, repr(pat))
+                    functionname = self.context.get_function_for_pattern(self.languagename, self._key(pat))
 
                     tmpi, tmpj  = rpy.gen_pyid_temporaries(2, symgen)
                     forb = rpy.BlockBuilder()
@@ -357,7 +549,7 @@ class PatternCodegen(pattern.PatternTransformer):
                     ifb1.AssignTo(tmpj).MethodCall(matches, 'append', rpy.PyTuple(m, h, t))
 
                     forb = rpy.BlockBuilder()
-                    forb.AssignTo(tmpi).MethodCall(m, MatchMethodTable.CompareKeys, rpy.PyString(pat.sym1), rpy.PyString(pat.sym2))
+                    forb.AssignTo(tmpi).MethodCall(m, MatchMethodTable.CompareKeys, self._slot(pat.sym1), self._slot(pat.sym2))
                     forb.If.Equal(tmpi, rpy.PyBoolean(True)).ThenBlock(ifb1)
 
                     ifb2 = rpy.BlockBuilder()
@@ -375,7 +567,7 @@ class PatternCodegen(pattern.PatternTransformer):
                     #   matches{i} = matches{i} + tmp{i}
                     # if len(matches{i}) == 0: 
                     #   return  matches{i} 
-                    function = self.context.get_function_for_pattern(self.languagename, repr(pat))
+                    function = self.context.get_function_for_pattern(self.languagename, self._key(pat))
                     tmpi, tmpj = rpy.gen_pyid_temporaries(2, symgen)
 
                     forb = rpy.BlockBuilder()
@@ -420,24 +612,139 @@ class PatternCodegen(pattern.PatternTransformer):
             self.modulebuilder.SingleLineComment(repr(seq))
             self.modulebuilder.Function(match_fn).WithParameters(term, match, head, tail).Block(fb)
 
+    def _gen_fixed_arity_sequence(self, match_fn, seq):
+        # Elements of sequences without repetitions are at fixed positions, thus these are matched
+        # by index without the cursor. Single-term elements are checked and bound in place, other 
+        # elements are matched with the head and tail of this sequence - their matches are 
+        # already of the form (m, head + 1, tail).
+        for pat in seq:
+            if isinstance(pat, (pattern.PatSequence, pattern.InHole)):
+                self.transform(pat)
+
+        # if not isinstance(term, Sequence):
+        #   return []
+        # tmp0 = term.length()
+        # if tmp0 != len(seq):
+        #   return []
+        # { for each element in match order
+        #   tmp1 = term.get(i)                       # single-term element
+        #   tmp2 = check(tmp1)
+        #   if tmp2 != True:
+        #     return []
+        #   tmp3 = match.addtobinding(sym, tmp1)
+        #
+        #   tmp4 = match.comparekeys(sym1, sym2)     # constraint check before the first other element
+        #   if tmp4 != True:
+        #     return []
+        #
+        #   tmp1 = term.get(i)                       # first other element
+        #   matches{i} = func(tmp1, match, head, tail)
+        #   if len(matches{i}) == 0:
+        #     return matches{i}
+        #
+        #   matches{i} = []                          # remaining elements and constraint checks
+        #   for m, h, t in matches{i-1}:
+        #     tmp1 = term.get(i)
+        #     tmp5 = func(tmp1, m, head, tail)
+        #     matches{i} = matches{i} + tmp5
+        #   if len(matches{i}) == 0:
+        #     return matches{i} }
+        # return matches{i}                          # [(match, head + 1, tail)] if all elements are single-term
+        symgen = SymGen()
+        term, match, head, tail = rpy.gen_pyid_for('term', 'match', 'head', 'tail')
+        m, h, t = rpy.gen_pyid_for('m', 'h', 't')
+        tmp0, tmp1, tmp2, tmp3, tmp4, tmp5 = rpy.gen_pyid_temporaries(6, symgen)
+
+        fb = rpy.BlockBuilder()
+        ifb = rpy.BlockBuilder()
+        ifb.Return(rpy.PyList())
+        fb.If.NotIsInstance(term, 'Sequence').ThenBlock(ifb)
+
+        ifb = rpy.BlockBuilder()
+        ifb.Return(rpy.PyList())
+        fb.AssignTo(tmp0).MethodCall(term, TermMethodTable.Length)
+        fb.If.NotEqual(tmp0, rpy.PyInt(seq.get_number_of_nonoptional_matches_between(0, len(seq)))).ThenBlock(ifb)
+
+        previousmatches = None
+        order = seq.matchorder()
+        for i in order:
+            pat = seq[i]
+            if isinstance(pat, pattern.CheckConstraint) and previousmatches is None:
+                ifb = rpy.BlockBuilder()
+                ifb.Return(rpy.PyList())
+                fb.AssignTo(tmp4).MethodCall(match, MatchMethodTable.CompareKeys, self._slot(pat.sym1), self._slot(pat.sym2))
+                fb.If.NotEqual(tmp4, rpy.PyBoolean(True)).ThenBlock(ifb)
+                continue
+
+            if isinstance(pat, pattern.CheckConstraint):
+                forb = rpy.BlockBuilder()
+                matches = rpy.gen_pyid_temporary_with_sym('matches', symgen)
+                ifb1 = rpy.BlockBuilder()
+                ifb1.AssignTo(tmp5).MethodCall(matches, 'append', rpy.PyTuple(m, h, t))
+                forb.AssignTo(tmp4).MethodCall(m, MatchMethodTable.CompareKeys, self._slot(pat.sym1), self._slot(pat.sym2))
+                forb.If.Equal(tmp4, rpy.PyBoolean(True)).ThenBlock(ifb1)
+                fb.AssignTo(matches).PyList()
+                fb.For(m, h, t).In(previousmatches).Block(forb)
+            elif isinstance(pat, (pattern.Lit, pattern.Nt, pattern.BuiltInPat)):
+                position = seq.get_number_of_nonoptional_matches_between(0, i)
+                fb.AssignTo(tmp1).MethodCall(term, TermMethodTable.Get, rpy.PyInt(position))
+                isacodegen = PatternIsaCodegen(self.modulebuilder, pat, self.context, self.languagename, self.symgen)
+                tmp2 = isacodegen._gen_check(fb, pat, tmp1, symgen)
+                if tmp2 is not None:
+                    ifb = rpy.BlockBuilder()
+                    ifb.Return(rpy.PyList())
+                    fb.If.NotEqual(tmp2, rpy.PyBoolean(True)).ThenBlock(ifb)
+                if isinstance(pat, pattern.Nt) or (isinstance(pat, pattern.BuiltInPat) and pat.kind != pattern.BuiltInPatKind.Hole):
+                    fb.AssignTo(tmp3).MethodCall(match, MatchMethodTable.AddToBinding, self._slot(pat.sym), tmp1)
+                continue
+            else:
+                position = seq.get_number_of_nonoptional_matches_between(0, i)
+                function = self.context.get_function_for_pattern(self.languagename, self._key(pat))
+                matches = rpy.gen_pyid_temporary_with_sym('matches', symgen)
+                if previousmatches is None:
+                    fb.AssignTo(tmp1).MethodCall(term, TermMethodTable.Get, rpy.PyInt(position))
+                    fb.AssignTo(matches).FunctionCall(function, tmp1, match, head, tail)
+                else:
+                    forb = rpy.BlockBuilder()
+                    forb.AssignTo(tmp1).MethodCall(term, TermMethodTable.Get, rpy.PyInt(position))
+                    forb.AssignTo(tmp5).FunctionCall(function, tmp1, m, head, tail)
+                    forb.AssignTo(matches).Add(matches, tmp5)
+                    fb.AssignTo(matches).PyList()
+                    fb.For(m, h, t).In(previousmatches).Block(forb)
+
+            if i != order[-1]:
+                ifb = rpy.BlockBuilder()
+                ifb.Return(matches)
+                fb.If.LengthOf(matches).Equal(rpy.PyInt(0)).ThenBlock(ifb)
+            previousmatches = matches
+
+        if previousmatches is None:
+            fb.AssignTo(tmp5).Add(head, rpy.PyInt(1))
+            fb.Return(rpy.PyList(rpy.PyTuple(match, tmp5, tail)))
+        else:
+            fb.Return(previousmatches)
+
+        self.modulebuilder.SingleLineComment('{} fixed arity'.format(repr(seq)))
+        self.modulebuilder.Function(match_fn).WithParameters(term, match, head, tail).Block(fb)
+
     def transformNt(self, nt):
         assert isinstance(nt, pattern.Nt)
         # first generate isa for NtDefinition 
         if self.context.get_isa_function_name(self.languagename, nt.prefix) is None:
             assert False, 'define-language should have been generated by now'
 
-        if self.context.get_function_for_pattern(self.languagename, repr(nt)) is None:
+        if self.context.get_function_for_pattern(self.languagename, self._key(nt)) is None:
             match_fn = 'lang_{}_match_nt_{}'.format(self.languagename, self.symgen.get())
-            self.context.add_function_for_pattern(self.languagename, repr(nt), match_fn)
+            self.context.add_function_for_pattern(self.languagename, self._key(nt), match_fn)
             isafunction = self.context.get_isa_function_name(self.languagename, nt.prefix)
             self._gen_match_function_for_primitive(match_fn, isafunction, repr(nt), sym=nt.sym)
 
     # FIXME will introduce explicit inhole pattern later.
     def transformInHole(self, pat):
         assert isinstance(pat, pattern.InHole)
-        if not self.context.get_function_for_pattern(self.languagename, repr(pat)):
+        if not self.context.get_function_for_pattern(self.languagename, self._key(pat)):
             functionname = 'lang_{}_builtin_inhole_{}'.format(self.languagename, self.symgen.get())
-            self.context.add_function_for_pattern(self.languagename, repr(pat), functionname)
+            self.context.add_function_for_pattern(self.languagename, self._key(pat), functionname)
             # 1. Look up all the terms that match pat2. Store (term, [match]) pairs.
             # 2. For each matching term,
             #    1. Replace term with hole
@@ -449,146 +756,201 @@ class PatternCodegen(pattern.PatternTransformer):
             self.transform(pat1)
             self.transform(pat2)
 
-            matchpat1 = self.context.get_function_for_pattern(self.languagename, repr(pat1))
-            matchpat2 = self.context.get_function_for_pattern(self.languagename, repr(pat2))
-
-            assignable_syms1 = pat1.getattribute(pattern.PatternAttribute.PatternVariables)
-            assignable_syms2 = pat2.getattribute(pattern.PatternAttribute.PatternVariables)
-            assignable_syms_all = assignable_syms1.union(assignable_syms2)
-
-            # def inhole(term, match, head, tail, path):
-            # matches = []
-            # inpat2match = Match(...)
-            # pat2matches = pat2matchfunc(term, inpat2match, 0, 1)
-            # if len(pat2matches) != 0:
-            #     inpat1match = Match(...)
-            #     tmp0 = path + [term]
-            #     tmp1 = copy_path_and_replace_last(tmp0, hole)
-            #     pat1matches = pat1matchfunc(tmp1, inpat1match, 0, 1)
-            #     if len(pat1matches) != 0:
-            #         tmp11 = head + 1
-            #         for m1, h1, t1 in pat1matches:
-            #             for m2, h2, t2 in pat2matches:
-            #                 tmp2 = combine_matches(m1, m2)
-            #                 tmp{i} = match.copy()
-            #                 tmp{j} = tmp2.getbinding(...)              ; same for inpat2match
-            #                 tmp{k} = tmp{i}.addtobinding(..., tmp{j})  ; same for inpat2match
-            #                 tmp3 = matches.append((tmp{i}, tmp11, tail))
-            # tmp4 = term.kind()
-            # if tmp4 == Term.Sequence:
-            #     tmp5 = path.append(term)
-            #     tmp6 = term.length()
-            #     for tmp10 in range(tmp6):
-            #         tmp7 = term.get(tmp10)
-            #         tmp8 = inhole(tmp7, match, head, tail, path)
-            #         matches = matches + tmp8
-            #     tmp9 = path.pop()
-            # return matches 
+            # Subterms the hole can be placed at are found by traversing the term once per context pattern,
+            # the traversal is shared between all in-hole patterns with the same context pattern.
+            # Not possible when context pattern contains in-hole patterns itself.
+            contextcheck = PatternIsaCodegen(self.modulebuilder, pat1, self.context, self.languagename, self.symgen).runincontext()
+            if contextcheck is not None:
+                lookupfuncname = self._gen_inhole_impl_with_decompositions(pat, contextcheck)
+                lookupargs = []
+            else:
+                lookupfuncname = self._gen_inhole_impl_with_traversal(pat)
+                lookupargs = [rpy.PyList(), rpy.PyList()]
 
+            #-------- this produces top-level function with empty list representing the path.
             symgen = SymGen()
-            lookupfuncname = 'lang_{}_inhole_{}_impl'.format(self.languagename, self.symgen.get())
 
-            matches, hole = rpy.gen_pyid_for('matches', '{}_hole'.format(self.languagename))
+            term, match, head, tail = rpy.gen_pyid_for('term', 'match', 'head', 'tail')
+            tmp0 = rpy.gen_pyid_temporaries(1, symgen)
+            fb = rpy.BlockBuilder()
+            fb.AssignTo(tmp0).FunctionCall(lookupfuncname, term, match, head, tail, *lookupargs)
+            fb.Return(tmp0)
 
-            term, match, head, tail, path = rpy.gen_pyid_for('term', 'match', 'head', 'tail', 'path')
-            m1, h1, t1 = rpy.gen_pyid_for('m1', 'h1', 't1')
-            m2, h2, t2 = rpy.gen_pyid_for('m2', 'h2', 't2')
+            self.modulebuilder.Function(functionname).WithParameters(term, match, head, tail).Block(fb)
 
-            pat1matches, inpat1match = rpy.gen_pyid_for('pat1matches', 'inpat1match')
-            pat2matches, inpat2match = rpy.gen_pyid_for('pat2matches', 'inpat2match')
+    def _gen_inhole_impl_with_decompositions(self, pat, contextcheck):
+        pat1, pat2 = pat.pat1, pat.pat2
+        matchpat1 = self.context.get_function_for_pattern(self.languagename, self._key(pat1))
+        matchpat2 = self.context.get_function_for_pattern(self.languagename, self._key(pat2))
+        decompose = gen_inhole_decompositions_function(self.modulebuilder, self.context, self.languagename, self.symgen, pat1, contextcheck)
+
+        # pat1 and pat2 are matched into empty matches of the same layout. Resulting bindings 
+        # are added into the match at corresponding slots. Constraint checks between bindings
+        # of pat1 and pat2 are done before matches are combined.
+        slots1 = rpy.PyList(*[rpy.PyInt(slot) for slot in self.layout.slotsof(pat1)])
+        slots2 = rpy.PyList(*[rpy.PyInt(slot) for slot in self.layout.slotsof(pat2)])
+        constraints1, constraints2 = rpy.PyList(), rpy.PyList()
+        if pat.constraintchecks != None:
+            constraints1 = rpy.PyList(*[self._slot(chck.sym1) for chck in pat.constraintchecks])
+            constraints2 = rpy.PyList(*[self._slot(chck.sym2) for chck in pat.constraintchecks])
+
+        # def inhole(term, match, head, tail):
+        # matches = []
+        # tmp0 = decompose(term)
+        # tmp1 = tmp0.length()
+        # for tmp2 in range(tmp1):
+        #   tmp3 = tmp0.subterm(tmp2)
+        #   inpat2match = match.emptycopy()
+        #   pat2matches = pat2matchfunc(tmp3, inpat2match, 0, 1)
+        #   if len(pat2matches) != 0:
+        #     inpat1match = match.emptycopy()
+        #     tmp4 = tmp0.context(tmp2, hole)     # copied once, shared with other in-hole patterns.
+        #     pat1matches = pat1matchfunc(tmp4, inpat1match, 0, 1)
+        #     if len(pat1matches) != 0:
+        #       tmp5 = head + 1
+        #       tmp6 = match_cartesian_product_add_binding_to(pat1matches, [slots1...], pat2matches, [slots2...], match, tmp5, tail, [constraints1...], [constraints2...])
+        #       matches = matches + tmp6
+        # return matches
+        symgen = SymGen()
+        lookupfuncname = 'lang_{}_inhole_{}_impl'.format(self.languagename, self.symgen.get())
 
-            tmp0, tmp1, tmp2, tmp3, tmp4 = rpy.gen_pyid_temporaries(5, symgen)
-            tmp5, tmp6, tmp7, tmp8, tmp9 = rpy.gen_pyid_temporaries(5, symgen)
-            tmp10, tmp11, tmp12 = rpy.gen_pyid_temporaries(3, symgen)
+        matches, hole = rpy.gen_pyid_for('matches', '{}_hole'.format(self.languagename))
+        term, match, head, tail = rpy.gen_pyid_for('term', 'match', 'head', 'tail')
+        pat1matches, inpat1match = rpy.gen_pyid_for('pat1matches', 'inpat1match')
+        pat2matches, inpat2match = rpy.gen_pyid_for('pat2matches', 'inpat2match')
+        tmp0, tmp1, tmp2, tmp3, tmp4, tmp5, tmp6 = rpy.gen_pyid_temporaries(7, symgen)
 
-            tmpm = rpy.gen_pyid_temporaries(1, symgen)
+        ifb0 = rpy.BlockBuilder()
+        ifb0.AssignTo(tmp5).Add(head, rpy.PyInt(1))
+        ifb0.AssignTo(tmp6).FunctionCall(MatchHelperFuncs.CartesianProductAndCombineWith, pat1matches, slots1, pat2matches, slots2, match, tmp5, tail, constraints1, constraints2)
+        ifb0.AssignTo(matches).Add(matches, tmp6)
 
-            forb2 = rpy.BlockBuilder()
-            forb2.AssignTo(tmp2).FunctionCall(MatchHelperFuncs.CombineMatches, m1, m2) 
-            forb2.AssignTo(tmpm).MethodCall(match, MatchMethodTable.DeepCopy)
-            for sym in assignable_syms_all:
-                tmpi, tmpj = rpy.gen_pyid_temporaries(2, symgen)
-                forb2.AssignTo(tmpi).MethodCall(tmp2, MatchMethodTable.GetBinding, rpy.PyString(sym))
-                forb2.AssignTo(tmpj).MethodCall(tmpm, MatchMethodTable.AddToBinding, rpy.PyString(sym), tmpi)
-            forb2.AssignTo(tmp3).MethodCall(matches, 'append', rpy.PyTuple(tmpm, tmp11, tail))
+        ifb1 = rpy.BlockBuilder()
+        ifb1.AssignTo(inpat1match).MethodCall(match, MatchMethodTable.EmptyCopy)
+        ifb1.AssignTo(tmp4).MethodCall(tmp0, 'context', tmp2, hole)
+        ifb1.AssignTo(pat1matches).FunctionCall(matchpat1, tmp4, inpat1match, rpy.PyInt(0), rpy.PyInt(1)) 
+        ifb1.If.LengthOf(pat1matches).NotEqual(rpy.PyInt(0)).ThenBlock(ifb0)
 
-            forb1 = rpy.BlockBuilder()
-            forb1.For(m2, h2, t2).In(pat2matches).Block(forb2)
+        forb = rpy.BlockBuilder()
+        forb.AssignTo(tmp3).MethodCall(tmp0, 'subterm', tmp2)
+        forb.AssignTo(inpat2match).MethodCall(match, MatchMethodTable.EmptyCopy)
+        forb.AssignTo(pat2matches).FunctionCall(matchpat2, tmp3, inpat2match, rpy.PyInt(0), rpy.PyInt(1))
+        forb.If.LengthOf(pat2matches).NotEqual(rpy.PyInt(0)).ThenBlock(ifb1)
 
-            ifb0 = rpy.BlockBuilder()
-            ifb0.AssignTo(tmp11).Add(head, rpy.PyInt(1))
-            ifb0.AssignTo(tmp2).FunctionCall(MatchHelperFuncs.CartesianProductAndCombineWith, pat1matches, pat2matches, match, tmp11, tail)
-            ifb0.AssignTo(matches).Add(matches, tmp2)
+        fb = rpy.BlockBuilder()
+        fb.AssignTo(matches).PyList()
+        fb.AssignTo(tmp0).FunctionCall(decompose, term)
+        fb.AssignTo(tmp1).MethodCall(tmp0, TermMethodTable.Length)
+        fb.For(tmp2).InRange(tmp1).Block(forb)
+        fb.Return(matches)
+
+        self.modulebuilder.SingleLineComment('{}'.format(repr(pat)))
+        self.modulebuilder.Function(lookupfuncname).WithParameters(term, match, head, tail).Block(fb)
+        return lookupfuncname
+
+    def _gen_inhole_impl_with_traversal(self, pat):
+        pat1, pat2 = pat.pat1, pat.pat2
+        matchpat1 = self.context.get_function_for_pattern(self.languagename, self._key(pat1))
+        matchpat2 = self.context.get_function_for_pattern(self.languagename, self._key(pat2))
+
+        # pat1 and pat2 are matched into empty matches of the same layout. Resulting bindings 
+        # are added into the match at corresponding slots. Constraint checks between bindings
+        # of pat1 and pat2 are done before matches are combined.
+        slots1 = rpy.PyList(*[rpy.PyInt(slot) for slot in self.layout.slotsof(pat1)])
+        slots2 = rpy.PyList(*[rpy.PyInt(slot) for slot in self.layout.slotsof(pat2)])
+        constraints1, constraints2 = rpy.PyList(), rpy.PyList()
+        if pat.constraintchecks != None:
+            constraints1 = rpy.PyList(*[self._slot(chck.sym1) for chck in pat.constraintchecks])
+            constraints2 = rpy.PyList(*[self._slot(chck.sym2) for chck in pat.constraintchecks])
+
+        # def inhole(term, match, head, tail, path, indices):
+        # matches = []
+        # inpat2match = match.emptycopy()
+        # pat2matches = pat2matchfunc(term, inpat2match, 0, 1)
+        # if len(pat2matches) != 0:
+        #     inpat1match = match.emptycopy()
+        #     tmp0 = path + [term]
+        #     tmp1 = copy_path_and_replace_last_with_hole(tmp0, indices, hole)
+        #     pat1matches = pat1matchfunc(tmp1, inpat1match, 0, 1)
+        #     if len(pat1matches) != 0:
+        #         tmp11 = head + 1
+        #         tmp2 = match_cartesian_product_add_binding_to(pat1matches, [slots1...], pat2matches, [slots2...], match, tmp11, tail, [constraints1...], [constraints2...])
+        #         matches = matches + tmp2
+        # tmp4 = term.kind()
+        # if tmp4 == Term.Sequence:
+        #     tmp5 = path.append(term)
+        #     tmp6 = term.length()
+        #     for tmp10 in range(tmp6):
+        #         tmp7 = term.get(tmp10)
+        #         tmp12 = indices.append(tmp10)
+        #         tmp8 = inhole(tmp7, match, head, tail, path, indices)
+        #         tmp12 = indices.pop()
+        #         matches = matches + tmp8
+        #     tmp9 = path.pop()
+        # return matches 
 
-            #ifb0.For(m1, h1, t1).In(pat1matches).Block(forb1)
+        symgen = SymGen()
+        lookupfuncname = 'lang_{}_inhole_{}_impl'.format(self.languagename, self.symgen.get())
 
-            ifb1 = rpy.BlockBuilder()
-            ifb1.AssignTo(inpat1match).New('Match', self._assignable_symbols_to_rpylist(assignable_syms1))
-            ifb1.AssignTo(tmp0).Add(path, rpy.PyList(term))
-            ifb1.AssignTo(tmp1).FunctionCall(TermHelperFuncs.CopyPathAndReplaceLast, tmp0, hole)
-            ifb1.AssignTo(pat1matches).FunctionCall(matchpat1, tmp1, inpat1match, rpy.PyInt(0), rpy.PyInt(1)) 
-            ifb1.If.LengthOf(pat1matches).NotEqual(rpy.PyInt(0)).ThenBlock(ifb0)
+        matches, hole = rpy.gen_pyid_for('matches', '{}_hole'.format(self.languagename))
 
-            # ---------------
+        term, match, head, tail, path, indices = rpy.gen_pyid_for('term', 'match', 'head', 'tail', 'path', 'indices')
 
-            forb1 = rpy.BlockBuilder()
-            forb1.AssignTo(tmp7).MethodCall(term, TermMethodTable.Get, tmp10)
-            forb1.AssignTo(tmp8).FunctionCall(lookupfuncname, tmp7, match, head, tail, path)
-            forb1.AssignTo(matches).Add(matches, tmp8)
+        pat1matches, inpat1match = rpy.gen_pyid_for('pat1matches', 'inpat1match')
+        pat2matches, inpat2match = rpy.gen_pyid_for('pat2matches', 'inpat2match')
 
-            ifb3 = rpy.BlockBuilder()
-            ifb3.AssignTo(tmp5).MethodCall(path, 'append', term)
-            ifb3.AssignTo(tmp6).MethodCall(term, TermMethodTable.Length)
-            ifb3.For(tmp10).InRange(tmp6).Block(forb1)
-            ifb3.AssignTo(tmp9).MethodCall(path, 'pop')
+        tmp0, tmp1, tmp2, tmp3, tmp4 = rpy.gen_pyid_temporaries(5, symgen)
+        tmp5, tmp6, tmp7, tmp8, tmp9 = rpy.gen_pyid_temporaries(5, symgen)
+        tmp10, tmp11, tmp12 = rpy.gen_pyid_temporaries(3, symgen)
 
-            # ----------------
+        ifb0 = rpy.BlockBuilder()
+        ifb0.AssignTo(tmp11).Add(head, rpy.PyInt(1))
+        ifb0.AssignTo(tmp2).FunctionCall(MatchHelperFuncs.CartesianProductAndCombineWith, pat1matches, slots1, pat2matches, slots2, match, tmp11, tail, constraints1, constraints2)
+        ifb0.AssignTo(matches).Add(matches, tmp2)
 
-            fb = rpy.BlockBuilder()
-            fb.AssignTo(matches).PyList()
-            fb.AssignTo(inpat2match).New('Match', self._assignable_symbols_to_rpylist(assignable_syms2))
-            fb.AssignTo(pat2matches).FunctionCall(matchpat2, term, inpat2match, rpy.PyInt(0), rpy.PyInt(1))
-            fb.If.LengthOf(pat2matches).NotEqual(rpy.PyInt(0)).ThenBlock(ifb1)
-            #fb.AssignTo(tmp4).MethodCall(term, TermMethodTable.Kind)
-            fb.If.IsInstance(term, 'Sequence').ThenBlock(ifb3)
-            fb.Return(matches)
+        ifb1 = rpy.BlockBuilder()
+        ifb1.AssignTo(inpat1match).MethodCall(match, MatchMethodTable.EmptyCopy)
+        ifb1.AssignTo(tmp0).Add(path, rpy.PyList(term))
+        ifb1.AssignTo(tmp1).FunctionCall(TermHelperFuncs.CopyPathAndReplaceLastWithHole, tmp0, indices, hole)
+        ifb1.AssignTo(pat1matches).FunctionCall(matchpat1, tmp1, inpat1match, rpy.PyInt(0), rpy.PyInt(1)) 
+        ifb1.If.LengthOf(pat1matches).NotEqual(rpy.PyInt(0)).ThenBlock(ifb0)
 
-            self.modulebuilder.SingleLineComment('{}'.format(repr(pat)))
-            self.modulebuilder.Function(lookupfuncname).WithParameters(term, match, head, tail, path).Block(fb)
+        # ---------------
 
-            #-------- this produces top-level function with empty list representing the path.
-            # We do constraint checking here also.
-            symgen = SymGen()
+        forb1 = rpy.BlockBuilder()
+        forb1.AssignTo(tmp7).MethodCall(term, TermMethodTable.Get, tmp10)
+        forb1.AssignTo(tmp12).MethodCall(indices, 'append', tmp10)
+        forb1.AssignTo(tmp8).FunctionCall(lookupfuncname, tmp7, match, head, tail, path, indices)
+        forb1.AssignTo(tmp12).MethodCall(indices, 'pop')
+        forb1.AssignTo(matches).Add(matches, tmp8)
 
-            m, h, t = rpy.gen_pyid_for('m', 'h', 't')
-            fb = rpy.BlockBuilder()
-            fb.AssignTo(tmp0).FunctionCall(lookupfuncname, term, match, head, tail, rpy.PyList())
-            if pat.constraintchecks != None:
-                fb.AssignTo(matches).PyList()
-                forb = rpy.BlockBuilder()
-                for chck in pat.constraintchecks:
-                    tmpi = rpy.gen_pyid_temporaries(1, symgen)
-                    ifb = rpy.BlockBuilder()
-                    ifb.Continue
+        ifb3 = rpy.BlockBuilder()
+        ifb3.AssignTo(tmp5).MethodCall(path, 'append', term)
+        ifb3.AssignTo(tmp6).MethodCall(term, TermMethodTable.Length)
+        ifb3.For(tmp10).InRange(tmp6).Block(forb1)
+        ifb3.AssignTo(tmp9).MethodCall(path, 'pop')
 
-                    forb.AssignTo(tmpi).MethodCall(m, MatchMethodTable.CompareKeys, rpy.PyString(chck.sym1), rpy.PyString(chck.sym2))
-                    forb.If.NotEqual(tmpi, rpy.PyBoolean(True)).ThenBlock(ifb)
+        # ----------------
 
-                tmp = rpy.gen_pyid_temporaries(1, symgen)
-                forb.AssignTo(tmp).MethodCall(matches, 'append', rpy.PyTuple(m, h, t))
-                fb.For(m, h, t).In(tmp0).Block(forb)
-                fb.Return(matches)
-            else:
-                fb.Return(tmp0)
-
-            self.modulebuilder.Function(functionname).WithParameters(term, match, head, tail).Block(fb)
+        fb = rpy.BlockBuilder()
+        fb.AssignTo(matches).PyList()
+        fb.AssignTo(inpat2match).MethodCall(match, MatchMethodTable.EmptyCopy)
+        fb.AssignTo(pat2matches).FunctionCall(matchpat2, term, inpat2match, rpy.PyInt(0), rpy.PyInt(1))
+        fb.If.LengthOf(pat2matches).NotEqual(rpy.PyInt(0)).ThenBlock(ifb1)
+        #fb.AssignTo(tmp4).MethodCall(term, TermMethodTable.Kind)
+        fb.If.IsInstance(term, 'Sequence').ThenBlock(ifb3)
+        fb.Return(matches)
+
+        self.modulebuilder.SingleLineComment('{}'.format(repr(pat)))
+        self.modulebuilder.Function(lookupfuncname).WithParameters(term, match, head, tail, path, indices).Block(fb)
+        return lookupfuncname
 
     def transformBuiltInPat(self, pat):
         assert isinstance(pat, pattern.BuiltInPat) 
         if pat.kind == pattern.BuiltInPatKind.Any:
-            if self.context.get_function_for_pattern(self.languagename, repr(pat)) is None:
+            if self.context.get_function_for_pattern(self.languagename, self._key(pat)) is None:
                 nameof_this_func = 'match_lang_{}_builtin_{}'.format(self.languagename, self.symgen.get())
-                self.context.add_function_for_pattern(self.languagename, repr(pat), nameof_this_func)
+                self.context.add_function_for_pattern(self.languagename, self._key(pat), nameof_this_func)
 
                 # tmp0 = match.addtobinding(sym, term) 
                 # head = head + 1
@@ -598,7 +960,7 @@ class PatternCodegen(pattern.PatternTransformer):
                 tmp0 = rpy.gen_pyid_temporaries(1, symgen)
 
                 fb = rpy.BlockBuilder()
-                fb.AssignTo(tmp0).MethodCall(match, MatchMethodTable.AddToBinding, rpy.PyString(pat.sym), term)
+                fb.AssignTo(tmp0).MethodCall(match, MatchMethodTable.AddToBinding, self._slot(pat.sym), term)
                 fb.AssignTo(head).Add(head, rpy.PyInt(1))
                 fb.Return(rpy.PyList( rpy.PyTuple(match, head, tail) ))
 
@@ -607,56 +969,17 @@ class PatternCodegen(pattern.PatternTransformer):
             return pat
 
         elif pat.kind == pattern.BuiltInPatKind.VariableNotOtherwiseDefined:
-            # generate isa function for variable-not-otherwise-mentioned here because we need to reference
-            # compile-time generated language-specific array 'langname_variable_mentioned'
-            if self.context.get_isa_function_name(self.languagename, pat.prefix) is None:
-                nameof_this_func = 'lang_{}_isa_builtin_variable_not_othewise_mentioned'.format(self.languagename)
-                self.context.add_isa_function_name(self.languagename, pat.prefix, nameof_this_func)
-
-                symgen = SymGen()
-                var, _ = self.context.get_variables_mentioned(self.languagename)
-                var = rpy.gen_pyid_for(var)
-                term = rpy.gen_pyid_for('term')
-                tmp0, tmp1 = rpy.gen_pyid_temporaries(2, symgen)
-
-                fb = rpy.BlockBuilder()
-                fb.AssignTo(tmp0).FunctionCall(TermHelperFuncs.TermIsVariableNotOtherwiseMentioned, term, var)
-                fb.Return(tmp0)
-
-                self.modulebuilder.SingleLineComment('#Is this term {}?'.format(pat.prefix))
-                self.modulebuilder.Function(nameof_this_func).WithParameters(term).Block(fb)
-                """
-                # tmp0 = term.kind()
-                # if tmp0 == TermKind.Variable:
-                #   tmp1 = term.value()
-                #   if tmp1 not in var:
-                #     return True
-                # return False
-                # This one is different from other built-in isa funcs because we do set membership test here.
-                ifb2 = rpy.BlockBuilder()
-                ifb2.Return(rpy.PyBoolean(True))
-
-                ifb1 = rpy.BlockBuilder()
-                ifb1.AssignTo(tmp1).MethodCall(term, TermMethodTable.Value)
-                ifb1.If.NotContains(tmp1).In(var).ThenBlock(ifb2)
-
-                fb = rpy.BlockBuilder()
-                fb.If.IsInstance(term, 'Variable').ThenBlock(ifb1)
-                fb.Return(rpy.PyBoolean(False))
-
-                self.modulebuilder.SingleLineComment('#Is this term {}?'.format(pat.prefix))
-                self.modulebuilder.Function(nameof_this_func).WithParameters(term).Block(fb)
-                """
+            gen_isa_function_for_variable_not_otherwise_mentioned(self.modulebuilder, self.context, self.languagename, pat)
 
             ##----- generate actual match function
-            if self.context.get_function_for_pattern(self.languagename, repr(pat)) is None:
+            if self.context.get_function_for_pattern(self.languagename, self._key(pat)) is None:
                 nameof_this_func = 'match_lang_{}_builtin_{}'.format(self.languagename, self.symgen.get())
-                self.context.add_function_for_pattern(self.languagename, repr(pat), nameof_this_func)
+                self.context.add_function_for_pattern(self.languagename, self._key(pat), nameof_this_func)
                 isafunc = self.context.get_isa_function_name(self.languagename, pat.prefix)
                 self._gen_match_function_for_primitive(nameof_this_func, isafunc, repr(pat), sym=pat.sym)
             return pat
         else:
-            if self.context.get_function_for_pattern(self.languagename, repr(pat)) is None:
+            if self.context.get_function_for_pattern(self.languagename, self._key(pat)) is None:
                 pat_isA_tab = {
                     pattern.BuiltInPatKind.Number:  TermHelperFuncs.TermIsNumber,
                     pattern.BuiltInPatKind.Integer: TermHelperFuncs.TermIsInteger,
@@ -670,7 +993,7 @@ class PatternCodegen(pattern.PatternTransformer):
                 try:
                     term_func = pat_isA_tab[pat.kind]
                     nameof_this_func = 'match_lang_{}_builtin_{}'.format(self.languagename, self.symgen.get())
-                    self.context.add_function_for_pattern(self.languagename, repr(pat), nameof_this_func)
+                    self.context.add_function_for_pattern(self.languagename, self._key(pat), nameof_this_func)
                     if pat.kind == pattern.BuiltInPatKind.Hole:
                         # 'hole' key is not present in the final Match object.
                         self._gen_match_function_for_primitive(nameof_this_func, term_func, repr(pat))
@@ -681,11 +1004,11 @@ class PatternCodegen(pattern.PatternTransformer):
             return pat
 
     def gen_procedure_for_lit(self, lit, consumeprocedure, exactvalue):
-        if self.context.get_function_for_pattern(self.languagename, repr(lit)) is not None:
+        if self.context.get_function_for_pattern(self.languagename, self._key(lit)) is not None:
             return lit
 
         nameof_this_func = 'lang_{}_consume_lit{}'.format(self.languagename, self.symgen.get())
-        self.context.add_function_for_pattern(self.languagename, repr(lit), nameof_this_func)
+        self.context.add_function_for_pattern(self.languagename, self._key(lit), nameof_this_func)
 
         symgen = SymGen()
         term, match, head, tail = rpy.gen_pyid_for('term', 'match', 'head', 'tail')
@@ -713,3 +1036,907 @@ class PatternCodegen(pattern.PatternTransformer):
             return self.gen_procedure_for_lit(lit, TermHelperFuncs.ConsumeBoolean, rpy.PyString(lit.lit))
 
         assert False, 'unknown literal kind ' + str(lit.kind)
+
+
+class PatternLazyCodegen(pattern.PatternTransformer):
+    """
+    Generates matcher f(term, match, head, tail, k) -> bool that resumes continuation k with every 
+    match found instead of collecting them into a list (see MatchContinuation in runtime). Returns 
+    True as soon as k asks to stop, thus consumers interested in the first match only never compute
+    the rest. Shares match layout with PatternCodegen that owns it.
+    """
+    def __init__(self, modulebuilder, context, languagename, symgen, layout):
+        assert isinstance(context, CompilationContext)
+        self.modulebuilder = modulebuilder
+        self.context = context
+        self.languagename = languagename
+        self.symgen = symgen
+        self.layout = layout
+
+    def _key(self, pat):
+        return 'lazy {}'.format(PatternCanonicalizer(self.layout).canonicalize(pat))
+
+    def _slot(self, sym):
+        return rpy.PyInt(self.layout.slot(sym))
+
+    def _function(self, pat):
+        return self.context.get_function_for_pattern(self.languagename, self._key(pat))
+
+    def _consumesoneterm(self, pat):
+        # matchers of these patterns leave the match untouched on failure and resume k at most once.
+        return not isinstance(pat, pattern.PatSequence) and not isinstance(pat, pattern.InHole)
+
+    def run(self, pat):
+        self.transform(pat)
+        return self._function(pat)
+
+    def _bindsym(self, pat):
+        # 'hole' key is not present in the final Match object.
+        if isinstance(pat, pattern.Nt):
+            return pat.sym
+        if isinstance(pat, pattern.BuiltInPat) and pat.kind != pattern.BuiltInPatKind.Hole:
+            return pat.sym
+        return None
+
+    def _isinlined(self, pat):
+        # patterns matched directly in step functions of the enclosing sequence.
+        return self._consumesoneterm(pat) and not isinstance(pat, pattern.Repeat)
+
+    def _gen_inline_element(self, fb, pat, term, match, symgen):
+        # tmp0 = check(term)
+        # if tmp0 != True:
+        #   return False
+        # tmp1 = match.addtobinding(sym, term)   # if pattern binds the term
+        isacodegen = PatternIsaCodegen(self.modulebuilder, pat, self.context, self.languagename, self.symgen)
+        tmp0 = isacodegen._gen_check(fb, pat, term, symgen)
+        if tmp0 is not None:
+            ifb = rpy.BlockBuilder()
+            ifb.Return(rpy.PyBoolean(False))
+            fb.If.NotEqual(tmp0, rpy.PyBoolean(True)).ThenBlock(ifb)
+        sym = self._bindsym(pat)
+        if sym is not None:
+            tmp1 = rpy.gen_pyid_temporaries(1, symgen)
+            fb.AssignTo(tmp1).MethodCall(match, MatchMethodTable.AddToBinding, self._slot(sym), term)
+
+    def _gen_element(self, pat):
+        if self._function(pat) is not None:
+            return pat
+        nameof_this_func = 'lang_{}_lazy_match_{}'.format(self.languagename, self.symgen.get())
+        self.context.add_function_for_pattern(self.languagename, self._key(pat), nameof_this_func)
+
+        # { inline element }
+        # tmp0 = head + 1
+        # tmp1 = k.resume(match, tmp0, tail)
+        # return tmp1
+        symgen = SymGen()
+        term, match, head, tail, k = rpy.gen_pyid_for('term', 'match', 'head', 'tail', 'k')
+
+        fb = rpy.BlockBuilder()
+        self._gen_inline_element(fb, pat, term, match, symgen)
+        tmp0, tmp1 = rpy.gen_pyid_temporaries(2, symgen)
+        fb.AssignTo(tmp0).Add(head, rpy.PyInt(1))
+        fb.AssignTo(tmp1).MethodCall(k, MatchContinuationMethodTable.Resume, match, tmp0, tail)
+        fb.Return(tmp1)
+
+        self.modulebuilder.SingleLineComment('lazy {}'.format(repr(pat)))
+        self.modulebuilder.Function(nameof_this_func).WithParameters(term, match, head, tail, k).Block(fb)
+        return pat
+
+    def transformNt(self, nt):
+        assert isinstance(nt, pattern.Nt)
+        return self._gen_element(nt)
+
+    def transformBuiltInPat(self, pat):
+        assert isinstance(pat, pattern.BuiltInPat)
+        return self._gen_element(pat)
+
+    def transformLit(self, lit):
+        assert isinstance(lit, pattern.Lit)
+        return self._gen_element(lit)
+
+    def transformPatSequence(self, seq):
+        assert isinstance(seq, pattern.PatSequence)
+        if self._function(seq) is not None:
+            return seq
+        nameof_this_func = 'lang_{}_lazy_match_{}'.format(self.languagename, self.symgen.get())
+        self.context.add_function_for_pattern(self.languagename, self._key(seq), nameof_this_func)
+
+        for pat in seq:
+            if not isinstance(pat, pattern.CheckConstraint) and not self._isinlined(pat):
+                self.transform(pat)
+
+        # Sequence is matched by chain of step functions. Step matches terms that are matched by 
+        # single-term patterns and constraint checks in place, up to and including the first 
+        # element that may produce multiple matches. The rest of the sequence is passed to the 
+        # next step as continuation. Thus only elements that may produce multiple matches 
+        # allocate continuation objects.
+        # Elements of sequences without repetitions are matched in PatSequence.matchorder order.
+        order = seq.matchorder()
+        fixedpositions = not seq.hasrepeat()
+        steps = [[]]
+        for n, i in enumerate(order):
+            pat = seq[i]
+            steps[-1].append(i)
+            if not isinstance(pat, pattern.CheckConstraint) and not self._isinlined(pat) and n + 1 < len(order):
+                steps.append([])
+        stepnames = ['{}_step_{}'.format(nameof_this_func, i) for i in range(len(steps))]
+
+        term, match, head, tail, k = rpy.gen_pyid_for('term', 'match', 'head', 'tail', 'k')
+        if len(steps) == 1 and all(isinstance(pat, pattern.CheckConstraint) or self._isinlined(pat) for pat in seq):
+            self._gen_inlined_sequence(nameof_this_func, seq)
+            return seq
+
+        for stepid, step in enumerate(steps):
+            symgen = SymGen()
+            fb = rpy.BlockBuilder()
+
+            # ensure there are enough terms left for non-repeat patterns following the repeat.
+            # tmp0 = tail - head
+            # if tmp0 < num_required:
+            #   return False
+            if len(step) > 0 and step[0] > 0 and isinstance(seq[step[0]-1], pattern.Repeat):
+                num_required = seq.get_number_of_nonoptional_matches_between(step[0], len(seq))
+                if num_required > 0:
+                    tmp0 = rpy.gen_pyid_temporaries(1, symgen)
+                    ifb = rpy.BlockBuilder()
+                    ifb.Return(rpy.PyBoolean(False))
+                    fb.AssignTo(tmp0).Subtract(tail, head)
+                    fb.If.LessThan(tmp0, rpy.PyInt(num_required)).ThenBlock(ifb)
+
+            # continuation matching the rest of the sequence after the last element of the step.
+            # tmp1 = SequenceContinuation(nextstep, term, k)
+            tmp1 = k
+            if stepid + 1 < len(steps):
+                tmp1 = rpy.gen_pyid_temporaries(1, symgen)
+
+            tmp2, tmp3 = rpy.gen_pyid_temporaries(2, symgen)
+            for i in step:
+                pat = seq[i]
+                position = head
+                if fixedpositions:
+                    position = rpy.PyInt(seq.get_number_of_nonoptional_matches_between(0, i))
+                if isinstance(pat, pattern.CheckConstraint):
+                    # tmp2 = match.comparekeys(sym1, sym2)
+                    # if tmp2 != True:
+                    #   return False
+                    ifb = rpy.BlockBuilder()
+                    ifb.Return(rpy.PyBoolean(False))
+                    fb.AssignTo(tmp2).MethodCall(match, MatchMethodTable.CompareKeys, self._slot(pat.sym1), self._slot(pat.sym2))
+                    fb.If.NotEqual(tmp2, rpy.PyBoolean(True)).ThenBlock(ifb)
+                elif self._isinlined(pat):
+                    # tmp2 = term.get(head)        # term.get(position) if position is fixed
+                    # { inline element }
+                    # head = head + 1
+                    fb.AssignTo(tmp2).MethodCall(term, TermMethodTable.Get, position)
+                    self._gen_inline_element(fb, pat, tmp2, match, symgen)
+                    fb.AssignTo(head).Add(head, rpy.PyInt(1))
+                else:
+                    if tmp1 is not k:
+                        fb.AssignTo(tmp1).New('SequenceContinuation', rpy.PyId(stepnames[stepid+1]), term, k)
+                    if isinstance(pat, pattern.Repeat):
+                        # tmp3 = repeatfn(term, match, head, tail, tmp1)
+                        fb.AssignTo(tmp3).FunctionCall(self._function(pat), term, match, head, tail, tmp1)
+                    else:
+                        # tmp2 = term.get(head)        # term.get(position) if position is fixed
+                        # tmp3 = elementfn(tmp2, match, head, tail, tmp1)
+                        fb.AssignTo(tmp2).MethodCall(term, TermMethodTable.Get, position)
+                        fb.AssignTo(tmp3).FunctionCall(self._function(pat), tmp2, match, head, tail, tmp1)
+                    fb.Return(tmp3)
+                    break
+            else:
+                # all elements of the step matched in place, this is the last step.
+                # tmp3 = k.resume(match, head, tail)
+                fb.AssignTo(tmp3).MethodCall(k, MatchContinuationMethodTable.Resume, match, head, tail)
+                fb.Return(tmp3)
+
+            self.modulebuilder.SingleLineComment('{} step {}'.format(repr(seq), stepid))
+            self.modulebuilder.Function(stepnames[stepid]).WithParameters(term, match, head, tail, k).Block(fb)
+
+        # if not isinstance(term, Sequence):
+        #   return False
+        # tmp0 = term.length()
+        # if tmp0 < num_required:
+        #   return False
+        # tmp1 = SequenceExitContinuation(k, head, tail)
+        # tmp2 = step0(term, match, 0, tmp0, tmp1)
+        # return tmp2
+        symgen = SymGen()
+        tmp0, tmp1, tmp2 = rpy.gen_pyid_temporaries(3, symgen)
+        fb = rpy.BlockBuilder()
+
+        ifb = rpy.BlockBuilder()
+        ifb.Return(rpy.PyBoolean(False))
+        fb.If.NotIsInstance(term, 'Sequence').ThenBlock(ifb)
+
+        num_required = seq.get_number_of_nonoptional_matches_between(0, len(seq))
+        ifb = rpy.BlockBuilder()
+        ifb.Return(rpy.PyBoolean(False))
+        fb.AssignTo(tmp0).MethodCall(term, TermMethodTable.Length)
+        fb.If.LessThan(tmp0, rpy.PyInt(num_required)).ThenBlock(ifb)
+
+        fb.AssignTo(tmp1).New('SequenceExitContinuation', k, head, tail)
+        fb.AssignTo(tmp2).FunctionCall(stepnames[0], term, match, rpy.PyInt(0), tmp0, tmp1)
+        fb.Return(tmp2)
+
+        self.modulebuilder.SingleLineComment('lazy {}'.format(repr(seq)))
+        self.modulebuilder.Function(nameof_this_func).WithParameters(term, match, head, tail, k).Block(fb)
+        return seq
+
+    def _gen_inlined_sequence(self, nameof_this_func, seq):
+        # All elements are matched in place, sequence is matched without allocating continuations.
+        # if not isinstance(term, Sequence):
+        #   return False
+        # tmp0 = term.length()
+        # if tmp0 != len(seq):
+        #   return False
+        # { foreach element i
+        #   tmp1 = term.get(i)
+        #   { inline element } }
+        # tmp2 = head + 1
+        # tmp3 = k.resume(match, tmp2, tail)
+        # return tmp3
+        symgen = SymGen()
+        term, match, head, tail, k = rpy.gen_pyid_for('term', 'match', 'head', 'tail', 'k')
+        tmp0, tmp1, tmp2, tmp3 = rpy.gen_pyid_temporaries(4, symgen)
+        fb = rpy.BlockBuilder()
+
+        ifb = rpy.BlockBuilder()
+        ifb.Return(rpy.PyBoolean(False))
+        fb.If.NotIsInstance(term, 'Sequence').ThenBlock(ifb)
+
+        num_required = seq.get_number_of_nonoptional_matches_between(0, len(seq))
+        ifb = rpy.BlockBuilder()
+        ifb.Return(rpy.PyBoolean(False))
+        fb.AssignTo(tmp0).MethodCall(term, TermMethodTable.Length)
+        fb.If.NotEqual(tmp0, rpy.PyInt(num_required)).ThenBlock(ifb)
+
+        for i in seq.matchorder():
+            pat = seq[i]
+            if isinstance(pat, pattern.CheckConstraint):
+                ifb = rpy.BlockBuilder()
+                ifb.Return(rpy.PyBoolean(False))
+                fb.AssignTo(tmp1).MethodCall(match, MatchMethodTable.CompareKeys, self._slot(pat.sym1), self._slot(pat.sym2))
+                fb.If.NotEqual(tmp1, rpy.PyBoolean(True)).ThenBlock(ifb)
+            else:
+                position = seq.get_number_of_nonoptional_matches_between(0, i)
+                fb.AssignTo(tmp1).MethodCall(term, TermMethodTable.Get, rpy.PyInt(position))
+                self._gen_inline_element(fb, pat, tmp1, match, symgen)
+
+        fb.AssignTo(tmp2).Add(head, rpy.PyInt(1))
+        fb.AssignTo(tmp3).MethodCall(k, MatchContinuationMethodTable.Resume, match, tmp2, tail)
+        fb.Return(tmp3)
+
+        self.modulebuilder.SingleLineComment('lazy {}'.format(repr(seq)))
+        self.modulebuilder.Function(nameof_this_func).WithParameters(term, match, head, tail, k).Block(fb)
+
+    def transformRepeat(self, repeat):
+        assert isinstance(repeat, pattern.Repeat)
+        if self._function(repeat) is not None:
+            return repeat
+        nameof_this_func = 'lang_{}_lazy_match_{}'.format(self.languagename, self.symgen.get())
+        self.context.add_function_for_pattern(self.languagename, self._key(repeat), nameof_this_func)
+
+        self.transform(repeat.pat)
+        functionname = self._function(repeat.pat)
+        slots = [self._slot(sym) for sym in repeat.getattribute(pattern.PatternAttribute.PatternVariables)]
+
+        # Matches of the enclosed pattern are queued and every number of consumed terms is tried, 
+        # fewest first. Only the rest of the sequence is matched lazily.
+        # tmp0 = match.increasedepth(...)
+        # queue = MatchQueue()
+        # tmp0 = queue.resume(match, head, tail)
+        # matches = queue.getmatches()
+        # heads = queue.getheads()
+        # cursor = 0
+        # while len(matches) > cursor:
+        #   m = matches[cursor]
+        #   h = heads[cursor]
+        #   cursor = cursor + 1
+        #   { body }
+        # return False
+        symgen = SymGen()
+        term, match, head, tail, k = rpy.gen_pyid_for('term', 'match', 'head', 'tail', 'k')
+        queue, matches, heads, cursor = rpy.gen_pyid_for('queue', 'matches', 'heads', 'cursor')
+        m, h = rpy.gen_pyid_for('m', 'h')
+        tmp0, tmp1, tmp2, tmp3, tmp4, tmp5, tmp6 = rpy.gen_pyid_temporaries(7, symgen)
+
+        wb = rpy.BlockBuilder()
+        wb.AssignTo(m).ArrayGet(matches, cursor)
+        wb.AssignTo(h).ArrayGet(heads, cursor)
+        wb.AssignTo(cursor).Add(cursor, rpy.PyInt(1))
+
+        ifb1 = rpy.BlockBuilder()
+        ifb1.Return(rpy.PyBoolean(True))
+
+        if repeat.matchmode == pattern.RepeatMatchMode.Deterministic:
+            # Following pattern cannot match terms matched by the repeat, thus the repeat consumes 
+            # as many terms as possible. Enclosed pattern that binds some variables before failing
+            # gets a copy of the match.
+            #   if h != tail:
+            #     tmp1 = queue.length()
+            #     tmp2 = term.get(h)
+            #     tmp3 = m.deepcopy()        # if needed
+            #     tmp4 = matchfn(tmp2, tmp3, h, tail, queue)
+            #     tmp5 = queue.length()
+            #     if tmp5 != tmp1:
+            #       continue
+            #   tmp4 = m.decreasedepth(...)
+            #   tmp6 = k.resume(m, h, tail)
+            #   if tmp6 == True:
+            #     return True
+            ifb2 = rpy.BlockBuilder()
+            ifb2.Continue
+
+            ifb = rpy.BlockBuilder()
+            ifb.AssignTo(tmp1).MethodCall(queue, 'length')
+            ifb.AssignTo(tmp2).MethodCall(term, TermMethodTable.Get, h)
+            if self._consumesoneterm(repeat.pat):
+                tmp3 = m
+            else:
+                ifb.AssignTo(tmp3).MethodCall(m, MatchMethodTable.DeepCopy)
+            ifb.AssignTo(tmp4).FunctionCall(functionname, tmp2, tmp3, h, tail, queue)
+            ifb.AssignTo(tmp5).MethodCall(queue, 'length')
+            ifb.If.NotEqual(tmp5, tmp1).ThenBlock(ifb2)
+
+            wb.If.NotEqual(h, tail).ThenBlock(ifb)
+            for slot in slots:
+                wb.AssignTo(tmp4).MethodCall(m, MatchMethodTable.DecreaseDepth, slot)
+            wb.AssignTo(tmp6).MethodCall(k, MatchContinuationMethodTable.Resume, m, h, tail)
+            wb.If.Equal(tmp6, rpy.PyBoolean(True)).ThenBlock(ifb1)
+        else:
+            #   tmp1 = m.deepcopy()
+            #   tmp2 = tmp1.decreasedepth(...)
+            #   tmp3 = k.resume(tmp1, h, tail)
+            #   if tmp3 == True:
+            #     return True
+            #   if h != tail:
+            #     tmp4 = term.get(h)
+            #     tmp5 = matchfn(tmp4, m, h, tail, queue)
+            ifb = rpy.BlockBuilder()
+            ifb.AssignTo(tmp4).MethodCall(term, TermMethodTable.Get, h)
+            ifb.AssignTo(tmp5).FunctionCall(functionname, tmp4, m, h, tail, queue)
+
+            wb.AssignTo(tmp1).MethodCall(m, MatchMethodTable.DeepCopy)
+            for slot in slots:
+                wb.AssignTo(tmp2).MethodCall(tmp1, MatchMethodTable.DecreaseDepth, slot)
+            wb.AssignTo(tmp3).MethodCall(k, MatchContinuationMethodTable.Resume, tmp1, h, tail)
+            wb.If.Equal(tmp3, rpy.PyBoolean(True)).ThenBlock(ifb1)
+            wb.If.NotEqual(h, tail).ThenBlock(ifb)
+
+        fb = rpy.BlockBuilder()
+        for slot in slots:
+            fb.AssignTo(tmp0).MethodCall(match, MatchMethodTable.IncreaseDepth, slot)
+        fb.AssignTo(queue).New('MatchQueue')
+        fb.AssignTo(tmp0).MethodCall(queue, MatchContinuationMethodTable.Resume, match, head, tail)
+        fb.AssignTo(matches).MethodCall(queue, 'getmatches')
+        fb.AssignTo(heads).MethodCall(queue, 'getheads')
+        fb.AssignTo(cursor).PyInt(0)
+        fb.While.LengthOf(matches).GreaterThan(cursor).Block(wb)
+        fb.Return(rpy.PyBoolean(False))
+
+        self.modulebuilder.SingleLineComment('lazy {}'.format(repr(repeat)))
+        self.modulebuilder.Function(nameof_this_func).WithParameters(term, match, head, tail, k).Block(fb)
+        return repeat
+
+    def transformInHole(self, pat):
+        assert isinstance(pat, pattern.InHole)
+        if self._function(pat) is not None:
+            return pat
+        nameof_this_func = 'lang_{}_lazy_inhole_{}'.format(self.languagename, self.symgen.get())
+        self.context.add_function_for_pattern(self.languagename, self._key(pat), nameof_this_func)
+
+        pat1, pat2 = pat.pat1, pat.pat2
+        self.transform(pat1)
+        self.transform(pat2)
+
+        # context is matched first and the subterm is matched in continuation of every context match.
+        slots1 = rpy.PyList(*[rpy.PyInt(slot) for slot in self.layout.slotsof(pat1)])
+        slots2 = rpy.PyList(*[rpy.PyInt(slot) for slot in self.layout.slotsof(pat2)])
+        constraints1, constraints2 = [], []
+        if pat.constraintchecks != None:
+            constraints1 = [self._slot(chck.sym1) for chck in pat.constraintchecks]
+            constraints2 = [self._slot(chck.sym2) for chck in pat.constraintchecks]
+        inhole = rpy.gen_pyid_for('{}_descriptor'.format(nameof_this_func))
+        self.modulebuilder.AssignTo(inhole).New('LazyInHole', rpy.PyId(self._function(pat2)), slots1, slots2, 
+                rpy.PyList(*constraints1), rpy.PyList(*constraints2))
+
+        contextcheck = PatternIsaCodegen(self.modulebuilder, pat1, self.context, self.languagename, self.symgen).runincontext()
+        if contextcheck is not None:
+            decompose = gen_inhole_decompositions_function(self.modulebuilder, self.context, self.languagename, self.symgen, pat1, contextcheck)
+        else:
+            decompose = MatchHelperFuncs.InHoleDecomposeAll
+
+        # Subterms not matching pat2 are skipped before the context is copied.
+        # tmp0 = decompose(term)
+        # tmp1 = tmp0.length()
+        # for tmp2 in range(tmp1):
+        #   tmp3 = tmp0.subterm(tmp2)
+        #   tmp4 = isapat2(tmp3)               # unless pat2 depends on bindings
+        #   if tmp4 != True:
+        #     continue
+        #   tmp5 = tmp0.context(tmp2, hole)
+        #   tmp6 = InHoleContinuation(inhole, tmp0, tmp2, match, head, tail, k)
+        #   tmp7 = match.emptycopy()
+        #   tmp8 = pat1fn(tmp5, tmp7, 0, 1, tmp6)
+        #   if tmp8 == True:
+        #     return True
+        # return False
+        symgen = SymGen()
+        term, match, head, tail, k = rpy.gen_pyid_for('term', 'match', 'head', 'tail', 'k')
+        hole = rpy.gen_pyid_for('{}_hole'.format(self.languagename))
+        tmp0, tmp1, tmp2, tmp3, tmp4, tmp5, tmp6, tmp7, tmp8 = rpy.gen_pyid_temporaries(9, symgen)
+
+        ifb1 = rpy.BlockBuilder()
+        ifb1.Return(rpy.PyBoolean(True))
+
+        forb = rpy.BlockBuilder()
+        forb.AssignTo(tmp3).MethodCall(tmp0, 'subterm', tmp2)
+        isacodegen = PatternIsaCodegen(self.modulebuilder, pat2, self.context, self.languagename, self.symgen)
+        if not isacodegen._requiresmatch(pat2):
+            ifb0 = rpy.BlockBuilder()
+            ifb0.Continue
+            forb.AssignTo(tmp4).FunctionCall(isacodegen.run(), tmp3)
+            forb.If.NotEqual(tmp4, rpy.PyBoolean(True)).ThenBlock(ifb0)
+        forb.AssignTo(tmp5).MethodCall(tmp0, 'context', tmp2, hole)
+        forb.AssignTo(tmp6).New('InHoleContinuation', inhole, tmp0, tmp2, match, head, tail, k)
+        forb.AssignTo(tmp7).MethodCall(match, MatchMethodTable.EmptyCopy)
+        forb.AssignTo(tmp8).FunctionCall(self._function(pat1), tmp5, tmp7, rpy.PyInt(0), rpy.PyInt(1), tmp6)
+        forb.If.Equal(tmp8, rpy.PyBoolean(True)).ThenBlock(ifb1)
+
+        fb = rpy.BlockBuilder()
+        fb.AssignTo(tmp0).FunctionCall(decompose, term)
+        fb.AssignTo(tmp1).MethodCall(tmp0, TermMethodTable.Length)
+        fb.For(tmp2).InRange(tmp1).Block(forb)
+        fb.Return(rpy.PyBoolean(False))
+
+        self.modulebuilder.SingleLineComment('lazy {}'.format(repr(pat)))
+        self.modulebuilder.Function(nameof_this_func).WithParameters(term, match, head, tail, k).Block(fb)
+        return pat
+
+
+class PatternIsaCodegen(pattern.PatternTransformer):
+    """
+    Generates boolean-only matcher f(term) -> bool for the pattern. Unlike functions generated by 
+    PatternCodegen, these do not allocate Match objects and return as soon as the first successful
+    path is found. Patterns that depend on bindings (in-hole patterns and constraint checks) are 
+    delegated to the full matcher.
+    """
+    def __init__(self, modulebuilder, pat, context, languagename, symgen):
+        assert isinstance(pat, pattern.Pat)
+        assert isinstance(context, CompilationContext)
+        self.modulebuilder = modulebuilder
+        self.pattern = pat 
+        self.context = context
+        self.languagename = languagename
+        self.symgen = symgen
+
+    def _requiresmatch(self, pat):
+        if isinstance(pat, pattern.InHole) or isinstance(pat, pattern.CheckConstraint):
+            return True
+        if isinstance(pat, pattern.PatSequence):
+            for p in pat:
+                if self._requiresmatch(p):
+                    return True
+        if isinstance(pat, pattern.Repeat):
+            return self._requiresmatch(pat.pat)
+        return False
+
+    def _key(self, pat):
+        # membership of the term does not depend on names of pattern variables unless the pattern
+        # is matched by the full matcher.
+        if self._requiresmatch(pat):
+            return repr(pat)
+        return PatternCanonicalizer().canonicalize(pat)
+
+    def run(self):
+        funcname = self.context.get_isa_function_name(self.languagename, self._key(self.pattern))
+        if funcname is not None:
+            return funcname
+
+        if isinstance(self.pattern, pattern.Nt):
+            return self.context.get_isa_function_name(self.languagename, self.pattern.prefix)
+        if isinstance(self.pattern, pattern.PatSequence) and not self._requiresmatch(self.pattern):
+            return self.transform(self.pattern)
+
+        nameof_this_func = 'lang_{}_isa_{}'.format(self.languagename, self.symgen.get('pat'))
+        self.context.add_isa_function_name(self.languagename, self._key(self.pattern), nameof_this_func)
+
+        symgen = SymGen()
+        term, matches = rpy.gen_pyid_for('term', 'matches')
+        fb = rpy.BlockBuilder()
+        if self._requiresmatch(self.pattern):
+            if self.context.get_toplevel_function_for_pattern(self.languagename, repr(self.pattern)) is None:
+                PatternCodegen(self.modulebuilder, self.pattern, self.context, self.languagename, self.symgen).run()
+
+            if self.context.lazy_match:
+                # match = first(term)
+                # if match is None:
+                #   return False
+                # return True
+                func2call = self.context.get_first_match_function_for_pattern(self.languagename, repr(self.pattern))
+                match = rpy.gen_pyid_for('match')
+                ifb = rpy.BlockBuilder()
+                ifb.Return(rpy.PyBoolean(False))
+                fb.AssignTo(match).FunctionCall(func2call, term)
+                fb.If.IsNone(match).ThenBlock(ifb)
+                fb.Return(rpy.PyBoolean(True))
+            else:
+                # matches = toplevel(term)
+                # if len(matches) != 0:
+                #   return True
+                # return False
+                func2call = self.context.get_toplevel_function_for_pattern(self.languagename, repr(self.pattern))
+                ifb = rpy.BlockBuilder()
+                ifb.Return(rpy.PyBoolean(True))
+                fb.AssignTo(matches).FunctionCall(func2call, term)
+                fb.If.LengthOf(matches).NotEqual(rpy.PyInt(0)).ThenBlock(ifb)
+                fb.Return(rpy.PyBoolean(False))
+        else:
+            # tmp0 = check(term)
+            # return tmp0
+            tmp0 = self._gen_check(fb, self.pattern, term, symgen)
+            if tmp0 is None:
+                fb.Return(rpy.PyBoolean(True))
+            else:
+                fb.Return(tmp0)
+
+        self.modulebuilder.SingleLineComment('isa {}'.format(repr(self.pattern)))
+        self.modulebuilder.Function(nameof_this_func).WithParameters(term).Block(fb)
+        return nameof_this_func
+
+    def _gen_check(self, fb, pat, term, symgen):
+        """
+        Emits code checking whether term matches pattern pat that consumes exactly one term.
+        Returns variable holding the result or None if any term matches the pattern.
+        """
+        if isinstance(pat, pattern.BuiltInPat) and pat.kind == pattern.BuiltInPatKind.Any:
+            return None
+
+        tmp0 = rpy.gen_pyid_temporaries(1, symgen)
+        if isinstance(pat, pattern.Nt):
+            isafunction = self.context.get_isa_function_name(self.languagename, pat.prefix)
+            assert isafunction is not None, 'define-language should have been generated by now'
+            fb.AssignTo(tmp0).FunctionCall(isafunction, term)
+            return tmp0
+
+        if isinstance(pat, pattern.PatSequence):
+            fb.AssignTo(tmp0).FunctionCall(self.transform(pat), term)
+            return tmp0
+
+        if isinstance(pat, pattern.BuiltInPat):
+            if pat.kind == pattern.BuiltInPatKind.VariableNotOtherwiseDefined:
+                gen_isa_function_for_variable_not_otherwise_mentioned(self.modulebuilder, self.context, self.languagename, pat)
+                isafunction = self.context.get_isa_function_name(self.languagename, pat.prefix)
+                fb.AssignTo(tmp0).FunctionCall(isafunction, term)
+                return tmp0
+            pat_isA_tab = {
+                pattern.BuiltInPatKind.Number:  TermHelperFuncs.TermIsNumber,
+                pattern.BuiltInPatKind.Integer: TermHelperFuncs.TermIsInteger,
+                pattern.BuiltInPatKind.Natural: TermHelperFuncs.TermIsNatural,
+                pattern.BuiltInPatKind.Float:   TermHelperFuncs.TermIsFloat,
+                pattern.BuiltInPatKind.String:  TermHelperFuncs.TermIsString,
+                pattern.BuiltInPatKind.Boolean: TermHelperFuncs.TermIsBoolean,
+                pattern.BuiltInPatKind.Hole:    TermHelperFuncs.TermIsHole,
+            }
+            assert pat.kind in pat_isA_tab, 'unsupported pattern' + str(pat.kind)
+            fb.AssignTo(tmp0).FunctionCall(pat_isA_tab[pat.kind], term)
+            return tmp0
+
+        if isinstance(pat, pattern.Lit):
+            lit_isA_tab = {
+                pattern.LitKind.Variable: (TermHelperFuncs.TermIsLiteralVariable, rpy.PyString),
+                pattern.LitKind.Integer:  (TermHelperFuncs.TermIsLiteralInteger,  lambda lit: rpy.PyInt(int(lit))),
+                pattern.LitKind.Float:    (TermHelperFuncs.TermIsLiteralFloat,    lambda lit: rpy.PyFloat(float(lit))),
+                pattern.LitKind.String:   (TermHelperFuncs.TermIsLiteralString,   rpy.PyString),
+                pattern.LitKind.Boolean:  (TermHelperFuncs.TermIsLiteralBoolean,  rpy.PyString),
+            }
+            assert pat.kind in lit_isA_tab, 'unknown literal kind ' + str(pat.kind)
+            isafunction, literal = lit_isA_tab[pat.kind]
+            fb.AssignTo(tmp0).FunctionCall(isafunction, term, literal(pat.lit))
+            return tmp0
+
+        assert False, 'unsupported pattern ' + repr(pat)
+
+    def transformPatSequence(self, seq):
+        assert isinstance(seq, pattern.PatSequence)
+        return self._gen_sequence(seq, False)
+
+    def _gen_element_check(self, fb, pat, term, head, symgen, incontext):
+        # returns variable holding the result of checking element of the sequence being matched.
+        if not incontext:
+            return self._gen_check(fb, pat, term, symgen)
+        if isinstance(pat, pattern.BuiltInPat) and pat.kind == pattern.BuiltInPatKind.Any:
+            return None
+        # tmp0 = inhole_child_depth(path, depth, head)
+        # tmp1 = ctxcheck(term, path, tmp0, within) 
+        path, depth, within = rpy.gen_pyid_for('path', 'depth', 'within')
+        tmp0, tmp1 = rpy.gen_pyid_temporaries(2, symgen)
+        fb.AssignTo(tmp0).FunctionCall(MatchHelperFuncs.InHoleChildDepth, path, depth, head)
+        if isinstance(pat, pattern.Nt):
+            fb.AssignTo(tmp1).FunctionCall(self._gen_nt_in_context(pat.prefix), term, path, tmp0, within)
+            return tmp1
+        if isinstance(pat, pattern.PatSequence):
+            fb.AssignTo(tmp1).FunctionCall(self._gen_sequence(pat, True), term, path, tmp0, within)
+            return tmp1
+        # non-sequence patterns do not match terms on the path, those are always sequences. When 
+        # looking for a term the hole could be within, only hole and any patterns may match, so
+        # treating the last term on the path as the hole is fine.
+        # tmp1 = inhole_subject(term, hole, path, tmp0)
+        hole = rpy.gen_pyid_for('{}_hole'.format(self.languagename))
+        fb.AssignTo(tmp1).FunctionCall(MatchHelperFuncs.InHoleSubject, term, hole, path, tmp0)
+        return self._gen_check(fb, pat, tmp1, symgen)
+
+    def _gen_sequence(self, seq, incontext):
+        # Sequence is split into segments at each repeat. Function for segment matches non-repeat 
+        # elements of the segment and then tries every possible number of terms consumed by the 
+        # repeat that follows, returning on the first success.
+        # Context-aware variant additionally takes path to the hole, the depth of the term on it and
+        # within flag (see runincontext).
+        assert isinstance(seq, pattern.PatSequence)
+        key = self._key(seq)
+        if incontext:
+            key = 'context {}'.format(self._key(seq))
+        nameof_this_func = self.context.get_isa_function_name(self.languagename, key)
+        if nameof_this_func is not None:
+            return nameof_this_func
+
+        if incontext:
+            nameof_this_func = 'lang_{}_isa_ctx_seq_{}'.format(self.languagename, self.symgen.get())
+        else:
+            nameof_this_func = 'lang_{}_isa_seq_{}'.format(self.languagename, self.symgen.get())
+        self.context.add_isa_function_name(self.languagename, key, nameof_this_func)
+
+        term, path, depth, within, head, tail = rpy.gen_pyid_for('term', 'path', 'depth', 'within', 'head', 'tail')
+        if incontext:
+            parameters = [term, path, depth, within]
+        else:
+            parameters = [term]
+
+        segmentstarts = [0] + [i+1 for i, pat in enumerate(seq) if isinstance(pat, pattern.Repeat)]
+        segmentfuncs = ['{}_from_{}'.format(nameof_this_func, start) for start in segmentstarts]
+        for k, start in enumerate(segmentstarts):
+            nextrepeat = len(seq)
+            if k + 1 < len(segmentstarts):
+                nextrepeat = segmentstarts[k+1] - 1
+
+            symgen = SymGen()
+            fb = rpy.BlockBuilder()
+
+            # tmp0 = tail - head
+            # if tmp0 < num_required:  # if tmp0 != num_required when there are no repeats left.
+            #   return False
+            num_required = 0
+            if start < len(seq):
+                num_required = seq.get_number_of_nonoptional_matches_between(start, len(seq))
+            tmp0 = rpy.gen_pyid_temporaries(1, symgen)
+            ifb = rpy.BlockBuilder()
+            ifb.Return(rpy.PyBoolean(False))
+            if nextrepeat == len(seq):
+                fb.AssignTo(tmp0).Subtract(tail, head)
+                fb.If.NotEqual(tmp0, rpy.PyInt(num_required)).ThenBlock(ifb)
+            elif num_required > 0:
+                fb.AssignTo(tmp0).Subtract(tail, head)
+                fb.If.LessThan(tmp0, rpy.PyInt(num_required)).ThenBlock(ifb)
+
+            # for each element:
+            #   tmp1 = term.get(head)
+            #   tmp2 = check(tmp1)
+            #   if tmp2 != True:
+            #     return False
+            #   head = head + 1
+            for pat in seq.seq[start:nextrepeat]:
+                tmp1 = rpy.gen_pyid_temporaries(1, symgen)
+                fb.AssignTo(tmp1).MethodCall(term, TermMethodTable.Get, head)
+                tmp2 = self._gen_element_check(fb, pat, tmp1, head, symgen, incontext)
+                if tmp2 is not None:
+                    ifb = rpy.BlockBuilder()
+                    ifb.Return(rpy.PyBoolean(False))
+                    fb.If.NotEqual(tmp2, rpy.PyBoolean(True)).ThenBlock(ifb)
+                fb.AssignTo(head).Add(head, rpy.PyInt(1))
+
+            if nextrepeat == len(seq):
+                fb.Return(rpy.PyBoolean(True))
+            else:
+                # while head < tail:
+                #   tmp3 = nextsegment(term, head, tail)
+                #   if tmp3 == True:
+                #     return True
+                #   tmp4 = term.get(head)
+                #   tmp5 = check(tmp4)
+                #   if tmp5 != True:
+                #     return False
+                #   head = head + 1
+                # tmp3 = nextsegment(term, head, tail)
+                # return tmp3
+                tmp3, tmp4 = rpy.gen_pyid_temporaries(2, symgen)
+                ifb1 = rpy.BlockBuilder()
+                ifb1.Return(rpy.PyBoolean(True))
+
+                wb = rpy.BlockBuilder()
+                wb.AssignTo(tmp3).FunctionCall(segmentfuncs[k+1], *(parameters + [head, tail]))
+                wb.If.Equal(tmp3, rpy.PyBoolean(True)).ThenBlock(ifb1)
+                wb.AssignTo(tmp4).MethodCall(term, TermMethodTable.Get, head)
+                tmp5 = self._gen_element_check(wb, seq[nextrepeat].pat, tmp4, head, symgen, incontext)
+                if tmp5 is not None:
+                    ifb2 = rpy.BlockBuilder()
+                    ifb2.Return(rpy.PyBoolean(False))
+                    wb.If.NotEqual(tmp5, rpy.PyBoolean(True)).ThenBlock(ifb2)
+                wb.AssignTo(head).Add(head, rpy.PyInt(1))
+
+                fb.While.LessThan(head, tail).Block(wb)
+                fb.AssignTo(tmp3).FunctionCall(segmentfuncs[k+1], *(parameters + [head, tail]))
+                fb.Return(tmp3)
+
+            self.modulebuilder.SingleLineComment('isa {} from {}'.format(repr(seq), start))
+            self.modulebuilder.Function(segmentfuncs[k]).WithParameters(*(parameters + [head, tail])).Block(fb)
+
+        symgen = SymGen()
+        tmp0, tmp1, tmp2 = rpy.gen_pyid_temporaries(3, symgen)
+        fb = rpy.BlockBuilder()
+
+        if incontext:
+            # tmp2 = inhole_position(path, depth)
+            # if tmp2 == InHolePosition.OffPath:
+            #   tmp1 = isa(term)
+            #   return tmp1
+            # if tmp2 == InHolePosition.Hole:
+            #   if within == True:    # only if the sequence can contain the hole.
+            #     return True
+            #   return False
+            isafunc = self._gen_sequence(seq, False)
+            ifb1 = rpy.BlockBuilder()
+            ifb1.AssignTo(tmp1).FunctionCall(isafunc, term)
+            ifb1.Return(tmp1)
+            ifb2 = rpy.BlockBuilder()
+            if self._canhavehole(seq):
+                ifb3 = rpy.BlockBuilder()
+                ifb3.Return(rpy.PyBoolean(True))
+                ifb2.If.Equal(within, rpy.PyBoolean(True)).ThenBlock(ifb3)
+            ifb2.Return(rpy.PyBoolean(False))
+
+            fb.AssignTo(tmp2).FunctionCall(MatchHelperFuncs.InHolePosition, path, depth)
+            fb.If.Equal(tmp2, rpy.PyInt(InHolePosition.OffPath)).ThenBlock(ifb1)
+            fb.If.Equal(tmp2, rpy.PyInt(InHolePosition.Hole)).ThenBlock(ifb2)
+
+        # if not isinstance(term, Sequence):
+        #   return False
+        # tmp0 = term.length()
+        # tmp1 = segment0(term, 0, tmp0)
+        # return tmp1
+        ifb = rpy.BlockBuilder()
+        ifb.Return(rpy.PyBoolean(False))
+
+        fb.If.NotIsInstance(term, 'Sequence').ThenBlock(ifb)
+        fb.AssignTo(tmp0).MethodCall(term, TermMethodTable.Length)
+        fb.AssignTo(tmp1).FunctionCall(segmentfuncs[0], *(parameters + [rpy.PyInt(0), tmp0]))
+        fb.Return(tmp1)
+
+        self.modulebuilder.SingleLineComment('isa {}'.format(repr(seq)))
+        self.modulebuilder.Function(nameof_this_func).WithParameters(*parameters).Block(fb)
+        return nameof_this_func
+
+    def _gen_nt_in_context(self, prefix):
+        # Context-aware non-terminal membership check. Alternatives that cannot be checked 
+        # without bindings are assumed to match, thus the result is a necessary condition.
+        key = 'context {}'.format(prefix)
+        nameof_this_func = self.context.get_isa_function_name(self.languagename, key)
+        if nameof_this_func is not None:
+            return nameof_this_func
+        nameof_this_func = 'lang_{}_isa_ctx_nt_{}'.format(self.languagename, prefix)
+        self.context.add_isa_function_name(self.languagename, key, nameof_this_func)
+
+        isafunc = self.context.get_isa_function_name(self.languagename, prefix)
+        assert isafunc is not None, 'define-language should have been generated by now'
+        hole = rpy.gen_pyid_for('{}_hole'.format(self.languagename))
+
+        # tmp0 = inhole_position(path, depth)
+        # if tmp0 == InHolePosition.OffPath:
+        #   tmp1 = isa(term)
+        #   return tmp1
+        # if tmp0 == InHolePosition.Hole:
+        #   if within == True:
+        #     return canhavehole
+        #   tmp1 = isa(hole)
+        #   return tmp1
+        # for each alternative:
+        #   tmp1 = ctxcheck(term, path, depth, within)
+        #   if tmp1 == True:
+        #     return True
+        # return False
+        symgen = SymGen()
+        term, path, depth, within = rpy.gen_pyid_for('term', 'path', 'depth', 'within')
+        tmp0, tmp1 = rpy.gen_pyid_temporaries(2, symgen)
+        ntdef = self.context.get_nt_definition(self.languagename, prefix)
+
+        ifb1 = rpy.BlockBuilder()
+        ifb1.AssignTo(tmp1).FunctionCall(isafunc, term)
+        ifb1.Return(tmp1)
+        ifb3 = rpy.BlockBuilder()
+        ifb3.Return(rpy.PyBoolean(self._canhavehole(ntdef.nt)))
+        ifb2 = rpy.BlockBuilder()
+        ifb2.If.Equal(within, rpy.PyBoolean(True)).ThenBlock(ifb3)
+        ifb2.AssignTo(tmp1).FunctionCall(isafunc, hole)
+        ifb2.Return(tmp1)
+
+        fb = rpy.BlockBuilder()
+        fb.AssignTo(tmp0).FunctionCall(MatchHelperFuncs.InHolePosition, path, depth)
+        fb.If.Equal(tmp0, rpy.PyInt(InHolePosition.OffPath)).ThenBlock(ifb1)
+        fb.If.Equal(tmp0, rpy.PyInt(InHolePosition.Hole)).ThenBlock(ifb2)
+        for pat in ntdef.patterns:
+            if self._containsinhole(pat):
+                fb.Return(rpy.PyBoolean(True))
+                break
+            pat = self._withoutconstraints(pat)
+            ifbtrue = rpy.BlockBuilder()
+            ifbtrue.Return(rpy.PyBoolean(True))
+            if isinstance(pat, pattern.Nt):
+                fb.AssignTo(tmp1).FunctionCall(self._gen_nt_in_context(pat.prefix), term, path, depth, within)
+                fb.If.Equal(tmp1, rpy.PyBoolean(True)).ThenBlock(ifbtrue)
+            elif isinstance(pat, pattern.PatSequence):
+                fb.AssignTo(tmp1).FunctionCall(self._gen_sequence(pat, True), term, path, depth, within)
+                fb.If.Equal(tmp1, rpy.PyBoolean(True)).ThenBlock(ifbtrue)
+            elif isinstance(pat, pattern.BuiltInPat) and pat.kind == pattern.BuiltInPatKind.Any:
+                fb.Return(rpy.PyBoolean(True))
+                break
+            # other patterns do not match terms on the path, those are always sequences.
+        else:
+            fb.Return(rpy.PyBoolean(False))
+
+        self.modulebuilder.SingleLineComment('isa {} in context'.format(prefix))
+        self.modulebuilder.Function(nameof_this_func).WithParameters(term, path, depth, within).Block(fb)
+        return nameof_this_func
+
+    def _canhavehole(self, pat):
+        # hole reachability computed by DefineLanguage_HoleReachabilitySolver. 
+        if isinstance(pat, pattern.Nt):
+            ntdef = self.context.get_nt_definition(self.languagename, pat.prefix)
+            _, maxholes = ntdef.nt.getattribute(pattern.PatternAttribute.NumberOfHoles)
+            return maxholes != NumberOfHoles.Zero
+        if isinstance(pat, pattern.BuiltInPat):
+            return pat.kind in (pattern.BuiltInPatKind.Hole, pattern.BuiltInPatKind.Any)
+        if isinstance(pat, pattern.PatSequence):
+            for p in pat:
+                if self._canhavehole(p):
+                    return True
+            return False
+        if isinstance(pat, pattern.Repeat):
+            return self._canhavehole(pat.pat)
+        return False
+
+    def _containsinhole(self, pat):
+        if isinstance(pat, pattern.InHole):
+            return True
+        if isinstance(pat, pattern.PatSequence):
+            for p in pat:
+                if self._containsinhole(p):
+                    return True
+        if isinstance(pat, pattern.Repeat):
+            return self._containsinhole(pat.pat)
+        return False
+
+    def _withoutconstraints(self, pat):
+        # constraint checks only ever reject matches, thus checking the pattern without them 
+        # gives a necessary condition.
+        if isinstance(pat, pattern.PatSequence):
+            seq = [self._withoutconstraints(p) for p in pat if not isinstance(p, pattern.CheckConstraint)]
+            return pattern.PatSequence(seq)
+        if isinstance(pat, pattern.Repeat):
+            return pattern.Repeat(self._withoutconstraints(pat.pat), pat.matchmode)
+        return pat
+
+    def runincontext(self):
+        """
+        Generates context-aware membership check f(root, path, 0, within) -> bool. If within is False, 
+        tells whether the pattern may match the root term with the subterm at index path replaced 
+        with the hole. Otherwise tells whether the pattern may match the root term with the hole 
+        placed somewhere within that subterm. No copy of the term is made. Returns None if the 
+        pattern contains in-hole patterns.
+        """
+        if self._containsinhole(self.pattern):
+            return None
+        pat = self._withoutconstraints(self.pattern)
+        if isinstance(pat, pattern.Nt):
+            return self._gen_nt_in_context(pat.prefix)
+        if isinstance(pat, pattern.PatSequence):
+            return self._gen_sequence(pat, True)
+        return None
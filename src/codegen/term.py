@@ -5,14 +5,17 @@ from src.context import CompilationContext
 
 from src.codegen.common import TermHelperFuncs, MatchHelperFuncs, \
                           MatchMethodTable, TermKind, \
-                          TermMethodTable
+                          TermMethodTable, MatchLayout, emptymatchlayout
 
 class TermCodegen(term.TermTransformer):
-    def __init__(self, modulebuilder, context):
+    # layout - slots of pattern variables in Match objects passed to generated functions.
+    def __init__(self, modulebuilder, context, layout=emptymatchlayout):
         assert isinstance(modulebuilder, rpy.BlockBuilder)
         assert isinstance(context, CompilationContext)
+        assert isinstance(layout, MatchLayout)
         self.context = context
         self.modulebuilder = modulebuilder 
+        self.layout = layout
         self.symgen = SymGen()
 
     def _gen_inconsistent_ellipsis_match_counts(self, foreach, bb, symgen):
@@ -32,9 +35,14 @@ class TermCodegen(term.TermTransformer):
         bb.AssignTo(lengths).PySet(*tmps)
         bb.If.LengthOf(lengths).NotEqual(rpy.PyInt(1)).ThenBlock(ifb)
 
+    # When hash-consing is enabled, every produced term goes through intern_term.
+    def _gen_intern_term(self, fb, t):
+        if self.context.hash_cons:
+            fb.AssignTo(t).FunctionCall(TermHelperFuncs.InternTerm, t)
+
     # Reads InArg annotation and creates two arrays - one with function parameters 
-    # and another one with (PyID(paramname), PyString(sym)) pairs that will be used to create
-    # paramname = match.getbinding(sym) statements.
+    # and another one with (PyID(paramname), PyInt(slot)) pairs that will be used to create
+    # paramname = match.getbinding(slot) statements.
     def _gen_inputs(self, t):
         match = rpy.PyId('match') 
         parameters = []
@@ -48,7 +56,7 @@ class TermCodegen(term.TermTransformer):
         try: 
             matchread_annotations = t.getattribute(term.TermAttribute.MatchRead)
             for sym, paramname in matchread_annotations: 
-                matchreads.append((rpy.PyId(paramname), rpy.PyString(sym)))
+                matchreads.append((rpy.PyId(paramname), rpy.PyInt(self.layout.slot(sym))))
         except:
             pass
         return match, parameters, matchreads
@@ -81,7 +89,16 @@ class TermCodegen(term.TermTransformer):
         funcname = self.context.get_function_for_term_template(pycall)
         tmpi = rpy.gen_pyid_temporaries(1, symgen)
 
+        # python functions return None if metafunction case does not apply.
+        # tmpi = pyfunc(...)
+        # if tmpi is not None:
+        #   tmpi = intern_term(tmpi)      # if -hash-cons
+        # return tmpi
         fb.AssignTo(tmpi).FunctionCall(pycall.functionname, *pycallarguments)
+        if self.context.hash_cons:
+            ifb = rpy.BlockBuilder()
+            self._gen_intern_term(ifb, tmpi)
+            fb.If.IsNotNone(tmpi).ThenBlock(ifb)
         fb.Return(tmpi)
 
         self.modulebuilder.SingleLineComment(repr(pycall))
@@ -118,7 +135,8 @@ class TermCodegen(term.TermTransformer):
         plugholeargs.append(t2)
 
         ret = rpy.gen_pyid_for('ret')
-        fb.AssignTo(ret).FunctionCall('plughole', *plugholeargs)
+        fb.AssignTo(ret).FunctionCall(TermHelperFuncs.PlugHole, *plugholeargs)
+        self._gen_intern_term(fb, ret)
         fb.Return(ret)
 
         self.modulebuilder.SingleLineComment(repr(inhole))
@@ -217,6 +235,7 @@ class TermCodegen(term.TermTransformer):
 
         tmpi = rpy.gen_pyid_temporaries(1, symgen)
         fb.AssignTo(tmpi).New('Sequence', lst)
+        self._gen_intern_term(fb, tmpi)
         fb.Return(tmpi)
 
         self.modulebuilder.SingleLineComment(repr(termsequence))
@@ -266,6 +285,7 @@ class TermCodegen(term.TermTransformer):
             fb.AssignTo(tmp0).New('String', rpy.PyString(node.value))
         if node.kind == term.TermLiteralKind.Boolean:
             fb.AssignTo(tmp0).New('Boolean', rpy.PyString(node.value))
+        self._gen_intern_term(fb, tmp0)
 
         fb.Return(tmp0)
 
@@ -3,15 +3,18 @@ import src.model.term as TERM
 import src.model.rpython as rpy
 import src.model.pattern as pattern
 
-from src.codegen.pattern import PatternCodegen
+from src.codegen.pattern import PatternCodegen, PatternIsaCodegen
 from src.codegen.term    import TermCodegen
+from src.codegen.discrimination import DiscriminationIndexCodegen
+from src.codegen.decisiontree import SequenceAlternativesCodegen
 
 from src.util import SymGen
 from src.context import CompilationContext
 
 from src.codegen.common import TermHelperFuncs, MatchHelperFuncs, \
                           MatchMethodTable, TermKind, \
-                          TermMethodTable, ReadFromStdinAndParse
+                          TermMethodTable, ReadFromStdinAndParse, ParseReductionOptions, ReduceDeterministically, \
+                          ReductionGraphMethodTable, MatchLayout
 
 #------------------------------
 # Top-level form codegen
@@ -32,6 +35,7 @@ class TopLevelFormCodegen(tlform.TopLevelFormVisitor):
         self.modulebuilder.IncludeFromPythonSource('runtime/parser.py')
         self.modulebuilder.IncludeFromPythonSource('runtime/fresh.py')
         self.modulebuilder.IncludeFromPythonSource('runtime/match.py')
+        self.modulebuilder.IncludeFromPythonSource('runtime/reduction.py')
 
         # parse all term literals. 
         # ~~ 26.07.2020 disable lit terms for now, need to implement
@@ -59,7 +63,8 @@ class TopLevelFormCodegen(tlform.TopLevelFormVisitor):
         fb = rpy.BlockBuilder()
         symgen = SymGen()
         ## emit some dummy Terms to aid RPython with type inference.
-        tmp0, tmp1, tmp2, tmp3, tmp4 = rpy.gen_pyid_temporaries(5, symgen)
+        tmp0, tmp1, tmp2, tmp3, tmp4, tmp5 = rpy.gen_pyid_temporaries(6, symgen)
+        fb.AssignTo(tmp5).FunctionCall(ParseReductionOptions, rpy.PyId('argv'))
         fb.AssignTo(tmp0).New('Integer', rpy.PyInt(0))
         fb.AssignTo(tmp1).New('Float', rpy.PyFloat(0.0))
         fb.AssignTo(tmp2).New('String', rpy.PyString("\"hello world!\""))
@@ -77,39 +82,84 @@ class TopLevelFormCodegen(tlform.TopLevelFormVisitor):
         fb.Return(rpy.PyTuple(rpy.PyId('entrypoint'), rpy.PyNone()))
         self.modulebuilder.Function('target').WithParameters(rpy.PyVarArg('args')).Block(fb)
 
-        # if __name__ == '__main__': entrypoint() 
+        # if __name__ == '__main__': entrypoint(sys.argv) 
         # for python2.7 compatibility.
         ifb = rpy.BlockBuilder()
         tmp = rpy.gen_pyid_temporaries(1, self.symgen)
-        ifb.AssignTo(tmp).FunctionCall('entrypoint', rpy.PyList())
+        ifb.AssignTo(tmp).FunctionCall('entrypoint', rpy.PyId('sys.argv'))
         self.modulebuilder.If.Equal(rpy.PyId('__name__'), rpy.PyString('__main__')).ThenBlock(ifb)
 
         return rpy.Module(self.modulebuilder.build())
 
     def _codegenNtDefinition(self, languagename, ntdef):
         assert isinstance(ntdef, tlform.DefineLanguage.NtDefinition)
+        isafuncs = []
         for pat in ntdef.patterns:
-            if self.context.get_toplevel_function_for_pattern(languagename, repr(pat)) is None:
-                PatternCodegen(self.modulebuilder, pat, self.context, languagename, self.symgen).run()
+            isafuncs.append(PatternIsaCodegen(self.modulebuilder, pat, self.context, languagename, self.symgen).run())
         
         nameof_this_func = 'lang_{}_isa_nt_{}'.format(languagename, ntdef.nt.prefix)
-        term, match, matches = rpy.gen_pyid_for('term', 'match', 'matches')
+        ntbit = self.context.get_nt_membership_bit(languagename, ntdef.nt.prefix)
+        term, result, known, tmp = rpy.gen_pyid_for('term', 'result', 'known', 'tmp')
+        # known = term.ntmembership(ntbit)
+        # if known == 1:
+        #   return True
+        # if known == 0:
+        #   return False
         # for each pattern in ntdefinition
-        # match = Match(...)
-        # matches = matchpat(term, match, 0, 1)
-        # if len(matches) != 0:
+        # result = isapat(term)
+        # if result == True:
+        #   tmp = term.addntmembership(ntbit, True)
         #   return True
+        # tmp = term.addntmembership(ntbit, False)
+        # return False
         fb = rpy.BlockBuilder()
-
-        for pat in ntdef.patterns:
-            func2call = self.context.get_toplevel_function_for_pattern(languagename, repr(pat))
-
+        if ntbit is not None:
+            ifb1 = rpy.BlockBuilder()
+            ifb1.Return(rpy.PyBoolean(True))
+            ifb2 = rpy.BlockBuilder()
+            ifb2.Return(rpy.PyBoolean(False))
+            fb.AssignTo(known).MethodCall(term, TermMethodTable.NtMembership, rpy.PyInt(ntbit))
+            fb.If.Equal(known, rpy.PyInt(1)).ThenBlock(ifb1)
+            fb.If.Equal(known, rpy.PyInt(0)).ThenBlock(ifb2)
+
+        # only alternatives that may match the term are tried, see DiscriminationIndexCodegen.
+        def emitexit(fb):
+            if ntbit is not None:
+                fb.AssignTo(tmp).MethodCall(term, TermMethodTable.AddNtMembership, rpy.PyInt(ntbit), rpy.PyBoolean(False))
+            fb.Return(rpy.PyBoolean(False))
+
+        # Alternatives of the bucket that are sequences of the same length are checked together,
+        # see SequenceAlternativesCodegen.
+        discrimination = DiscriminationIndexCodegen(self.modulebuilder, self.context, languagename, self.symgen)
+        merger = SequenceAlternativesCodegen(self.modulebuilder, self.context, languagename, self.symgen)
+        def emitbucket(fb, indices, length):
+            groups = {}
+            for i in indices:
+                pat = ntdef.patterns[i]
+                if merger.canmerge(pat):
+                    groups.setdefault(len(pat.seq), []).append(i)
+            for i in indices:
+                pat = ntdef.patterns[i]
+                if not merger.canmerge(pat) or len(groups[len(pat.seq)]) == 1:
+                    discrimination.emitguarded(fb, pat, length, lambda ab: emitalternative(ab, i))
+                elif groups[len(pat.seq)][0] == i:
+                    func2call = merger.run([ntdef.patterns[j] for j in groups[len(pat.seq)]])
+                    discrimination.emitguarded(fb, pat, length, lambda ab: emitcall(ab, func2call))
+
+        def emitcall(fb, func2call):
             ifb = rpy.BlockBuilder()
+            if ntbit is not None:
+                ifb.AssignTo(tmp).MethodCall(term, TermMethodTable.AddNtMembership, rpy.PyInt(ntbit), rpy.PyBoolean(True))
             ifb.Return(rpy.PyBoolean(True))
 
-            fb.AssignTo(matches).FunctionCall(func2call, term)
-            fb.If.LengthOf(matches).NotEqual(rpy.PyInt(0)).ThenBlock(ifb)
-        fb.Return(rpy.PyBoolean(False))
+            fb.AssignTo(result).FunctionCall(func2call, term)
+            fb.If.Equal(result, rpy.PyBoolean(True)).ThenBlock(ifb)
+
+        def emitalternative(fb, i):
+            emitcall(fb, isafuncs[i])
+
+        discrimination.emit(fb, term, ntdef.patterns, SymGen(), emitalternative, emitexit, 
+                emitbucket if self.context.decision_trees else None)
 
         self.modulebuilder.Function(nameof_this_func).WithParameters(term).Block(fb)
     
@@ -123,6 +173,7 @@ class TopLevelFormCodegen(tlform.TopLevelFormVisitor):
         for ntsym, ntdef in form.nts.items():
             nameof_this_func = 'lang_{}_isa_nt_{}'.format(form.name, ntsym)
             self.context.add_isa_function_name(form.name, ntdef.nt.prefix, nameof_this_func)
+            self.context.add_nt_definition(form.name, ntdef)
 
         for nt in form.nts.values():
             self._codegenNtDefinition(form.name, nt)
@@ -164,20 +215,19 @@ class TopLevelFormCodegen(tlform.TopLevelFormVisitor):
             self.modulebuilder.AssignTo(tmp0).FunctionCall(nameof_this_func)
 
     def _visitRedexMatchAssertEqual(self, form):
-        def gen_matches(expectedmatches, fb, symgen):
+        def gen_matches(expectedmatches, layout, fb, symgen):
             processedmatches = []
             for m in expectedmatches:
                 tmp0 = rpy.gen_pyid_temporaries(1, symgen)
-                fb.AssignTo(tmp0).New('Match')
+                fb.AssignTo(tmp0).New('Match', rpy.PyId(layout.name))
                 processedmatches.append(tmp0) 
                 for sym, termx in m.bindings:
-                    tmp1, tmp2, tmp3, tmp4 = rpy.gen_pyid_temporaries(4, symgen)
+                    tmp1, tmp2, tmp4 = rpy.gen_pyid_temporaries(3, symgen)
                     TermCodegen(self.modulebuilder, self.context).transform(termx)
                     termfunc = self.context.get_function_for_term_template(termx)
                     fb.AssignTo(tmp1).New('Match')
                     fb.AssignTo(tmp2).FunctionCall(termfunc, tmp1)
-                    fb.AssignTo(tmp3).MethodCall(tmp0, MatchMethodTable.AddKey, rpy.PyString(sym))
-                    fb.AssignTo(tmp4).MethodCall(tmp0, MatchMethodTable.AddToBinding, rpy.PyString(sym), tmp2)
+                    fb.AssignTo(tmp4).MethodCall(tmp0, MatchMethodTable.AddToBinding, rpy.PyInt(layout.slot(sym)), tmp2)
             tmpi = rpy.gen_pyid_temporaries(1, symgen)
             fb.AssignTo(tmpi).PyList(*processedmatches)
             return tmpi
@@ -187,12 +237,13 @@ class TopLevelFormCodegen(tlform.TopLevelFormVisitor):
             PatternCodegen(self.modulebuilder, form.pat, self.context, form.languagename, self.symgen).run()
         TermCodegen(self.modulebuilder, self.context).transform(form.termtemplate)
         matchfunc = self.context.get_toplevel_function_for_pattern(form.languagename, repr(form.pat))
+        layout = self.context.get_match_layout_for_pattern(form.languagename, repr(form.pat))
         termfunc  = self.context.get_function_for_term_template(form.termtemplate)
         symgen = SymGen()
 
         matches, match, term = rpy.gen_pyid_for('matches', 'match', 'term') 
         fb = rpy.BlockBuilder()
-        expectedmatches = gen_matches(form.expectedmatches, fb, symgen)
+        expectedmatches = gen_matches(form.expectedmatches, layout, fb, symgen)
         tmp0, tmp1, tmp2 = rpy.gen_pyid_temporaries(3, symgen)
         fb.AssignTo(tmp0).New('Match')
         fb.AssignTo(term).FunctionCall(termfunc, tmp0)
@@ -210,8 +261,11 @@ class TopLevelFormCodegen(tlform.TopLevelFormVisitor):
     def _visitTermLetAssertEqual(self, form):
         assert isinstance(form, tlform.TermLetAssertEqual)
 
+        layout = MatchLayout(self.symgen.get('termlet_layout'), form.variableassignments.keys())
+        layout.gen(self.modulebuilder)
+
         template = form.template
-        TermCodegen(self.modulebuilder, self.context).transform(template)
+        TermCodegen(self.modulebuilder, self.context, layout).transform(template)
         templatetermfunc = self.context.get_function_for_term_template(template)
 
         TermCodegen(self.modulebuilder, self.context).transform(form.expected)
@@ -227,17 +281,16 @@ class TopLevelFormCodegen(tlform.TopLevelFormVisitor):
         fb.AssignTo(tmp0).New('Match')
         fb.AssignTo(expected).FunctionCall(expectedtermfunc, tmp0) 
         
-        fb.AssignTo(match).New('Match')
+        fb.AssignTo(match).New('Match', rpy.PyId(layout.name))
         for variable, term in form.variableassignments.items():
-            tmp1, tmp2, tmp3, tmp4 = rpy.gen_pyid_temporaries(4, symgen)
+            tmp1, tmp2, tmp4 = rpy.gen_pyid_temporaries(3, symgen)
 
             TermCodegen(self.modulebuilder, self.context).transform(term)
             termfunc = self.context.get_function_for_term_template(term)
 
             fb.AssignTo(tmp1).New('Match')
             fb.AssignTo(tmp2).FunctionCall(termfunc, tmp1) 
-            fb.AssignTo(tmp3).MethodCall(match, MatchMethodTable.AddKey, rpy.PyString(variable))
-            fb.AssignTo(tmp4).MethodCall(match, MatchMethodTable.AddToBinding, rpy.PyString(variable), tmp2)
+            fb.AssignTo(tmp4).MethodCall(match, MatchMethodTable.AddToBinding, rpy.PyInt(layout.slot(variable)), tmp2)
 
         tmp0, tmp1, tmp2 = rpy.gen_pyid_temporaries(3, symgen)
         fb.AssignTo(tmp0).FunctionCall(templatetermfunc, match)
@@ -253,7 +306,8 @@ class TopLevelFormCodegen(tlform.TopLevelFormVisitor):
 
         if self.context.get_toplevel_function_for_pattern(languagename, repr(rc.pattern)) is None:
             PatternCodegen(self.modulebuilder, rc.pattern, self.context, languagename, self.symgen).run()
-        TermCodegen(self.modulebuilder, self.context).transform(rc.termtemplate)
+        layout = self.context.get_match_layout_for_pattern(languagename, repr(rc.pattern))
+        TermCodegen(self.modulebuilder, self.context, layout).transform(rc.termtemplate)
 
         nameof_matchfn = self.context.get_toplevel_function_for_pattern(languagename, repr(rc.pattern))
         nameof_termfn = self.context.get_function_for_term_template(rc.termtemplate)
@@ -286,7 +340,7 @@ class TopLevelFormCodegen(tlform.TopLevelFormVisitor):
                     .format(reductionrelationname, rc.name), 
                     tmpa, tmpb)
             forb.AssignTo(tmp2).FunctionCall(nameof_domaincheck, tmp0)
-            forb.If.LengthOf(tmp2).Equal(rpy.PyInt(0)).ThenBlock(ifb)
+            forb.If.NotEqual(tmp2, rpy.PyBoolean(True)).ThenBlock(ifb)
         forb.AssignTo(tmp1).MethodCall(terms, 'append', tmp0)
 
         ifb = rpy.BlockBuilder()
@@ -301,6 +355,194 @@ class TopLevelFormCodegen(tlform.TopLevelFormVisitor):
         self.modulebuilder.Function(nameof_rc).WithParameters(term).Block(fb)
         return nameof_rc
 
+    # Returns indices leading from the term produced by the template to the term produced by its in-hole 
+    # subterm along with the in-hole subterm itself if the position is known statically - the in-hole term
+    # is either the template itself or is nested in sequences and not preceded by ellipses. The context of
+    # in-hole term has to be a pattern variable so the term the contractum was plugged into can be read 
+    # from the match. Returns None otherwise.
+    def _find_plug_position(self, termtemplate):
+        if isinstance(termtemplate, TERM.InHole):
+            if not isinstance(termtemplate.term1, TERM.PatternVariable):
+                return None
+            try:
+                if len(termtemplate.term1.getattribute(TERM.TermAttribute.InArg)) != 0:
+                    return None
+            except KeyError:
+                pass
+            return [], termtemplate
+        if isinstance(termtemplate, TERM.TermSequence):
+            for i, t in enumerate(termtemplate.seq):
+                if isinstance(t, TERM.Repeat):
+                    return None
+                position = self._find_plug_position(t)
+                if position is not None:
+                    indices, inhole = position
+                    return [i] + indices, inhole
+        return None
+
+    def _codegenDeterministicReductionCase(self, rc, languagename, reductionrelationname, nameof_domaincheck=None, refocus=False):
+        assert isinstance(rc, tlform.DefineReductionRelation.ReductionCase)
+
+        nameof_firstfn = PatternCodegen(self.modulebuilder, rc.pattern, self.context, languagename, self.symgen).runfirst()
+        layout = self.context.get_match_layout_for_pattern(languagename, repr(rc.pattern))
+        TermCodegen(self.modulebuilder, self.context, layout).transform(rc.termtemplate)
+        nameof_termfn = self.context.get_function_for_term_template(rc.termtemplate)
+
+        nameof_rc = self.symgen.get('{}_{}_firstcase'.format(languagename, reductionrelationname))
+
+        symgen = SymGen()
+        # tmp2 = refocusing.setactive(refocus)      # if #:refocus
+        # match = first(term)
+        # tmp2 = refocusing.setactive(False)        # if #:refocus
+        # if match is None:
+        #   return None
+        # tmp0 = gen_term(match)
+        # tmp1 = match_domain(tmp0)
+        # if tmp1 != True:
+        #   raise Exception('reduction-relation {}: term reduced from {} to {} via rule {} and is outside domain')
+        # { if #:refocus and position of the plugged term in tmp0 is known
+        # tmp3 = gen_context(match)
+        # tmp4 = tmp0.get(i).get(j)...
+        # tmp2 = refocusing.sethint(tmp0, tmp4, tmp3)
+        # { otherwise, if #:refocus
+        # tmp2 = refocusing.clearhint() }
+        # return tmp0
+        term, match, refocusarg, refocusing = rpy.gen_pyid_for('term', 'match', 'refocus', 'refocusing')
+        tmp0, tmp1, tmp2, tmp3, tmp4 = rpy.gen_pyid_temporaries(5, symgen)
+
+        fb = rpy.BlockBuilder()
+        ifb = rpy.BlockBuilder()
+        ifb.Return(rpy.PyNone())
+        if refocus:
+            fb.AssignTo(tmp2).MethodCall(refocusing, 'setactive', refocusarg)
+        fb.AssignTo(match).FunctionCall(nameof_firstfn, term)
+        if refocus:
+            fb.AssignTo(tmp2).MethodCall(refocusing, 'setactive', rpy.PyBoolean(False))
+        fb.If.IsNone(match).ThenBlock(ifb)
+        fb.AssignTo(tmp0).FunctionCall(nameof_termfn, match)
+        if nameof_domaincheck is not None:
+            ifb = rpy.BlockBuilder()
+            tmpa, tmpb = rpy.gen_pyid_temporaries(2, symgen)
+            ifb.AssignTo(tmpa).MethodCall(term, TermMethodTable.ToString)
+            ifb.AssignTo(tmpb).MethodCall(tmp0, TermMethodTable.ToString)
+            ifb.RaiseException('reduction-relation \\"{}\\": term reduced from %s to %s via rule \\"{}\\" is outside domain' \
+                    .format(reductionrelationname, rc.name), 
+                    tmpa, tmpb)
+            fb.AssignTo(tmp1).FunctionCall(nameof_domaincheck, tmp0)
+            fb.If.NotEqual(tmp1, rpy.PyBoolean(True)).ThenBlock(ifb)
+        if refocus:
+            position = self._find_plug_position(rc.termtemplate)
+            if position is not None:
+                indices, inhole = position
+                nameof_contextfn = self.context.get_function_for_term_template(inhole.term1)
+                fb.AssignTo(tmp3).FunctionCall(nameof_contextfn, match)
+                fb.AssignTo(tmp4).PyId(tmp0)
+                for i in indices:
+                    fb.AssignTo(tmp4).MethodCall(tmp4, TermMethodTable.Get, rpy.PyInt(i))
+                fb.AssignTo(tmp2).MethodCall(refocusing, 'sethint', tmp0, tmp4, tmp3)
+            else:
+                fb.AssignTo(tmp2).MethodCall(refocusing, 'clearhint')
+        fb.Return(tmp0)
+
+        parameters = [term, refocusarg] if refocus else [term]
+        self.modulebuilder.Function(nameof_rc).WithParameters(*parameters).Block(fb)
+        return nameof_rc
+
+    def _codegenDeterministicReductionRelation(self, form, nameof_domaincheck):
+        # def reduction_relation_name_first(term):
+        #   { domain check }
+        #   { for each case that may match the term
+        #   tmpi = rc_first(term)
+        #   if tmpi is not None:
+        #     return tmpi }
+        #   return None
+        # def reduction_relation_name(term):
+        #   tmp0 = reduction_relation_name_first(term)
+        #   if tmp0 is None:
+        #     return []
+        #   return [tmp0]
+        # With #:refocus, reduction_relation_name_first and functions of cases take additional
+        # argument telling whether refocusing is active, see Refocusing. Cases are first matched
+        # with refocusing, full search is done if none of them matches.
+        # Refocusing is only attempted if the previous step left a hint for the term being reduced.
+        # def reduction_relation_name_refocus(term):
+        #   tmp0 = None
+        #   tmp1 = refocusing.hashintfor(term)
+        #   if tmp1 == True:
+        #     tmp0 = reduction_relation_name_first(term, True)
+        #   if tmp0 is None:
+        #     tmp0 = reduction_relation_name_first(term, False)
+        #   return tmp0
+        rcfuncs = []
+        for rc in form.reductioncases:
+            rcfuncs.append(self._codegenDeterministicReductionCase(rc, form.languagename, form.name, nameof_domaincheck, form.refocus))
+
+        term, refocusarg = rpy.gen_pyid_for('term', 'refocus')
+        caseargs = [term, refocusarg] if form.refocus else [term]
+        symgen = SymGen()
+
+        fb = rpy.BlockBuilder()
+        if nameof_domaincheck != None:
+            tmp0 = rpy.gen_pyid_temporaries(1, symgen)
+            ifb = rpy.BlockBuilder()
+            tmpa = rpy.gen_pyid_temporaries(1, symgen)
+            ifb.AssignTo(tmpa).MethodCall(term, TermMethodTable.ToString)
+            ifb.RaiseException('reduction-relation not defined for %s', tmpa)
+
+            fb.AssignTo(tmp0).FunctionCall(nameof_domaincheck, term)
+            fb.If.NotEqual(tmp0, rpy.PyBoolean(True)).ThenBlock(ifb)
+
+        def emitcase(fb, i):
+            tmpi = rpy.gen_pyid_temporaries(1, symgen)
+            ifb = rpy.BlockBuilder()
+            ifb.Return(tmpi)
+            fb.AssignTo(tmpi).FunctionCall(rcfuncs[i], *caseargs)
+            fb.If.IsNotNone(tmpi).ThenBlock(ifb)
+
+        def emitexit(fb):
+            fb.Return(rpy.PyNone())
+
+        DiscriminationIndexCodegen(self.modulebuilder, self.context, form.languagename, self.symgen) \
+                .emit(fb, term, [rc.pattern for rc in form.reductioncases], symgen, emitcase, emitexit)
+
+        nameof_first = '{}_{}_first'.format(form.languagename, form.name)
+        self.modulebuilder.Function(nameof_first).WithParameters(*caseargs).Block(fb)
+
+        if form.refocus:
+            symgen = SymGen()
+            tmp0, tmp1 = rpy.gen_pyid_temporaries(2, symgen)
+            refocusing = rpy.gen_pyid_for('refocusing')
+            hintb = rpy.BlockBuilder()
+            hintb.AssignTo(tmp0).FunctionCall(nameof_first, term, rpy.PyBoolean(True))
+            ifb = rpy.BlockBuilder()
+            ifb.AssignTo(tmp0).FunctionCall(nameof_first, term, rpy.PyBoolean(False))
+            fb = rpy.BlockBuilder()
+            fb.AssignTo(tmp0).PyId(rpy.PyNone())
+            fb.AssignTo(tmp1).MethodCall(refocusing, 'hashintfor', term)
+            fb.If.Equal(tmp1, rpy.PyBoolean(True)).ThenBlock(hintb)
+            fb.If.IsNone(tmp0).ThenBlock(ifb)
+            fb.Return(tmp0)
+            nameof_refocus = '{}_{}_refocus'.format(form.languagename, form.name)
+            self.context.add_deterministic_reduction_relation(form.name, nameof_refocus)
+            self.modulebuilder.Function(nameof_refocus).WithParameters(term).Block(fb)
+        else:
+            self.context.add_deterministic_reduction_relation(form.name, nameof_first)
+
+        symgen = SymGen()
+        tmp0 = rpy.gen_pyid_temporaries(1, symgen)
+        ifb = rpy.BlockBuilder()
+        ifb.Return(rpy.PyList())
+        fb = rpy.BlockBuilder()
+        fullsearchargs = [term, rpy.PyBoolean(False)] if form.refocus else [term]
+        fb.AssignTo(tmp0).FunctionCall(nameof_first, *fullsearchargs)
+        fb.If.IsNone(tmp0).ThenBlock(ifb)
+        fb.Return(rpy.PyList(tmp0))
+
+        nameof_function = '{}_{}'.format(form.languagename, form.name)
+        self.context.add_reduction_relation(form.name, nameof_function)
+        self.modulebuilder.Function(nameof_function).WithParameters(term).Block(fb)
+        return form
+
     def _visitDefineReductionRelation(self, form):
         assert isinstance(form, tlform.DefineReductionRelation)
         # def reduction_relation_name(term):
@@ -309,13 +551,11 @@ class TopLevelFormCodegen(tlform.TopLevelFormVisitor):
         # tmpi = rc(term)
         # outterms = outterms + tmp{i} 
         # return outterms
-        if form.domain != None:
-            if self.context.get_toplevel_function_for_pattern(form.languagename, repr(form.domain)) is None:
-                PatternCodegen(self.modulebuilder, form.domain, self.context, form.languagename, self.symgen).run()
-
         nameof_domaincheck = None
         if form.domain != None:
-            nameof_domaincheck = self.context.get_toplevel_function_for_pattern(form.languagename, repr(form.domain))
+            nameof_domaincheck = PatternIsaCodegen(self.modulebuilder, form.domain, self.context, form.languagename, self.symgen).run()
+        if form.deterministic:
+            return self._codegenDeterministicReductionRelation(form, nameof_domaincheck)
 
         rcfuncs = []
         for rc in form.reductioncases:
@@ -335,14 +575,20 @@ class TopLevelFormCodegen(tlform.TopLevelFormVisitor):
             ifb.RaiseException('reduction-relation not defined for %s', tmpa)
 
             fb.AssignTo(tmp0).FunctionCall(nameof_domaincheck, term)
-            fb.If.LengthOf(tmp0).Equal(rpy.PyInt(0)).ThenBlock(ifb)
+            fb.If.NotEqual(tmp0, rpy.PyBoolean(True)).ThenBlock(ifb)
 
-        fb.AssignTo(terms).PyList()
-        for rcfunc in rcfuncs:
+        # only cases that may match the term are tried, see DiscriminationIndexCodegen.
+        def emitcase(fb, i):
             tmpi = rpy.gen_pyid_temporaries(1, symgen)
-            fb.AssignTo(tmpi).FunctionCall(rcfunc, term)
+            fb.AssignTo(tmpi).FunctionCall(rcfuncs[i], term)
             fb.AssignTo(terms).Add(terms, tmpi)
-        fb.Return(terms)
+
+        def emitexit(fb):
+            fb.Return(terms)
+
+        fb.AssignTo(terms).PyList()
+        DiscriminationIndexCodegen(self.modulebuilder, self.context, form.languagename, self.symgen) \
+                .emit(fb, term, [rc.pattern for rc in form.reductioncases], symgen, emitcase, emitexit)
 
         nameof_function = '{}_{}'.format(form.languagename, form.name)
         self.context.add_reduction_relation(form.name, nameof_function)
@@ -426,7 +672,8 @@ class TopLevelFormCodegen(tlform.TopLevelFormVisitor):
         #  return tmp6
         if self.context.get_toplevel_function_for_pattern(metafunction.languagename, repr(case.patternsequence)) is None:
             PatternCodegen(self.modulebuilder, case.patternsequence, self.context, metafunction.languagename, self.symgen).run()
-        TermCodegen(self.modulebuilder, self.context).transform(case.termtemplate)
+        layout = self.context.get_match_layout_for_pattern(metafunction.languagename, repr(case.patternsequence))
+        TermCodegen(self.modulebuilder, self.context, layout).transform(case.termtemplate)
         matchfunc = self.context.get_toplevel_function_for_pattern(metafunction.languagename, repr(case.patternsequence))
         termfunc = self.context.get_function_for_term_template(case.termtemplate)
 
@@ -473,28 +720,28 @@ class TopLevelFormCodegen(tlform.TopLevelFormVisitor):
         assert isinstance(form, tlform.DefineMetafunction)
         #def mf(argterm):
         #  tmp0 = domaincheck(argterm)
-        #  if len(tmp0) == 0:
+        #  if tmp0 != True:
         #    raise Exception('mfname: term is not in my domain')
         #  { foreach reductioncase
         #  tmp{i} = mfcase(term)
         #  if len(tmp{i}) == 1:
         #    tmp{j} = tmp{i}[0]
         #    tmp{k} = codomaincheck(tmp{j})
-        #    if len(tmp{k}) == 0:
+        #    if tmp{k} != True:
         #      raise Exception('mfname: term not in my codomain')
         #    return tmp{j}
         #  }
         #  raise Exception('no metafuncion cases matched for term')
         mfname = form.contract.name
         nameof_function = self.symgen.get('metafunction')
-        self.context.add_metafunction(mfname, nameof_function)
+        if form.memo is not None:
+            # applications, including recursive ones, go through the cache.
+            self.context.add_metafunction(mfname, self._codegenMetafunctionCache(form, nameof_function))
+        else:
+            self.context.add_metafunction(mfname, nameof_function)
 
-        if self.context.get_toplevel_function_for_pattern(form.languagename, repr(form.contract.domain)) is None:
-            PatternCodegen(self.modulebuilder, form.contract.domain, self.context, form.languagename, self.symgen).run()
-        domainmatchfunc = self.context.get_toplevel_function_for_pattern(form.languagename, repr(form.contract.domain))
-        if self.context.get_toplevel_function_for_pattern(form.languagename, repr(form.contract.codomain)) is None:
-            PatternCodegen(self.modulebuilder, form.contract.codomain, self.context, form.languagename, self.symgen).run()
-        codomainmatchfunc = self.context.get_toplevel_function_for_pattern(form.languagename, repr(form.contract.codomain))
+        domainmatchfunc = PatternIsaCodegen(self.modulebuilder, form.contract.domain, self.context, form.languagename, self.symgen).run()
+        codomainmatchfunc = PatternIsaCodegen(self.modulebuilder, form.contract.codomain, self.context, form.languagename, self.symgen).run()
 
 
         symgen = SymGen()
@@ -508,11 +755,16 @@ class TopLevelFormCodegen(tlform.TopLevelFormVisitor):
 
         fb = rpy.BlockBuilder()
         fb.AssignTo(tmp0).FunctionCall(domainmatchfunc, argterm)
-        fb.If.LengthOf(tmp0).Equal(rpy.PyInt(0)).ThenBlock(ifbd)
+        fb.If.NotEqual(tmp0, rpy.PyBoolean(True)).ThenBlock(ifbd)
         
+        mfcasefuncs = []
         for i, mfcase in enumerate(form.cases):
+            mfcasefuncs.append(self._codegenMetafunctionCase(form, mfcase, i, nameof_function))
+
+        # only clauses that may match the term are tried, see DiscriminationIndexCodegen.
+        def emitcase(fb, i):
             tmpi, tmpj, tmpk = rpy.gen_pyid_temporaries(3, symgen)
-            mfcasefunc = self._codegenMetafunctionCase(form, mfcase, i, nameof_function)
+            mfcasefunc = mfcasefuncs[i]
 
             tmpa = rpy.gen_pyid_temporaries(1, symgen)
             ifbi1 = rpy.BlockBuilder()
@@ -522,17 +774,49 @@ class TopLevelFormCodegen(tlform.TopLevelFormVisitor):
             ifbi2 = rpy.BlockBuilder()
             ifbi2.AssignTo(tmpj).ArrayGet(tmpi, rpy.PyInt(0))
             ifbi2.AssignTo(tmpk).FunctionCall(codomainmatchfunc, tmpj)
-            ifbi2.If.LengthOf(tmpk).Equal(rpy.PyInt(0)).ThenBlock(ifbi1)
+            ifbi2.If.NotEqual(tmpk, rpy.PyBoolean(True)).ThenBlock(ifbi1)
             ifbi2.Return(tmpj)
 
             fb.AssignTo(tmpi).FunctionCall(mfcasefunc, argterm)
             fb.If.LengthOf(tmpi).Equal(rpy.PyInt(1)).ThenBlock(ifbi2)
 
-        fb.RaiseException('meta-function \\"{}\\": no clauses matches'.format(mfname))
+        def emitexit(fb):
+            fb.RaiseException('meta-function \\"{}\\": no clauses matches'.format(mfname))
+
+        DiscriminationIndexCodegen(self.modulebuilder, self.context, form.languagename, self.symgen) \
+                .emit(fb, argterm, [mfcase.patternsequence for mfcase in form.cases], symgen, emitcase, emitexit)
 
         self.modulebuilder.Function(nameof_function).WithParameters(argterm).Block(fb)
         return nameof_function
 
+    def _codegenMetafunctionCache(self, form, nameof_function):
+        # cache = MetafunctionCache(memo)
+        # def mf_memo(argterm):
+        #   tmp0 = cache.get(argterm)
+        #   if tmp0 is None:
+        #     tmp0 = mf(argterm)
+        #     tmp1 = cache.put(argterm, tmp0)
+        #   return tmp0
+        cache = rpy.gen_pyid_for(self.symgen.get('{}_cache'.format(nameof_function)))
+        self.modulebuilder.AssignTo(cache).New('MetafunctionCache', rpy.PyInt(form.memo))
+
+        symgen = SymGen()
+        argterm = rpy.gen_pyid_for('argterm')
+        tmp0, tmp1 = rpy.gen_pyid_temporaries(2, symgen)
+
+        ifb = rpy.BlockBuilder()
+        ifb.AssignTo(tmp0).FunctionCall(nameof_function, argterm)
+        ifb.AssignTo(tmp1).MethodCall(cache, 'put', argterm, tmp0)
+
+        fb = rpy.BlockBuilder()
+        fb.AssignTo(tmp0).MethodCall(cache, 'get', argterm)
+        fb.If.IsNone(tmp0).ThenBlock(ifb)
+        fb.Return(tmp0)
+
+        nameof_memo = self.symgen.get('{}_memo'.format(nameof_function))
+        self.modulebuilder.Function(nameof_memo).WithParameters(argterm).Block(fb)
+        return nameof_memo
+
     def _visitParseAssertEqual(self, form):
         assert isinstance(form, tlform.ParseAssertEqual)
 
@@ -546,6 +830,8 @@ class TopLevelFormCodegen(tlform.TopLevelFormVisitor):
         fb = rpy.BlockBuilder()
         fb.AssignTo(tmp0).New('Parser', rpy.PyString(form.string2parse))
         fb.AssignTo(tmp1).MethodCall(tmp0, 'parse')
+        if self.context.hash_cons:
+            fb.AssignTo(tmp1).FunctionCall(TermHelperFuncs.InternTerm, tmp1)
         fb.AssignTo(tmp2).New('Match')
         fb.AssignTo(tmp3).FunctionCall(termfunc, tmp2)
         fb.AssignTo(tmp4).FunctionCall('asserttermsequal', tmp1, tmp3)
@@ -560,30 +846,51 @@ class TopLevelFormCodegen(tlform.TopLevelFormVisitor):
 
         reduction_relation_func = self.context.get_reduction_relation(form.reductionrelationname)
         symgen = SymGen()
-        term = rpy.gen_pyid_for('term')
+        graph = rpy.gen_pyid_for('graph')
         tmp0, tmp1, tmp2, tmp3, tmp4, tmp5, tmp6, tmp7 = rpy.gen_pyid_temporaries(8, symgen)
 
-        forb = rpy.BlockBuilder()
-        forb.AssignTo(tmp3).FunctionCall(reduction_relation_func, term)
-        forb.AssignTo(tmp2).Add(tmp2, tmp3)
-
+        # Each distinct term is expanded once - frontier only consists of terms not seen before.
+        # Frontier is expanded by ReductionGraph.expandfrontier, in worker processes if the program 
+        # is run with --workers N. Which frontiers are printed depends on --print and --print-every.
+        # graph = ReductionGraph()
+        # tmp7 = graph.addterm(tmp0)
+        # tmp1 = [tmp0]
+        # tmp4 = graph.printfrontier(tmp1)
+        # while len(tmp1) != 0:
+        #   tmp2 = graph.expandfrontier(tmp1, reductionrelation, hashcons)
+        #   tmp1 = tmp2
+        #   tmp4 = graph.printfrontier(tmp1)
+        # tmp7 = graph.print_summary()
         wh = rpy.BlockBuilder()
-        wh.AssignTo(tmp2).PyList()
-        wh.For(term).In(tmp1).Block(forb)
+        wh.AssignTo(tmp2).MethodCall(graph, ReductionGraphMethodTable.ExpandFrontier, tmp1, 
+                rpy.PyId(reduction_relation_func), rpy.PyBoolean(self.context.hash_cons))
         wh.AssignTo(tmp1).PyId(tmp2)
-        wh.AssignTo(tmp4).FunctionCall(TermHelperFuncs.PrintTermList, tmp1)
+        wh.AssignTo(tmp4).MethodCall(graph, ReductionGraphMethodTable.PrintFrontier, tmp1)
 
         fb = rpy.BlockBuilder()
         fb.AssignTo(tmp0).FunctionCall(ReadFromStdinAndParse)
+        if self.context.hash_cons:
+            fb.AssignTo(tmp0).FunctionCall(TermHelperFuncs.InternTerm, tmp0)
         if form.metafunctionname != None:
             mfname = self.context.get_metafunction(form.metafunctionname)
             fb.AssignTo(tmp5).New('Variable', rpy.PyString(form.metafunctionname))
             fb.AssignTo(tmp6).New('Sequence', rpy.PyList(tmp5, tmp0))
+            if self.context.hash_cons:
+                fb.AssignTo(tmp6).FunctionCall(TermHelperFuncs.InternTerm, tmp6)
             fb.AssignTo(tmp0).FunctionCall(mfname, tmp6)
 
-        fb.AssignTo(tmp1).PyList(tmp0)
-        fb.AssignTo(tmp4).FunctionCall(TermHelperFuncs.PrintTermList, tmp1)
-        fb.While.LengthOf(tmp1).NotEqual(rpy.PyInt(0)).Block(wh)
+        # #:deterministic relations are applied to a single term until it is irreducible.
+        # tmp7 = reduce_deterministically(tmp0, reductionrelation_first)
+        nameof_step = self.context.get_deterministic_reduction_relation(form.reductionrelationname)
+        if nameof_step is not None:
+            fb.AssignTo(tmp7).FunctionCall(ReduceDeterministically, tmp0, rpy.PyId(nameof_step))
+        else:
+            fb.AssignTo(graph).New('ReductionGraph')
+            fb.AssignTo(tmp7).MethodCall(graph, ReductionGraphMethodTable.AddTerm, tmp0)
+            fb.AssignTo(tmp1).PyList(tmp0)
+            fb.AssignTo(tmp4).MethodCall(graph, ReductionGraphMethodTable.PrintFrontier, tmp1)
+            fb.While.LengthOf(tmp1).NotEqual(rpy.PyInt(0)).Block(wh)
+            fb.AssignTo(tmp7).MethodCall(graph, ReductionGraphMethodTable.PrintSummary)
 
         nameof_this_func = self.symgen.get('readfromstdinandeval')
         self.modulebuilder.Function(nameof_this_func).Block(fb)
@@ -2,19 +2,33 @@ import src.model.rpython as rpy
 import src.model.term as term
 from src.util import SymGen
 
+# Terms cache non-terminal membership in machine-word bitsets. Non-terminals beyond this number are not cached.
+MAX_CACHED_NONTERMINALS = 62
 
 class CompilationContext:
-    def __init__(self):
+    def __init__(self, hash_cons=False, lazy_match=False, decision_trees=False):
+        # when set, terms produced by term templates and the parser are interned.
+        self.hash_cons = hash_cons
+        # when set, patterns are compiled into matchers producing matches on demand.
+        self.lazy_match = lazy_match
+        # when set, membership checks of non-terminal alternatives share tests.
+        self.decision_trees = decision_trees
+
         self.__variables_mentioned = {} 
         self.__isa_functions = {}
+        self.__nt_membership_bits = {}
+        self.__nt_definitions = {}
         self.__pattern_code = {}
         self.__term_template_funcs = {}
 
         self._litterms = {}
 
         self.__toplevel_patterns = {}
+        self.__first_match_patterns = {}
+        self.__match_layouts = {}
 
         self.__reductionrelations = {}
+        self.__deterministicreductionrelations = {}
         self.__metafuctions = {}
 
         self.__redexmatches = {}
@@ -46,6 +60,24 @@ class CompilationContext:
             return self.__isa_functions[k]
         return None
 
+    def add_nt_definition(self, languagename, ntdef):
+        k = (languagename, ntdef.nt.prefix)
+        assert k not in self.__nt_definitions
+        self.__nt_definitions[k] = ntdef
+
+    def get_nt_definition(self, languagename, ntprefix):
+        k = (languagename, ntprefix)
+        assert k in self.__nt_definitions, 'non-terminal {}-{} is not defined'.format(languagename, ntprefix)
+        return self.__nt_definitions[k]
+
+    # non-terminals of all languages are numbered together, thus bits never clash.
+    def get_nt_membership_bit(self, languagename, ntprefix):
+        k = (languagename, ntprefix)
+        if k not in self.__nt_membership_bits:
+            n = len(self.__nt_membership_bits)
+            self.__nt_membership_bits[k] = 1 << n if n < MAX_CACHED_NONTERMINALS else None
+        return self.__nt_membership_bits[k]
+
     def get_sym_for_lit_term(self, term):
         return self._litterms[term]
 
@@ -80,6 +112,27 @@ class CompilationContext:
             return self.__toplevel_patterns[k]
         return None
 
+    def add_first_match_function_for_pattern(self, languagename, patrepr, functionname):
+        k = (languagename, patrepr)
+        assert k not in self.__first_match_patterns, 'function for {}-{} is present'.format(languagename, patrepr)
+        self.__first_match_patterns[k] = functionname
+
+    def get_first_match_function_for_pattern(self, languagename, patrepr):
+        k = (languagename, patrepr)
+        if k in self.__first_match_patterns:
+            return self.__first_match_patterns[k]
+        return None
+
+    def add_match_layout_for_pattern(self, languagename, patrepr, layout):
+        k = (languagename, patrepr)
+        assert k not in self.__match_layouts, 'match layout for {}-{} is present'.format(languagename, patrepr)
+        self.__match_layouts[k] = layout
+
+    def get_match_layout_for_pattern(self, languagename, patrepr):
+        k = (languagename, patrepr)
+        assert k in self.__match_layouts, 'match layout for {}-{} is not present'.format(languagename, patrepr)
+        return self.__match_layouts[k]
+
     def get_function_for_term_template(self, term_template):
         assert isinstance(term_template, term.Term)
         if term_template not in self.__term_template_funcs:
@@ -98,6 +151,18 @@ class CompilationContext:
             return self.__reductionrelations[k]
         return None
 
+    # function f(term) -> term or None reducing the term by the first matching case of #:deterministic relation.
+    def add_deterministic_reduction_relation(self, reductionrelationname, function):
+        k = reductionrelationname
+        assert k not in self.__deterministicreductionrelations
+        self.__deterministicreductionrelations[k] = function 
+
+    def get_deterministic_reduction_relation(self, reductionrelationname):
+        k = reductionrelationname
+        if k in self.__deterministicreductionrelations:
+            return self.__deterministicreductionrelations[k]
+        return None
+
     def add_metafunction(self, mfname, function):
         k = mfname 
         assert k not in self.__metafuctions
@@ -81,6 +81,25 @@ class PatSequence(Pat):
     def get_number_of_optional_matches(self):
         return len(self.seq) - self.get_number_of_nonoptional_matches_between(0, len(self.seq))
 
+    def hasrepeat(self):
+        for pat in self.seq:
+            if isinstance(pat, Repeat):
+                return True
+        return False
+
+    def matchorder(self):
+        """
+        Returns indices of patterns in the order they are matched. Elements of sequences without
+        repetitions are at fixed positions, thus elements matching a single term (literals,
+        non-terminals and built-in patterns) are matched first - these are cheap and produce at most
+        one match. Remaining elements and constraint checks keep their relative order.
+        """
+        if self.hasrepeat():
+            return list(range(len(self.seq)))
+        simple = [i for i, pat in enumerate(self.seq) if isinstance(pat, (Lit, Nt, BuiltInPat))]
+        rest = [i for i in range(len(self.seq)) if i not in simple]
+        return simple + rest
+
     def get_nonoptional_matches(self):
         nonoptional = []
         for pat in self.seq:
@@ -72,6 +72,7 @@ class BinaryOp(enum.Enum):
     Eq    = '=='
     NotEq = '!='
     GrEq = '>='
+    Gt   = '>'
     Lt   = '<'
 
 # Few classes like IfStmt/WhileStmt start out with empty bodies and 
@@ -153,8 +154,9 @@ class RaiseExceptionStmt(Stmt):
 class Expr(PyAst):
     pass
 class IsNone(Expr):
-    def __init__(self, var):
+    def __init__(self, var, neg=False):
         self.var = var
+        self.neg = neg
 
 class BinaryExpr(Expr):
     def __init__(self, op, lhs, rhs):
@@ -451,6 +453,9 @@ class IfOrWhileBuilderPreStage1:
     def IsNone(self, var):
         return self.lastprestage(IsNone(var), self.statements)
 
+    def IsNotNone(self, var):
+        return self.lastprestage(IsNone(var, neg=True), self.statements)
+
     def Equal(self, lhs, rhs):
         return self.lastprestage(BinaryExpr(BinaryOp.Eq, lhs, rhs), self.statements)
 
@@ -488,6 +493,9 @@ class IfOrWhileBuilderPreStage1:
             def NotEqual(self, value):
                 return self.lastprestage( BinaryExpr(BinaryOp.NotEq, self.lengthof, value), self.statements )
 
+            def GreaterThan(self, value):
+                return self.lastprestage( BinaryExpr(BinaryOp.Gt, self.lengthof, value), self.statements )
+
         return IfBuilderPreStage2(self.lastprestage, item, self.statements)
 
 # Rpython Dump
@@ -754,7 +762,10 @@ class RPythonWriter:
 
     def visitIsNone(self, expr):
         self.visit(expr.var)
-        self.emit(' is None')
+        if expr.neg:
+            self.emit(' is not None')
+        else:
+            self.emit(' is None')
 
     def visitLenExpr(self, expr):
         assert isinstance(expr, LenExpr)
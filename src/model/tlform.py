@@ -76,16 +76,20 @@ class DefineMetafunction(TopLevelForm):
         def __repr__(self):
             return 'MetafunctionContract({}, {})'.format(self.name, self.domain, self.codomain)
 
-    def __init__(self, languagename, contract, cases):
+    # number of results kept by #:memo metafunctions if the size is not given.
+    DefaultMemoCacheSize = 1024
+
+    def __init__(self, languagename, contract, cases, memo=None):
         self.languagename = languagename
         self.contract = contract
         self.cases = cases
+        self.memo = memo # maximal number of cached results, None if results are not cached.
         for case in self.cases:
             if case.name != contract.name:
                 raise CompilationError('each metafunction case must begin with {}'.format(contract.name))
 
     def __repr__(self):
-        return 'DefineMetafunction({}, {}, {})'.format(self.languagename, self.contract, self.cases)
+        return 'DefineMetafunction({}, {}, {}, {})'.format(self.languagename, self.contract, self.cases, self.memo)
 
 class DefineReductionRelation(TopLevelForm):
     class ReductionCase:
@@ -97,14 +101,19 @@ class DefineReductionRelation(TopLevelForm):
         def __repr__(self):
             return 'ReductionCase({}, {}, {})'.format(self.pattern, self.termtemplate, self.name)
 
-    def __init__(self, name, languagename, domain, reductioncases):
+    def __init__(self, name, languagename, domain, reductioncases, deterministic=False, refocus=False):
         self.name = name
         self.languagename = languagename
         self.reductioncases = reductioncases
         self.domain = domain
+        # each term is reduced by the first case that matches it, using the first match.
+        self.deterministic = deterministic
+        # redex is looked for near the plug point of the previous step first, implies deterministic.
+        self.refocus = refocus
 
     def __repr__(self):
-        return 'DefineReductionRelation({},{},{},{})'.format(self.name, self.languagename, self.domain, repr(self.reductioncases))
+        return 'DefineReductionRelation({},{},{},{},{},{})'.format(self.name, self.languagename, self.domain,
+                repr(self.reductioncases), self.deterministic, self.refocus)
 
 class RedexMatch(TopLevelForm):
     def __init__(self, languagename, pat, termstr):
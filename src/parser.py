@@ -42,7 +42,10 @@ tokens = [
     'RPAREN',
     'STRING',
     'REDDOMAIN',
-    'APPLYMF'
+    'APPLYMF',
+    'MEMO',
+    'DETERMINISTIC',
+    'REFOCUS'
 ]
 
 
@@ -59,6 +62,9 @@ t_RPAREN = r'\)|\}|\]'
 t_BOOLEAN = r'\#true|\#false|\#t|\#f' 
 t_REDDOMAIN = '\#:domain' 
 t_APPLYMF   = '\#:apply-mf'
+t_MEMO      = '\#:memo'
+t_DETERMINISTIC = '\#:deterministic'
+t_REFOCUS   = '\#:refocus'
 
 def t_NEWLINE(t):
     r'\n+'
@@ -198,11 +204,28 @@ def p_parse_assert_equal(p):
 # define-metafunction ::=  ( define-metafunction IDENT metafunction-contract metafunction-case ... )
 # metafunction-contract ::= IDENT : pattern-sequence ...  -> pattern
 # metafunction-case ::= [ (IDENT pattern ...) term-template ]
+# metafunction-memo ::= #:memo | #:memo INTEGER
 def p_define_metafunction(p):
     """
     define-metafunction : LPAREN DEFINEMETAFUNCTION IDENT metafunction-contract metafunction-case-list RPAREN
+                        | LPAREN DEFINEMETAFUNCTION IDENT metafunction-memo metafunction-contract metafunction-case-list RPAREN
     """
-    p[0] = tlform.DefineMetafunction(p[3], p[4], p[5])
+    if len(p) == 7:
+        p[0] = tlform.DefineMetafunction(p[3], p[4], p[5])
+    else:
+        p[0] = tlform.DefineMetafunction(p[3], p[5], p[6], memo=p[4])
+
+def p_metafunction_memo(p):
+    """
+    metafunction-memo : MEMO
+                      | MEMO INTEGER
+    """
+    if len(p) == 2:
+        p[0] = tlform.DefineMetafunction.DefaultMemoCacheSize
+    else:
+        p[0] = int(p[2])
+        if p[0] <= 0:
+            raise Exception('#:memo cache size must be positive')
 
 
 def p_define_metafunction_contract(p):
@@ -237,18 +260,29 @@ def p_metafunction_case(p):
         p[0] = tlform.DefineMetafunction.MetafunctionCase(p[3], p[4], p[6])
 
 # --------------------- DEFINE-REDUCTION-RELATION FORM ---------
-# define-reduction-relation ::= ( define-reduction-relation IDENT IDENT domain reduction-case ... )
+# define-reduction-relation ::= ( define-reduction-relation IDENT IDENT mode? domain? reduction-case ... )
 # reduction-case ::= (--> pattern term-template STRING)
 # domain ::= #:domain pattern
+# mode ::= #:deterministic | #:refocus
 def p_define_reduction_relation(t):
     """
     define-reduction-relation : LPAREN DEFINEREDUCTIONRELATION IDENT IDENT domain reduction-case-list RPAREN
     define-reduction-relation : LPAREN DEFINEREDUCTIONRELATION IDENT IDENT reduction-case-list RPAREN
+    define-reduction-relation : LPAREN DEFINEREDUCTIONRELATION IDENT IDENT reduction-relation-mode domain reduction-case-list RPAREN
+    define-reduction-relation : LPAREN DEFINEREDUCTIONRELATION IDENT IDENT reduction-relation-mode reduction-case-list RPAREN
     """
-    if len(t) == 8:
-        t[0] = tlform.DefineReductionRelation(t[3], t[4], t[5], t[6])
-    else:
-        t[0] = tlform.DefineReductionRelation(t[3], t[4], None, t[5])
+    mode = t[5] if t[5] in ('#:deterministic', '#:refocus') else None
+    rest = t[6:-1] if mode is not None else t[5:-1]
+    domain = rest[0] if len(rest) == 2 else None
+    t[0] = tlform.DefineReductionRelation(t[3], t[4], domain, rest[-1],
+            deterministic=mode is not None, refocus=mode == '#:refocus')
+
+def p_reduction_relation_mode(t):
+    """
+    reduction-relation-mode : DETERMINISTIC
+                            | REFOCUS
+    """
+    t[0] = t[1]
 
 def p_define_reduction_relation_domain(t):
     'domain : REDDOMAIN pattern'
@@ -3,11 +3,13 @@ from src.preprocess.pattern.checkinhole import Pattern_InHoleChecker
 from src.preprocess.pattern.checkntcycle import DefineLanguage_NtCycleChecker
 from src.preprocess.pattern.extractsym import DefineLanguage_AssignableSymbolExtractor, Pattern_AssignableSymbolExtractor
 from src.preprocess.pattern.insertconstraintcheck import Pattern_ConstraintCheckInserter
+from src.preprocess.pattern.scheduleconstraintcheck import Pattern_ConstraintCheckScheduler
 from src.preprocess.pattern.rewriteellipsismatchmode import DefineLanguage_EllipsisMatchModeRewriter, Pattern_EllipsisMatchModeRewriter
 from src.preprocess.pattern.rewriteid import DefineLanguage_IdRewriter, Pattern_IdRewriter
 from src.preprocess.pattern.rewritent import DefineLanguage_NtRewriter, Pattern_NtRewriter
 from src.preprocess.pattern.solveholereachability import NtGraphBuilder, NumberOfHoles, NtGraph, DefineLanguage_HoleReachabilitySolver
 from src.preprocess.pattern.solventclosure import DefineLanguage_NtClosureSolver
+from src.preprocess.pattern.solventoverlap import DefineLanguage_NtOverlapSolver, PatternOverlapChecker
 
 __all__ = [
     'Pattern_EllipsisDepthChecker', 
@@ -16,6 +18,7 @@ __all__ = [
     'DefineLanguage_AssignableSymbolExtractor', 
     'Pattern_AssignableSymbolExtractor', 
     'Pattern_ConstraintCheckInserter', 
+    'Pattern_ConstraintCheckScheduler', 
     'DefineLanguage_EllipsisMatchModeRewriter', 
     'Pattern_EllipsisMatchModeRewriter', 
     'DefineLanguage_IdRewriter', 
@@ -26,5 +29,7 @@ __all__ = [
     'NtGraphBuilder', 
     'NumberOfHoles', 
     'DefineLanguage_NtClosureSolver', 
+    'DefineLanguage_NtOverlapSolver', 
+    'PatternOverlapChecker', 
     'DefineLanguage_HoleReachabilitySolver',
 ]
@@ -0,0 +1,88 @@
+import src.model.pattern as pattern
+
+# Pattern_ConstraintCheckInserter places constraint check right after the element of the sequence
+# that binds the second symbol, even if that element is a sequence or the symbol is bound earlier
+# in match order (see PatSequence.matchorder). This class moves each check to the point both symbols
+# are bound, so that matches violating the constraint are discarded before the rest of the pattern
+# is matched. For instance, in
+# (var-lookup ((var_1 int_1) ... (var int) (var_2 int_2) ...) var#1 CheckConstraint(var == var#1))
+# var#1 is matched before the environment and the check is moved into (var int):
+# (var-lookup ((var_1 int_1) ... (var int CheckConstraint(var == var#1)) (var_2 int_2) ...) var#1)
+# Checks are never moved into repetitions and in-hole patterns - their subpatterns are matched
+# into separate matches. In-hole patterns compare bindings of pat1 and pat2 themselves.
+class Pattern_ConstraintCheckScheduler(pattern.PatternTransformer):
+    def __init__(self, pattern):
+        self.pattern = pattern
+
+    def run(self):
+        return self.transform(self.pattern)
+
+    def _syms(self, pat):
+        if isinstance(pat, pattern.Nt):
+            return set([pat.sym])
+        if isinstance(pat, pattern.BuiltInPat):
+            if pat.kind == pattern.BuiltInPatKind.Hole:
+                return set([])
+            return set([pat.sym])
+        if isinstance(pat, pattern.PatSequence):
+            syms = set([])
+            for p in pat:
+                syms.update(self._syms(p))
+            return syms
+        if isinstance(pat, pattern.Repeat):
+            return self._syms(pat.pat)
+        if isinstance(pat, pattern.InHole):
+            return self._syms(pat.pat1).union(self._syms(pat.pat2))
+        return set([])
+
+    def _schedule(self, seq, checks):
+        # checks is the list of checks moved into the sequence from the enclosing one, one of the
+        # symbols of such check is bound before the sequence is matched.
+        elements = [pat for pat in seq if not isinstance(pat, pattern.CheckConstraint)]
+        checks = [pat for pat in seq if isinstance(pat, pattern.CheckConstraint)] + checks
+        order = pattern.PatSequence(elements).matchorder()
+        bound = {}
+        for step, i in enumerate(order):
+            for sym in self._syms(elements[i]):
+                bound[sym] = step
+
+        after = [[] for _ in elements]
+        for check in checks:
+            step = max(bound.get(check.sym1, -1), bound.get(check.sym2, -1))
+            assert step >= 0
+            i = order[step]
+            if isinstance(elements[i], pattern.PatSequence):
+                elements[i] = self._schedule(elements[i], [check]).copyattributesfrom(elements[i])
+            else:
+                after[i].append(check)
+
+        # In sequences without repetitions single-term elements are matched first, their checks
+        # precede the first remaining element.
+        ahead = set([])
+        if not pattern.PatSequence(elements).hasrepeat():
+            ahead = set(i for i, pat in enumerate(elements) if isinstance(pat, (pattern.Lit, pattern.Nt, pattern.BuiltInPat)))
+        pending = [check for i in sorted(ahead) for check in after[i]]
+        nseq = []
+        for i, pat in enumerate(elements):
+            if i not in ahead:
+                nseq.extend(pending)
+                pending = []
+            nseq.append(pat)
+            if i not in ahead:
+                nseq.extend(after[i])
+        nseq.extend(pending)
+        return pattern.PatSequence(nseq)
+
+    def transformPatSequence(self, node):
+        assert isinstance(node, pattern.PatSequence)
+        seq = [self.transform(pat) for pat in node]
+        return self._schedule(seq, []).copyattributesfrom(node)
+
+    def transformInHole(self, node):
+        assert isinstance(node, pattern.InHole)
+        pat1 = self.transform(node.pat1)
+        pat2 = self.transform(node.pat2)
+        return pattern.InHole(pat1, pat2, node.constraintchecks).copyattributesfrom(node)
+
+    def transformCheckConstraint(self, node):
+        return node
@@ -9,7 +9,8 @@ class DefineLanguage_NtClosureSolver:
 
     def run(self):
         # compute initial sets.
-        # FIXME THESE closures are incorrect, something to fix when reimplementing EllipsisMatchMode.
+        # closure of non-terminal only contains non-terminals and built-in patterns it includes directly 
+        # or transitively and is not enough to decide whether two patterns overlap, see solventoverlap.py.
         closureof = {}
         closureof['number'] = set([])
         closureof['integer'] = set([])
@@ -0,0 +1,167 @@
+import src.model.tlform as tlform
+import src.model.pattern as pattern
+
+# Two patterns overlap if there exists a term matched by both. The check is conservative - patterns
+# that are not known to be disjoint are assumed to overlap. Constraints (i.e. n_1 appearing twice) are
+# ignored, pattern can only match less terms with them.
+#
+# Overlap between non-terminals is computed as least fixed point: initially no non-terminals overlap,
+# and pair (nt1, nt2) is added whenever some alternatives of nt1 and nt2 overlap given the current relation.
+# Term witnessing overlap is finite, so nt1 and nt2 overlap only if there's witness that does not
+# rely on (nt1, nt2) itself.
+class PatternOverlapChecker:
+    def __init__(self, definelanguage, overlaps, variables=None):
+        assert isinstance(definelanguage, tlform.DefineLanguage)
+        self.definelanguage = definelanguage
+        self.overlaps = overlaps
+        # variables mentioned in the language, variable-not-otherwise-mentioned cannot match these.
+        self.variables = variables
+        # (non-terminal, pattern) pairs being checked.
+        self.inprogress = set([])
+
+    def mayoverlap(self, pat1, pat2):
+        assert isinstance(pat1, pattern.Pat)
+        assert isinstance(pat2, pattern.Pat)
+        # Terms matched by in-hole patterns are not computed, such patterns are conservatively assumed
+        # to overlap with every pattern. See TODOs in README.
+        if isinstance(pat1, pattern.InHole) or isinstance(pat2, pattern.InHole):
+            return True
+        if self._isany(pat1) or self._isany(pat2):
+            return True
+        if isinstance(pat1, pattern.Nt) and isinstance(pat2, pattern.Nt):
+            return pat2.prefix in self.overlaps[pat1.prefix]
+        # Non-terminal and another pattern - check all alternatives.
+        if isinstance(pat1, pattern.Nt):
+            return self._ntoverlaps(pat1, pat2)
+        if isinstance(pat2, pattern.Nt):
+            return self._ntoverlaps(pat2, pat1)
+        if isinstance(pat1, pattern.PatSequence) and isinstance(pat2, pattern.PatSequence):
+            return self._sequencesoverlap(pat1, pat2)
+        if isinstance(pat1, pattern.PatSequence) or isinstance(pat2, pattern.PatSequence):
+            return False
+        return self._atomsoverlap(pat1, pat2)
+
+    def _isany(self, pat):
+        return isinstance(pat, pattern.BuiltInPat) and pat.kind == pattern.BuiltInPatKind.Any
+
+    # Recursive grammars may lead back to the same pair, e.g. checking m against (m) with
+    # (m ::= ((m)) 1). The smallest witness never needs that so such path is assumed to fail.
+    def _ntoverlaps(self, nt, pat):
+        key = (nt.prefix, id(pat))
+        if key in self.inprogress:
+            return False
+        self.inprogress.add(key)
+        result = False
+        ntdef = self.definelanguage.nts[nt.prefix]
+        for alt in ntdef.patterns:
+            if self.mayoverlap(alt, pat):
+                result = True
+                break
+        self.inprogress.remove(key)
+        return result
+
+    # Finds if there's a sequence of terms matched by both seq1 and seq2. State (i, j) means
+    # first i patterns of seq1 and first j patterns of seq2 have been matched. Repeat patterns
+    # can either be skipped or consume a term while staying at the same position.
+    def _sequencesoverlap(self, seq1, seq2):
+        seq1 = [pat for pat in seq1 if not isinstance(pat, pattern.CheckConstraint)]
+        seq2 = [pat for pat in seq2 if not isinstance(pat, pattern.CheckConstraint)]
+        visited = set([])
+        stack = [(0, 0)]
+        while len(stack) != 0:
+            state = stack.pop()
+            if state in visited:
+                continue
+            visited.add(state)
+            i, j = state
+            if i == len(seq1) and j == len(seq2):
+                return True
+            if i < len(seq1) and isinstance(seq1[i], pattern.Repeat):
+                stack.append((i+1, j))
+            if j < len(seq2) and isinstance(seq2[j], pattern.Repeat):
+                stack.append((i, j+1))
+            if i < len(seq1) and j < len(seq2):
+                pat1, nexti = self._element(seq1, i)
+                pat2, nextj = self._element(seq2, j)
+                if self.mayoverlap(pat1, pat2):
+                    stack.append((nexti, nextj))
+        return False
+
+    def _element(self, seq, i):
+        if isinstance(seq[i], pattern.Repeat):
+            return seq[i].pat, i
+        return seq[i], i+1
+
+    def _termkinds(self, pat):
+        if isinstance(pat, pattern.Lit):
+            return {
+                pattern.LitKind.Integer:  set(['integer']),
+                pattern.LitKind.Float:    set(['float']),
+                pattern.LitKind.String:   set(['string']),
+                pattern.LitKind.Boolean:  set(['boolean']),
+                pattern.LitKind.Variable: set(['variable']),
+            }[pat.kind]
+        assert isinstance(pat, pattern.BuiltInPat)
+        return {
+            pattern.BuiltInPatKind.Number:  set(['integer', 'float']),
+            pattern.BuiltInPatKind.Integer: set(['integer']),
+            pattern.BuiltInPatKind.Natural: set(['integer']),
+            pattern.BuiltInPatKind.Float:   set(['float']),
+            pattern.BuiltInPatKind.String:  set(['string']),
+            pattern.BuiltInPatKind.Boolean: set(['boolean']),
+            pattern.BuiltInPatKind.VariableNotOtherwiseDefined: set(['variable']),
+            pattern.BuiltInPatKind.VariableExcept: set(['variable']),
+            pattern.BuiltInPatKind.Hole:    set(['hole']),
+        }[pat.kind]
+
+    def _atomsoverlap(self, pat1, pat2):
+        if len(self._termkinds(pat1).intersection(self._termkinds(pat2))) == 0:
+            return False
+        if isinstance(pat2, pattern.Lit):
+            pat1, pat2 = pat2, pat1
+        if not isinstance(pat1, pattern.Lit):
+            return True
+        if isinstance(pat2, pattern.Lit):
+            if pat1.kind == pattern.LitKind.Integer:
+                return int(pat1.lit) == int(pat2.lit)
+            if pat1.kind == pattern.LitKind.Float:
+                # floats are compared with tolerance at runtime.
+                return abs(float(pat1.lit) - float(pat2.lit)) < 0.002
+            if pat1.kind == pattern.LitKind.Boolean:
+                return True
+            return pat1.lit == pat2.lit
+        if pat2.kind == pattern.BuiltInPatKind.Natural:
+            return int(pat1.lit) >= 0
+        if pat2.kind == pattern.BuiltInPatKind.VariableNotOtherwiseDefined and self.variables is not None:
+            return pat1.lit not in self.variables
+        return True
+
+class DefineLanguage_NtOverlapSolver:
+    def __init__(self, definelanguage, variables=None):
+        assert isinstance(definelanguage, tlform.DefineLanguage)
+        self.definelanguage = definelanguage
+        self.variables = variables
+
+    def run(self):
+        nts = self.definelanguage.nts
+        overlaps = dict((nt, set([])) for nt in nts.keys())
+        checker = PatternOverlapChecker(self.definelanguage, overlaps, self.variables)
+        changed = True
+        while changed:
+            changed = False
+            for nt1, ntdef1 in nts.items():
+                for nt2, ntdef2 in nts.items():
+                    if nt2 in overlaps[nt1]:
+                        continue
+                    if self._alternativesoverlap(checker, ntdef1, ntdef2):
+                        overlaps[nt1].add(nt2)
+                        overlaps[nt2].add(nt1)
+                        changed = True
+        return overlaps
+
+    def _alternativesoverlap(self, checker, ntdef1, ntdef2):
+        for pat1 in ntdef1.patterns:
+            for pat2 in ntdef2.patterns:
+                if checker.mayoverlap(pat1, pat2):
+                    return True
+        return False
@@ -18,7 +18,7 @@ class TopLevelProcessor(tlform.TopLevelFormVisitor):
 
         # store reference to definelanguage structure for use by redex-match form
         self.definelanguages = {}
-        self.definelanguageclosures = {}
+        self.definelanguageoverlaps = {}
         self.reductionrelations = {}
         self.metafunctions = {}
 
@@ -35,6 +35,7 @@ class TopLevelProcessor(tlform.TopLevelFormVisitor):
         form = DefineLanguage_IdRewriter(form).run()
         successors, closures = DefineLanguage_NtClosureSolver(form).run()
         DefineLanguage_NtCycleChecker(form, successors).run()
+        overlaps = DefineLanguage_NtOverlapSolver(form, variables).run()
 
         graph = NtGraphBuilder(form).run()
         DefineLanguage_HoleReachabilitySolver(form, graph).run()
@@ -44,32 +45,35 @@ class TopLevelProcessor(tlform.TopLevelFormVisitor):
             for nt, ntdef in form.nts.items():
                 print('{}: {}'.format(nt, ntdef.nt.getattribute(pattern.PatternAttribute.NumberOfHoles)))
             print('\n') 
-        #form = DefineLanguage_EllipsisMatchModeRewriter(form, closures).run()
+        form = DefineLanguage_EllipsisMatchModeRewriter(form, overlaps, variables).run()
         form = DefineLanguage_AssignableSymbolExtractor(form).run()
         self.definelanguages[form.name] = form 
-        self.definelanguageclosures[form.name] = closures
+        self.definelanguageoverlaps[form.name] = overlaps
         return form
 
     def __processpattern(self, pat, languagename):
         lang = self.definelanguages[languagename]
-        closure = self.definelanguageclosures[languagename]
+        overlaps = self.definelanguageoverlaps[languagename]
+        _, variables = self.context.get_variables_mentioned(languagename)
         ntsyms = lang.ntsyms()
         pat = Pattern_NtRewriter(pat, ntsyms).run()
         pat = Pattern_EllipsisDepthChecker(pat).run()
         Pattern_InHoleChecker(lang, pat).run()
-        #pat = Pattern_EllipsisMatchModeRewriter(lang, pat, closure).run()
+        pat = Pattern_EllipsisMatchModeRewriter(lang, pat, overlaps, variables).run()
         pat = Pattern_ConstraintCheckInserter(pat).run()
+        pat = Pattern_ConstraintCheckScheduler(pat).run()
         pat = Pattern_AssignableSymbolExtractor(pat).run()
         return pat
 
     def __processdomaincheck(self, pat, languagename):
         lang = self.definelanguages[languagename]
         ntsyms = lang.ntsyms()
-        closure = self.definelanguageclosures[languagename]
+        overlaps = self.definelanguageoverlaps[languagename]
+        _, variables = self.context.get_variables_mentioned(languagename)
         pat = Pattern_NtRewriter(pat, ntsyms).run()
         pat = Pattern_IdRewriter(pat).run()
         Pattern_InHoleChecker(lang, pat).run()
-        #pat = Pattern_EllipsisMatchModeRewriter(lang, pat, closure).run()
+        pat = Pattern_EllipsisMatchModeRewriter(lang, pat, overlaps, variables).run()
         pat = Pattern_AssignableSymbolExtractor(pat).run()
         return pat
 
@@ -1,7 +1,7 @@
 import unittest
 from src.preprocess import TopLevelProcessor 
-from src.preprocess.pattern import Pattern_EllipsisMatchModeRewriter, DefineLanguage_NtClosureSolver
-from src.model.pattern import PatSequence, BuiltInPat, Nt, Repeat, Lit, LitKind, BuiltInPatKind, RepeatMatchMode
+from src.preprocess.pattern import Pattern_EllipsisMatchModeRewriter, DefineLanguage_NtClosureSolver, DefineLanguage_NtOverlapSolver
+from src.model.pattern import PatSequence, BuiltInPat, Nt, Repeat, Lit, LitKind, BuiltInPatKind, RepeatMatchMode, InHole
 from src.model.tlform import DefineLanguage, Module
 from src.context import CompilationContext
 
@@ -82,7 +82,7 @@ class TestMakeEllipsisDeterministic(unittest.TestCase):
             ]),
         ])
 
-        _, closure = DefineLanguage_NtClosureSolver(lang).run()
+        overlaps = DefineLanguage_NtOverlapSolver(lang).run()
 
         #( number ... number ...) 
         pat = PatSequence([
@@ -95,7 +95,7 @@ class TestMakeEllipsisDeterministic(unittest.TestCase):
                 Repeat(BuiltInPat(BuiltInPatKind.Number, 'number', 'number'), RepeatMatchMode.Deterministic), 
             ])
 
-        actual = Pattern_EllipsisMatchModeRewriter(lang, pat, closure).run()
+        actual = Pattern_EllipsisMatchModeRewriter(lang, pat, overlaps).run()
         self.assertEqual(actual, expected)
 
         # (e e ... m ... n)  no deterministm possible
@@ -105,7 +105,7 @@ class TestMakeEllipsisDeterministic(unittest.TestCase):
                 Repeat(Nt('m', 'm')), 
                 Nt('n', 'n') 
             ])
-        actual = Pattern_EllipsisMatchModeRewriter(lang, pat, closure).run()
+        actual = Pattern_EllipsisMatchModeRewriter(lang, pat, overlaps).run()
         self.assertEqual(actual, pat)
         # (e ... number ... m ...) # s can be matched deterministically
         pat = PatSequence([
@@ -120,7 +120,7 @@ class TestMakeEllipsisDeterministic(unittest.TestCase):
                 Repeat(Nt('m', 'm'), RepeatMatchMode.Deterministic), 
             ])
 
-        actual = Pattern_EllipsisMatchModeRewriter(lang, pat, closure).run()
+        actual = Pattern_EllipsisMatchModeRewriter(lang, pat, overlaps).run()
         self.assertEqual(actual, expected)
 
         # (e e ... m ... h)  m should be deterministic
@@ -138,7 +138,7 @@ class TestMakeEllipsisDeterministic(unittest.TestCase):
                 Nt('h', 'h') 
             ])
 
-        actual = Pattern_EllipsisMatchModeRewriter(lang, pat, closure).run()
+        actual = Pattern_EllipsisMatchModeRewriter(lang, pat, overlaps).run()
         self.assertEqual(actual, expected)
 
         # (e e ... m ... h ...)  m and h should be deterministic.
@@ -156,7 +156,7 @@ class TestMakeEllipsisDeterministic(unittest.TestCase):
                 Repeat(Nt('h', 'h'), RepeatMatchMode.Deterministic)
             ])
 
-        actual = Pattern_EllipsisMatchModeRewriter(lang, pat, closure).run()
+        actual = Pattern_EllipsisMatchModeRewriter(lang, pat, overlaps).run()
         self.assertEqual(actual, expected)
 
 
@@ -173,7 +173,7 @@ class TestMakeEllipsisDeterministic(unittest.TestCase):
                 Repeat(PatSequence([Nt('h', 'h')]), RepeatMatchMode.Deterministic),
             ])
 
-        actual = Pattern_EllipsisMatchModeRewriter(lang, pat, closure).run()
+        actual = Pattern_EllipsisMatchModeRewriter(lang, pat, overlaps).run()
         self.assertEqual(actual, expected)
 
         #((e ...) ... (m ...) ... (m ... h ...) ...) -> (m ... h ...) term can be matched deterministically
@@ -203,7 +203,7 @@ class TestMakeEllipsisDeterministic(unittest.TestCase):
                     ]), RepeatMatchMode.Deterministic),
             ])
 
-        actual = Pattern_EllipsisMatchModeRewriter(lang, pat, closure).run()
+        actual = Pattern_EllipsisMatchModeRewriter(lang, pat, overlaps).run()
         self.assertEqual(actual, expected)
 
         #((e ...) ... (m ... h ...) ... (m ... h ...)) ->  nondeterministc
@@ -235,7 +235,7 @@ class TestMakeEllipsisDeterministic(unittest.TestCase):
                     ]),
             ])
 
-        actual = Pattern_EllipsisMatchModeRewriter(lang, pat, closure).run()
+        actual = Pattern_EllipsisMatchModeRewriter(lang, pat, overlaps).run()
         self.assertEqual(actual, expected)
 
     # ((n h ... n) ... (m e) ...)
@@ -263,7 +263,7 @@ class TestMakeEllipsisDeterministic(unittest.TestCase):
                     ]), RepeatMatchMode.Deterministic),
             ])
 
-        actual = Pattern_EllipsisMatchModeRewriter(lang, pat, closure).run()
+        actual = Pattern_EllipsisMatchModeRewriter(lang, pat, overlaps).run()
         self.assertEqual(actual, expected)
 
     # ((n "string" n) ... (m "string" e) ...)
@@ -280,7 +280,7 @@ class TestMakeEllipsisDeterministic(unittest.TestCase):
                     ]), RepeatMatchMode.Deterministic),
             ])
 
-        actual = Pattern_EllipsisMatchModeRewriter(lang, pat, closure).run()
+        actual = Pattern_EllipsisMatchModeRewriter(lang, pat, overlaps).run()
         self.assertEqual(actual, pat)
 
     # ((n "string" n) ... (m "another_string" e) ...)
@@ -310,5 +310,113 @@ class TestMakeEllipsisDeterministic(unittest.TestCase):
                     ]), RepeatMatchMode.Deterministic),
             ])
 
-        actual = Pattern_EllipsisMatchModeRewriter(lang, pat, closure).run()
+        actual = Pattern_EllipsisMatchModeRewriter(lang, pat, overlaps).run()
+        self.assertEqual(actual, expected)
+
+    def test_overlaps(self):
+        lang = DefineLanguage('Lang', [
+            DefineLanguage.NtDefinition(Nt('m', 'm'), [
+                Nt('e', 'e'), 
+                PatSequence([Lit('-', LitKind.Variable), Nt('m', 'm_1'), Nt('m', 'm_2')]),
+            ]),
+            DefineLanguage.NtDefinition(Nt('e', 'e'), [
+                PatSequence([Lit('+', LitKind.Variable), Nt('e', 'e_1'), Nt('e', 'e_2')]),
+                Nt('n', 'n'), 
+            ]),
+            DefineLanguage.NtDefinition(Nt('n', 'n'), [
+                BuiltInPat(BuiltInPatKind.Number, 'number', 'number'),
+            ]),
+            DefineLanguage.NtDefinition(Nt('s', 's'), [
+                BuiltInPat(BuiltInPatKind.String, 'string', 'string'),
+                PatSequence([Lit('-', LitKind.Variable), Nt('s', 's_1'), Nt('s', 's_2')]),
+            ]),
+            DefineLanguage.NtDefinition(Nt('l', 'l'), [
+                PatSequence([Repeat(Nt('n', 'n'))]),
+            ]),
+            DefineLanguage.NtDefinition(Nt('w', 'w'), [
+                PatSequence([PatSequence([Nt('w', 'w')])]),
+                Lit('1', LitKind.Integer),
+            ]),
+        ])
+
+        overlaps = DefineLanguage_NtOverlapSolver(lang).run()
+
+        self.assertSetEqual(overlaps['m'], {'m', 'e', 'n', 'w'})
+        self.assertSetEqual(overlaps['e'], {'m', 'e', 'n', 'w'})
+        self.assertSetEqual(overlaps['n'], {'m', 'e', 'n', 'w'})
+        # (- m m) and (- s s) cannot match the same term - leaves are numbers and strings respectively.
+        self.assertSetEqual(overlaps['s'], {'s'})
+        self.assertSetEqual(overlaps['l'], {'l'})
+        self.assertSetEqual(overlaps['w'], {'m', 'e', 'n', 'w'})
+
+    def test_det_2(self):
+        lang = DefineLanguage('Lang', [
+            DefineLanguage.NtDefinition(Nt('e', 'e'), [
+                PatSequence([Lit('+', LitKind.Variable), Nt('e', 'e_1'), Nt('e', 'e_2')]),
+                Nt('n', 'n'), 
+            ]),
+            DefineLanguage.NtDefinition(Nt('n', 'n'), [
+                BuiltInPat(BuiltInPatKind.Number, 'number', 'number'),
+            ]),
+            DefineLanguage.NtDefinition(Nt('E', 'E'), [
+                PatSequence([Lit('+', LitKind.Variable), Nt('E', 'E'), Nt('e', 'e')]),
+                PatSequence([Lit('+', LitKind.Variable), Nt('n', 'n'), Nt('E', 'E')]),
+                BuiltInPat(BuiltInPatKind.Hole, 'hole', 'hole'),
+            ]),
+        ])
+
+        overlaps = DefineLanguage_NtOverlapSolver(lang).run()
+
+        # (e ... (+ n n)) -> e can be (+ n n) and thus no determinism possible.
+        pat = PatSequence([
+                Repeat(Nt('e', 'e')), 
+                PatSequence([Lit('+', LitKind.Variable), Nt('n', 'n_1'), Nt('n', 'n_2')]),
+            ])
+        actual = Pattern_EllipsisMatchModeRewriter(lang, pat, overlaps).run()
+        self.assertEqual(actual, pat)
+
+        # (e ... (- n n)) -> e is never (- n n)
+        pat = PatSequence([
+                Repeat(Nt('e', 'e')), 
+                PatSequence([Lit('-', LitKind.Variable), Nt('n', 'n_1'), Nt('n', 'n_2')]),
+            ])
+        expected = PatSequence([
+                Repeat(Nt('e', 'e'), RepeatMatchMode.Deterministic), 
+                PatSequence([Lit('-', LitKind.Variable), Nt('n', 'n_1'), Nt('n', 'n_2')]),
+            ])
+        actual = Pattern_EllipsisMatchModeRewriter(lang, pat, overlaps).run()
+        self.assertEqual(actual, expected)
+
+        # (n ... E e ...) -> E may contain hole, n cannot. 
+        pat = PatSequence([
+                Repeat(Nt('n', 'n')), 
+                Nt('E', 'E'),
+                Repeat(Nt('e', 'e')), 
+            ])
+        expected = PatSequence([
+                Repeat(Nt('n', 'n'), RepeatMatchMode.Deterministic), 
+                Nt('E', 'E'),
+                Repeat(Nt('e', 'e'), RepeatMatchMode.Deterministic), 
+            ])
+        actual = Pattern_EllipsisMatchModeRewriter(lang, pat, overlaps).run()
+        self.assertEqual(actual, expected)
+
+        # (e ... E) -> (+ E e) and (+ e e) could only match the same term if e contained hole.
+        pat = PatSequence([
+                Repeat(Nt('e', 'e')), 
+                Nt('E', 'E'),
+            ])
+        expected = PatSequence([
+                Repeat(Nt('e', 'e'), RepeatMatchMode.Deterministic), 
+                Nt('E', 'E'),
+            ])
+        actual = Pattern_EllipsisMatchModeRewriter(lang, pat, overlaps).run()
         self.assertEqual(actual, expected)
+
+        # (e ... (in-hole E n)) -> in-hole is assumed to overlap with everything.
+        pat = PatSequence([
+                Repeat(Nt('e', 'e')), 
+                InHole(Nt('E', 'E'), Nt('n', 'n')),
+            ])
+        actual = Pattern_EllipsisMatchModeRewriter(lang, pat, overlaps).run()
+        self.assertEqual(actual, pat)
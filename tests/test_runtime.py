@@ -15,33 +15,126 @@ testcases = [
     'tests/metafunction_test1.rkt',
     'tests/freshtest.rkt',
     'tests/parsetest.rkt',
+    'tests/ntmembershiptest.rkt',
+    'tests/ellipsismatchmodetest.rkt',
+    'tests/deterministicreductiontest.rkt',
+    'tests/refocusreductiontest.rkt',
+    'tests/fixedaritytest.rkt',
+    'tests/alphaequivalencetest.rkt',
+    'tests/discriminationtest.rkt',
+    'tests/lazymatchtest.rkt',
+    'tests/repeatmatchtest.rkt',
+    'tests/holereachabilitytest.rkt',
+    'tests/matchbindingtest.rkt',
+    'tests/matchslottest.rkt',
 ]
 
-def runpython(filename):
-    py = subprocess.Popen(['python2.7', filename])
-    return py.wait() 
+# read-from-stdin-and-apply-reduction-relation* testcases along with files fed to stdin and expected output.
+stdintestcases = [
+    ('tests/reductiongraphtest.rkt', 'tests/reductiongraphtest.input', 'tests/reductiongraphtest.output'),
+    ('tests/deterministicreductiongraphtest.rkt', 'tests/deterministicreductiongraphtest.input', 'tests/deterministicreductiongraphtest.output'),
+    ('tests/deterministicreductiongraphtest.rkt', 'tests/deterministicreductiongraphtest2.input', 'tests/deterministicreductiongraphtest2.output'),
+    ('tests/refocusreductiongraphtest.rkt', 'tests/refocusreductiongraphtest.input', 'tests/refocusreductiongraphtest.output'),
+    ('tests/refocusreductiongraphtest.rkt', 'tests/refocusreductiongraphtest2.input', 'tests/refocusreductiongraphtest2.output'),
+    ('tests/workersreductiongraphtest.rkt', 'tests/workersreductiongraphtest.input', 'tests/workersreductiongraphtest.output'),
+]
+
+# Generated code is checked by the RPython typer in addition to running it under CPython.
+rtypetestcases = [
+    'tests/metafunction_test1.rkt',
+    'tests/applyreductionrelationtest.rkt',
+    'tests/reductiongraphtest.rkt',
+    'tests/refocusreductiongraphtest.rkt',
+]
+
+def runpython(filename, stdin=None, programargs=()):
+    py = subprocess.Popen(['python2.7', filename] + list(programargs), stdin=stdin, stdout=subprocess.PIPE)
+    stdout, _ = py.communicate(timeout=60)
+    stdout = stdout.decode()
+    print(stdout, end='')
+    return py.returncode, stdout
 
+# Output of the program run with --print-every and --print options - every printevery-th frontier 
+# (none if printevery is 0) followed by irreducible terms and cycles if printsummary is set.
+def expected_output(output, printevery=1, printsummary=True):
+    lines = output.splitlines(keepends=True)
+    frontiers = [line for line in lines if line.startswith('[')]
+    summary = [line for line in lines if not line.startswith('[')]
+    expected = []
+    if printevery > 0:
+        expected.extend(frontiers[::printevery])
+    if printsummary:
+        expected.extend(summary)
+    return ''.join(expected)
 
-def make_arg_obj(src):
+def make_arg_obj(src, hash_cons=False, lazy_match=False, decision_trees=False):
     return type('Args', (object,),
             {'src': src, 'dump_ast': False, 'debug_dump_ntgraph': False, 
-                'output_directory': RPYTHON_SOURCE_DIR, })
+                'output_directory': RPYTHON_SOURCE_DIR, 'hash_cons': hash_cons, 'lazy_match': lazy_match, 
+                'decision_trees': decision_trees, })
 
-def gentestcase(filename):
+def gentestcase(filename, inputfilename=None, outputfilename=None, programargs=(), expected=expected_output, **options):
     def testcase(self):
         print('\n')
-        print('------------------------------- Run {} ---------------'.format(filename))
-        entrypoint(make_arg_obj(filename))
-        exitcode = runpython('{}/out.py'.format(RPYTHON_SOURCE_DIR))
+        print('------------------------------- Run {} {} ---------------'.format(filename, options))
+        entrypoint(make_arg_obj(filename, **options))
+        if inputfilename is not None:
+            with open(inputfilename) as stdin:
+                exitcode, stdout = runpython('{}/out.py'.format(RPYTHON_SOURCE_DIR), stdin=stdin, programargs=programargs)
+        else:
+            exitcode, stdout = runpython('{}/out.py'.format(RPYTHON_SOURCE_DIR))
         self.assertEqual(exitcode, 0)
+        if outputfilename is not None:
+            with open(outputfilename) as f:
+                self.assertEqual(stdout, expected(f.read()))
+    return testcase
+
+def genrtypetestcase(filename, **options):
+    @unittest.skipIf(shutil.which('rpython') is None, 'rpython is not installed')
+    def testcase(self):
+        print('\n')
+        print('------------------------------- RType {} {} ---------------'.format(filename, options))
+        entrypoint(make_arg_obj(filename, **options))
+        rpython = subprocess.Popen(['rpython', '--batch', '--rtype', 'out.py'], cwd=RPYTHON_SOURCE_DIR, 
+                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        _, stderr = rpython.communicate(timeout=600)
+        self.assertEqual(rpython.returncode, 0, stderr.decode()[-2000:])
     return testcase
 
 class TestRuntimeCode(unittest.TestCase):
     @classmethod
     def tearDownClass(cls):
-        os.remove('{}/out.py'.format(RPYTHON_SOURCE_DIR))
-        os.rmdir(RPYTHON_SOURCE_DIR)
+        shutil.rmtree(RPYTHON_SOURCE_DIR)
+
+    def test_stdin_workers_failure(self):
+        entrypoint(make_arg_obj('tests/workersfailuretest.rkt'))
+        with open('tests/workersfailuretest.input') as stdin:
+            exitcode, stdout = runpython('{}/out.py'.format(RPYTHON_SOURCE_DIR), stdin=stdin, 
+                    programargs=('--workers', '2', '--min-frontier', '1'))
+        self.assertNotEqual(exitcode, 0)
+        self.assertIn('Exception: reduction worker', stdout)
+        self.assertIn('via rule "replace" is outside domain', stdout)
 
 for i, testcase in enumerate(testcases):
     setattr(TestRuntimeCode, 'test_{}'.format(i), gentestcase(testcase))
+    setattr(TestRuntimeCode, 'test_{}_hash_cons'.format(i), gentestcase(testcase, hash_cons=True))
+    setattr(TestRuntimeCode, 'test_{}_lazy_match'.format(i), gentestcase(testcase, lazy_match=True))
+    setattr(TestRuntimeCode, 'test_{}_decision_trees'.format(i), gentestcase(testcase, decision_trees=True))
+
+for i, (testcase, inputfile, outputfile) in enumerate(stdintestcases):
+    setattr(TestRuntimeCode, 'test_stdin_{}'.format(i), gentestcase(testcase, inputfile, outputfile))
+    setattr(TestRuntimeCode, 'test_stdin_{}_hash_cons'.format(i), gentestcase(testcase, inputfile, outputfile, hash_cons=True))
+    setattr(TestRuntimeCode, 'test_stdin_{}_workers'.format(i), gentestcase(testcase, inputfile, outputfile, 
+        programargs=('--workers', '2', '--min-frontier', '1')))
+    setattr(TestRuntimeCode, 'test_stdin_{}_workers3'.format(i), gentestcase(testcase, inputfile, outputfile, 
+        programargs=('--workers', '3', '--min-frontier', '5')))
+    setattr(TestRuntimeCode, 'test_stdin_{}_print_every'.format(i), gentestcase(testcase, inputfile, outputfile,
+        programargs=('--print-every', '2'), expected=lambda output: expected_output(output, printevery=2)))
+    setattr(TestRuntimeCode, 'test_stdin_{}_print_final'.format(i), gentestcase(testcase, inputfile, outputfile,
+        programargs=('--print', 'final'), expected=lambda output: expected_output(output, printevery=0)))
+    setattr(TestRuntimeCode, 'test_stdin_{}_print_none'.format(i), gentestcase(testcase, inputfile, outputfile,
+        programargs=('--print', 'none'), expected=lambda output: expected_output(output, printevery=0, printsummary=False)))
 
+for i, testcase in enumerate(rtypetestcases):
+    setattr(TestRuntimeCode, 'test_rtype_{}'.format(i), genrtypetestcase(testcase))
+    setattr(TestRuntimeCode, 'test_rtype_{}_hash_cons'.format(i), genrtypetestcase(testcase, hash_cons=True))
@@ -0,0 +1,163 @@
+# Tests of runtime term classes and MetafunctionCache. The runtime is RPython, thus these are run with python2.7.
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'runtime'))
+from term import Integer, Float, String, Boolean, Variable, Hole, Sequence, term_equals, intern_term, \
+                 MetafunctionCache
+
+def seq(*elems):
+    return Sequence(list(elems))
+
+def sample_terms():
+    return [
+        Integer(1),
+        Float(2.5),
+        String('hi'),
+        Boolean('#t'),
+        Variable('x'),
+        Hole(),
+        seq(),
+        seq(Integer(1), seq(Variable('x'), Hole()), String('hi')),
+        seq(seq(seq(Integer(1))), Float(0.5), Boolean('#f')),
+    ]
+
+class TestTermHash(unittest.TestCase):
+    def test_equal_terms_have_equal_hashes(self):
+        for t1, t2 in zip(sample_terms(), sample_terms()):
+            self.assertTrue(term_equals(t1, t2))
+            self.assertEqual(t1.hash(), t2.hash())
+
+    def test_floats_equal_within_tolerance_have_equal_hashes(self):
+        self.assertTrue(Float(1.0).equals(Float(1.0005)))
+        self.assertEqual(Float(1.0).hash(), Float(1.0005).hash())
+        t1 = seq(Integer(1), Float(1.0))
+        t2 = seq(Integer(1), Float(1.0005))
+        self.assertTrue(t1.equals(t2))
+        self.assertEqual(t1.hash(), t2.hash())
+
+    def test_hash_depends_on_kind_and_order(self):
+        self.assertNotEqual(Integer(1).hash(), seq(Integer(1)).hash())
+        self.assertNotEqual(seq(Integer(1), Integer(2)).hash(), seq(Integer(2), Integer(1)).hash())
+        self.assertNotEqual(String('x').hash(), Variable('x').hash())
+
+class TestTermSizeDepth(unittest.TestCase):
+    def test_atoms(self):
+        for t in [Integer(1), Float(2.5), String('hi'), Boolean('#t'), Variable('x'), Hole()]:
+            self.assertEqual(t.size(), 1)
+            self.assertEqual(t.depth(), 1)
+
+    def test_sequences(self):
+        t = seq(Integer(1), seq(Variable('x'), Hole()), String('hi'))
+        self.assertEqual(t.size(), 6)
+        self.assertEqual(t.depth(), 3)
+        self.assertEqual(seq().size(), 1)
+        self.assertEqual(seq().depth(), 1)
+
+    # terms built by appending elements one by one cache the same values as terms built at once.
+    def test_append(self):
+        expected = seq(Integer(1), seq(Variable('x'), seq(Hole())), Float(0.5))
+        t = seq()
+        inner = seq(Variable('x'))
+        inner.append(seq(Hole()))
+        t.append(Integer(1))
+        t.append(inner)
+        t.append(Float(0.5))
+        self.assertEqual(t.hash(), expected.hash())
+        self.assertEqual(t.size(), expected.size())
+        self.assertEqual(t.depth(), expected.depth())
+        self.assertEqual(t.size(), 7)
+        self.assertEqual(t.depth(), 4)
+
+    def test_append_resets_ntmembership(self):
+        t = seq(Integer(1))
+        t.addntmembership(1, True)
+        t.append(Integer(2))
+        self.assertEqual(t.ntmembership(1), -1)
+
+class TestTermEquals(unittest.TestCase):
+    # hash comparison in Sequence.equals only rejects terms that are not equal.
+    def test_equal_sequences_are_not_rejected(self):
+        for t1, t2 in zip(sample_terms(), sample_terms()):
+            self.assertTrue(t1.equals(t2))
+            self.assertTrue(term_equals(t2, t1))
+
+    def test_appended_sequences_are_not_rejected(self):
+        t1 = seq(Integer(1))
+        t1.append(seq(Float(2.0)))
+        t2 = seq(Integer(1), seq(Float(2.0004)))
+        self.assertTrue(t1.equals(t2))
+        self.assertTrue(t2.equals(t1))
+
+    def test_different_sequences(self):
+        self.assertFalse(seq(Integer(1), Integer(2)).equals(seq(Integer(2), Integer(1))))
+        self.assertFalse(seq(Integer(1)).equals(seq(Integer(1), Integer(1))))
+        self.assertFalse(seq(Float(1.0)).equals(seq(Float(1.5))))
+
+    def test_interned_sequences_with_floats(self):
+        t1 = intern_term(seq(Variable('y'), Float(3.0)))
+        t2 = intern_term(seq(Variable('y'), Float(3.0005)))
+        self.assertIsNot(t1, t2)
+        self.assertTrue(t1.equals(t2))
+
+def app(*args):
+    return seq(Variable('f'), *[Integer(arg) for arg in args])
+
+class TestMetafunctionCache(unittest.TestCase):
+    def test_get_put(self):
+        cache = MetafunctionCache(4)
+        self.assertIsNone(cache.get(app(1)))
+        result = Integer(10)
+        cache.put(app(1), result)
+        # keys are compared structurally.
+        self.assertIs(cache.get(app(1)), result)
+        self.assertIsNone(cache.get(app(2)))
+        self.assertEqual(cache.length(), 1)
+
+    def test_put_replaces_value(self):
+        cache = MetafunctionCache(4)
+        cache.put(app(1), Integer(10))
+        cache.put(app(1), Integer(11))
+        self.assertEqual(cache.length(), 1)
+        self.assertEqual(cache.get(app(1)).value(), 11)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = MetafunctionCache(2)
+        cache.put(app(1), Integer(1))
+        cache.put(app(2), Integer(2))
+        cache.put(app(3), Integer(3))
+        self.assertEqual(cache.length(), 2)
+        self.assertIsNone(cache.get(app(1)))
+        self.assertEqual(cache.get(app(2)).value(), 2)
+        self.assertEqual(cache.get(app(3)).value(), 3)
+
+    def test_hit_updates_recency(self):
+        cache = MetafunctionCache(2)
+        cache.put(app(1), Integer(1))
+        cache.put(app(2), Integer(2))
+        self.assertEqual(cache.get(app(1)).value(), 1)
+        cache.put(app(3), Integer(3))
+        self.assertIsNone(cache.get(app(2)))
+        self.assertEqual(cache.get(app(1)).value(), 1)
+        self.assertEqual(cache.get(app(3)).value(), 3)
+
+    def test_put_of_cached_key_updates_recency(self):
+        cache = MetafunctionCache(2)
+        cache.put(app(1), Integer(1))
+        cache.put(app(2), Integer(2))
+        cache.put(app(1), Integer(4))
+        cache.put(app(3), Integer(3))
+        self.assertIsNone(cache.get(app(2)))
+        self.assertEqual(cache.get(app(1)).value(), 4)
+
+    def test_capacity_one(self):
+        cache = MetafunctionCache(1)
+        for i in range(5):
+            cache.put(app(i), Integer(i))
+            self.assertEqual(cache.length(), 1)
+            self.assertEqual(cache.get(app(i)).value(), i)
+        self.assertIsNone(cache.get(app(3)))
+
+if __name__ == '__main__':
+    unittest.main()